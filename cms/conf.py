@@ -100,13 +100,76 @@ class Config:
         self.database = "postgresql+psycopg2://cmsuser@localhost/cms"
         self.database_debug = False
         self.twophase_commit = False
+        # Format in which to compress the files stored in the database
+        # (None means no compression; see cmscommon.compression).
+        self.storage_compression = None
+        # Whether services are told about new work (e.g., submissions)
+        # by the database itself (see cms.db.notifications).
+        self.db_notifications = False
 
         # Worker.
         self.keep_sandbox = True
         self.use_cgroups = True
         self.sandbox_implementation = 'isolate'
+        # Limits of the local file cache of each worker (None means
+        # unbounded), and how to choose the files to evict ("lru" or
+        # "lfu").
+        self.worker_cache_max_size_mib = None
+        self.worker_cache_max_files = None
+        self.worker_cache_eviction_policy = "lru"
+        # Whether workers take the files they miss from other workers
+        # before resorting to the database.
+        self.worker_peer_fetch = False
+        # Whether the workers on the same host share a single local
+        # file cache.
+        self.worker_shared_cache = False
+        # How many jobs of a group each worker runs in parallel, each
+        # in its own sandbox, and whether to pin each of them on its
+        # own share of the CPUs of the worker.
+        self.worker_slots = 1
+        self.worker_pin_cpus = False
+        # How long ES waits for a busy worker likely having the files
+        # needed by some operations before giving them to another.
+        self.worker_affinity_wait_s = 1.0
+        # How long ES wants each batch of operations sent to a worker
+        # to take.
+        self.worker_batch_wall_time_s = 10.0
+        # Whether workers send each result to ES as soon as it is
+        # ready, instead of with the rest of its batch.
+        self.worker_stream_results = False
+        # Whether ES skips the evaluations that cannot change the score
+        # of a submission (see ScoreType.get_irrelevant_testcases).
+        self.lazy_evaluation = False
+        # Whether workers reuse the outcome of identical compilations
+        # (see cms.grading.compilationcache).
+        self.compilation_cache = False
+        # Whether ES copies the evaluations of a submission on another
+        # dataset when they would give the same outcome (see
+        # cms.service.esoperations.reuse_evaluations).
+        self.evaluation_reuse = False
+        # How often ES looks for missing operations among all the
+        # submissions, instead of only the recent ones.
+        self.full_sweep_interval_s = 1800.0
+        # How often ES saves its queue, to resume it after a restart
+        # (None means never; see cms.service.queuesnapshot).
+        self.queue_snapshot_interval_s = None
+        # How the tasks are partitioned among the shards of ES ("task"
+        # or "contest"; see cms.service.espartition).
+        self.evaluation_partition = "task"
+        # How ES shares its turns among the operations of the same
+        # priority: by "participation" and/or "task" (empty for none;
+        # see cms.service.fairshare), and with which weights (e.g.,
+        # {"participation:12": 2.0}).
+        self.evaluation_fair_share = []
+        self.evaluation_fair_share_weights = {}
+        # How often the operations waiting in the queue of ES gain a
+        # level of priority (None means never; see
+        # cms.io.priorityqueue).
+        self.queue_aging_interval_s = None
 
         # Sandbox.
+        # How many boxes isolate allows (its num_boxes setting).
+        self.sandbox_num_boxes = 1000
         # Max size of each writable file during an evaluation step, in KiB.
         self.max_file_size = 1024 * 1024  # 1 GiB
         # Max processes, CPU time (s), memory (KiB) for compilation runs.
@@ -117,11 +180,20 @@ class Config:
         self.trusted_sandbox_max_processes = 1000
         self.trusted_sandbox_max_time_s = 10.0
         self.trusted_sandbox_max_memory_kib = 4 * 1024 * 1024  # 4 GiB
+        # Whether to materialize files from the storage in the sandbox
+        # by reflinking or hardlinking them from the local cache,
+        # instead of copying them.
+        self.sandbox_link_cached_files = False
 
         # WebServers.
         self.secret_key_default = "8e045a51e4b102ea803c06f92841a1fb"
         self.secret_key = self.secret_key_default
         self.tornado_debug = False
+        # Total size of the in-memory cache of the small files served
+        # by the web servers (None disables it), and the maximum size
+        # of the files it keeps.
+        self.web_memory_cache_size_mib = None
+        self.web_memory_cache_max_file_kib = 64
 
         # ContestWebServer.
         self.contest_listen_address = [""]
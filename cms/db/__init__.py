@@ -67,6 +67,10 @@ __all__ = [
     "UserTestExecutable",
     # printjob
     "PrintJob",
+    # compilationcache
+    "CompilationCacheEntry",
+    # notifications
+    "NotificationListener",
     # init
     "init_db",
     # drop
@@ -80,7 +84,7 @@ __all__ = [
 
 # Instantiate or import these objects.
 
-version = 39
+version = 43
 
 engine = create_engine(config.database, echo=config.database_debug,
                        pool_timeout=60, pool_recycle=120)
@@ -103,6 +107,8 @@ from .submission import Submission, File, Token, SubmissionResult, \
 from .usertest import UserTest, UserTestFile, UserTestManager, \
     UserTestResult, UserTestExecutable
 from .printjob import PrintJob
+from .compilationcache import CompilationCacheEntry
+from .notifications import NotificationListener
 
 from .init import init_db
 from .drop import drop_db
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compilation cache database interface for SQLAlchemy.
+
+"""
+
+from sqlalchemy import Boolean
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.orm import relationship
+from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy.types import Integer, String, DateTime
+
+from . import Base, Dataset
+
+
+class CompilationCacheEntry(Base):
+    """Class to store the outcome of a compilation, to be reused by
+    the compilations of the same sources in the same conditions (see
+    cms.grading.compilationcache).
+
+    """
+    __tablename__ = 'compilation_cache_entries'
+
+    # The key of the compilation, derived from everything the outcome
+    # of the compilation depends on.
+    key = Column(
+        String,
+        primary_key=True)
+
+    # Dataset (id and object) of the compilation that created the
+    # entry; the entry is dropped with the dataset, but can be used by
+    # the compilations against any dataset.
+    dataset_id = Column(
+        Integer,
+        ForeignKey(Dataset.id,
+                   onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False,
+        index=True)
+    dataset = relationship(
+        Dataset)
+
+    # Time of the compilation.
+    timestamp = Column(
+        DateTime,
+        nullable=False)
+
+    # The outcome of the compilation, as in CompilationJob.
+    compilation_success = Column(
+        Boolean,
+        nullable=False)
+    text = Column(
+        ARRAY(String),
+        nullable=False,
+        default=[])
+    plus = Column(
+        JSONB,
+        nullable=False,
+        default={})
+
+    # The executables produced, as a dict from filename to digest.
+    executables = Column(
+        JSONB,
+        nullable=False,
+        default={})
@@ -25,17 +25,26 @@
 """
 
 import atexit
+import fcntl
 import io
+import itertools
 import logging
 import os
 import tempfile
 from abc import ABCMeta, abstractmethod
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import partial
 
 import gevent
+import gevent.event
+import gevent.pool
 from sqlalchemy.exc import IntegrityError
 
 from cms import config, mkdir, rmtree
 from cms.db import SessionGen, Digest, FSObject, LargeObject
+from cmscommon.compression import COMPRESSION_FORMATS, CompressingWriter, \
+    open_decompressed
 from cmscommon.digest import Digester
 
 
@@ -80,6 +89,367 @@ class TombstoneError(RuntimeError):
     pass
 
 
+class CacheIndex:
+    """Bookkeeping of the files held in the local cache of a FileCacher.
+
+    The index remembers the size and the number of uses of each cached
+    file, in order of last use, and it is used to keep the cache within
+    an optional maximum total size and maximum number of files. When a
+    limit is exceeded, the least recently used files (or, with the LFU
+    policy, the least frequently used ones) are chosen for eviction.
+    Files can be pinned, for example while a job that needs them is
+    running, and pinned files are never chosen for eviction.
+
+    The index also counts hits, misses and evictions, to monitor the
+    effectiveness of the cache.
+
+    """
+
+    POLICY_LRU = "lru"
+    POLICY_LFU = "lfu"
+
+    def __init__(self, max_size=None, max_files=None, policy=None):
+        """Initialize the index.
+
+        max_size (int|None): the maximum total size of the cached
+            files, in bytes, or None for no limit.
+        max_files (int|None): the maximum number of cached files, or
+            None for no limit.
+        policy (str|None): the eviction policy, POLICY_LRU (default)
+            or POLICY_LFU.
+
+        raise (ValueError): if the policy is not known.
+
+        """
+        if policy is None:
+            policy = CacheIndex.POLICY_LRU
+        if policy not in (CacheIndex.POLICY_LRU, CacheIndex.POLICY_LFU):
+            raise ValueError("Unknown cache eviction policy `%s'." % policy)
+
+        self.max_size = max_size
+        self.max_files = max_files
+        self.policy = policy
+
+        # The cached files, from the least to the most recently used.
+        # Type: OrderedDict{str: [int, int]} (digest: [size, uses])
+        self._entries = OrderedDict()
+        # With the LFU policy, the cached files by number of uses, each
+        # group from the least to the most recently used.
+        # Type: {int: OrderedDict{str: None}}
+        self._by_uses = {}
+        # How many times each digest has been pinned (and not yet
+        # unpinned).
+        self._pins = Counter()
+
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, digest):
+        return digest in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def add(self, digest, size):
+        """Record that a file is now in the cache, and mark it as used.
+
+        digest (str): the digest of the file.
+        size (int): the size of the file, in bytes.
+
+        """
+        entry = self._entries.get(digest)
+        if entry is None:
+            self._entries[digest] = [size, 1]
+            self._add_to_uses(digest, 1)
+        else:
+            self.total_size -= entry[0]
+            entry[0] = size
+            self._use(digest, entry)
+        self.total_size += size
+
+    def touch(self, digest):
+        """Mark a file in the cache as used.
+
+        digest (str): the digest of the file.
+
+        return (bool): whether the file was known to the index.
+
+        """
+        entry = self._entries.get(digest)
+        if entry is None:
+            return False
+        self._use(digest, entry)
+        return True
+
+    def _use(self, digest, entry):
+        """Count a use of a file already in the index."""
+        self._remove_from_uses(digest, entry[1])
+        entry[1] += 1
+        self._add_to_uses(digest, entry[1])
+        self._entries.move_to_end(digest)
+
+    def _add_to_uses(self, digest, uses):
+        if self.policy == CacheIndex.POLICY_LFU:
+            self._by_uses.setdefault(uses, OrderedDict())[digest] = None
+
+    def _remove_from_uses(self, digest, uses):
+        if self.policy == CacheIndex.POLICY_LFU:
+            group = self._by_uses[uses]
+            del group[digest]
+            if len(group) == 0:
+                del self._by_uses[uses]
+
+    def remove(self, digest, evicted=False):
+        """Record that a file is not in the cache anymore.
+
+        digest (str): the digest of the file.
+        evicted (bool): whether the file was removed to respect the
+            limits (as opposed to being explicitly dropped).
+
+        """
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+        self._remove_from_uses(digest, entry[1])
+        self.total_size -= entry[0]
+        if evicted:
+            self.evictions += 1
+            self.evicted_size += entry[0]
+
+    def clear(self):
+        """Forget all the files in the cache (but not pins and stats)."""
+        self._entries.clear()
+        self._by_uses.clear()
+        self.total_size = 0
+
+    def pin(self, digest):
+        """Prevent a file from being evicted until unpinned.
+
+        Pins are counted: a file pinned twice needs to be unpinned
+        twice before it can be evicted again.
+
+        digest (str): the digest of the file.
+
+        """
+        self._pins[digest] += 1
+
+    def unpin(self, digest):
+        """Undo one previous call to pin.
+
+        digest (str): the digest of the file.
+
+        """
+        if self._pins[digest] <= 1:
+            del self._pins[digest]
+        else:
+            self._pins[digest] -= 1
+
+    def is_pinned(self, digest):
+        """Return whether a file is pinned."""
+        return self._pins[digest] > 0
+
+    def _over_limits(self, size, files):
+        return (self.max_size is not None and size > self.max_size) or \
+            (self.max_files is not None and files > self.max_files)
+
+    def victims(self):
+        """Return the files to evict to get back within the limits.
+
+        The files are not removed from the index: the caller is
+        expected to delete them and then call remove().
+
+        The candidates are visited from the least valuable one, and
+        only until the limits are met, so the cost is proportional to
+        the number of victims and of pinned files skipped (plus, with
+        the LFU policy, sorting the distinct numbers of uses).
+
+        return ([str]): the digests of the files to evict, possibly
+            fewer than needed if too many files are pinned.
+
+        """
+        size = self.total_size
+        files = len(self._entries)
+        if not self._over_limits(size, files):
+            return []
+
+        if self.policy == CacheIndex.POLICY_LFU:
+            # Ties are broken by recency.
+            candidates = itertools.chain.from_iterable(
+                self._by_uses[uses] for uses in sorted(self._by_uses))
+        else:
+            candidates = iter(self._entries)
+
+        victims = []
+        for digest in candidates:
+            if not self._over_limits(size, files):
+                break
+            if self.is_pinned(digest):
+                continue
+            victims.append(digest)
+            size -= self._entries[digest][0]
+            files -= 1
+        return victims
+
+    def get_status(self):
+        """Return the counters and the current occupation of the cache.
+
+        return (dict): the status of the cache.
+
+        """
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self._entries),
+            "size": self.total_size,
+            "max_files": self.max_files,
+            "max_size": self.max_size,
+            "policy": self.policy,
+            "pinned": len(self._pins),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else None,
+            "evictions": self.evictions,
+            "evicted_size": self.evicted_size,
+        }
+
+
+class MemoryCache:
+    """An in-memory cache of the content of small files.
+
+    It sits in front of the local cache of a FileCacher, to save the
+    file-system accesses for the small files that are requested very
+    often (statements, attachments, submissions shown by the web
+    servers). Only files up to a maximum size are kept, within a total
+    memory budget; when it is exceeded, the least recently used files
+    are dropped.
+
+    """
+
+    def __init__(self, max_size, max_file_size):
+        """Initialize.
+
+        max_size (int): the maximum total size of the contents kept,
+            in bytes.
+        max_file_size (int): the maximum size of a file to be kept,
+            in bytes.
+
+        """
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        # The contents, in order of last use.
+        # Type: {str: bytes}
+        self._contents = OrderedDict()
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, digest):
+        """Return the content of a file, if kept.
+
+        digest (str): the digest of the file.
+
+        return (bytes|None): the content, or None if not kept.
+
+        """
+        content = self._contents.get(digest)
+        if content is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._contents.move_to_end(digest)
+        return content
+
+    def get_size(self, digest):
+        """Return the size of a file, if kept.
+
+        Unlike get, this is not counted as a use of the file.
+
+        digest (str): the digest of the file.
+
+        return (int|None): the size, or None if not kept.
+
+        """
+        content = self._contents.get(digest)
+        return len(content) if content is not None else None
+
+    def put(self, digest, content):
+        """Keep the content of a file, if small enough.
+
+        digest (str): the digest of the file.
+        content (bytes): its content.
+
+        """
+        if len(content) > self.max_file_size or len(content) > self.max_size:
+            return
+        self.remove(digest)
+        self._contents[digest] = content
+        self.total_size += len(content)
+        while self.total_size > self.max_size:
+            _, evicted = self._contents.popitem(last=False)
+            self.total_size -= len(evicted)
+            self.evictions += 1
+
+    def remove(self, digest):
+        """Forget the content of a file, if kept.
+
+        digest (str): the digest of the file.
+
+        """
+        content = self._contents.pop(digest, None)
+        if content is not None:
+            self.total_size -= len(content)
+
+    def clear(self):
+        """Forget all the contents."""
+        self._contents.clear()
+        self.total_size = 0
+
+    def get_status(self):
+        """Return the counters and the current occupation of the cache.
+
+        return (dict): the status of the cache.
+
+        """
+        lookups = self.hits + self.misses
+        return {
+            "files": len(self._contents),
+            "size": self.total_size,
+            "max_size": self.max_size,
+            "max_file_size": self.max_file_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else None,
+            "evictions": self.evictions,
+        }
+
+
+def _get_uncompressed_size(fobj):
+    """Return the size of the content of a compressed file.
+
+    The content has to be decompressed, since the size is not stored.
+
+    fobj (fileobj): the decompressed content; it is closed afterwards.
+
+    return (int): the size of the content, in bytes.
+
+    """
+    size = 0
+    with fobj:
+        while True:
+            buf = fobj.read(io.DEFAULT_BUFFER_SIZE * 8)
+            if len(buf) == 0:
+                break
+            size += len(buf)
+            gevent.sleep(0)
+    return size
+
+
 class FileCacherBackend(metaclass=ABCMeta):
     """Abstract base class for all FileCacher backends.
 
@@ -98,14 +468,38 @@ class FileCacherBackend(metaclass=ABCMeta):
         """
         pass
 
+    def get_files(self, digests):
+        """Prepare the retrieval of many files from the storage.
+
+        Backends can override this to look up all the files at once
+        (for example, with a single query), instead of one at a time
+        in get_file(). The contents are still read by the returned
+        functions, one file at a time.
+
+        digests ([unicode]): the digests of the files to retrieve.
+
+        return ({unicode: function}): for each digest, a function
+            taking no arguments and returning a readable binary
+            file-like object, as get_file() does; digests that cannot
+            be found are either omitted, or their function raises
+            KeyError.
+
+        """
+        return dict((digest, partial(self.get_file, digest))
+                    for digest in digests)
+
     @abstractmethod
     def create_file(self, digest):
         """Create an empty file that will live in the storage.
 
         Once the caller has written the contents to the file, the commit_file()
-        method must be called to commit it into the store.
+        method must be called to commit it into the store (or discard_file()
+        to give up).
 
-        digest (unicode): the digest of the file to store.
+        digest (unicode|None): the digest of the file to store, or None if
+            it is not known yet (as when the file is being hashed while it
+            is written); in the latter case the file is always created, and
+            duplicates are detected by commit_file().
 
         return (fileobj): a writable binary file-like object on which
             to write the contents of the file, or None if the file is
@@ -135,6 +529,14 @@ class FileCacherBackend(metaclass=ABCMeta):
         """
         pass
 
+    def discard_file(self, fobj):
+        """Discard a file created by create_file() without storing it.
+
+        fobj (fileobj): the object returned by create_file().
+
+        """
+        fobj.close()
+
     @abstractmethod
     def describe(self, digest):
         """Return the description of a file given its digest.
@@ -175,7 +577,10 @@ class FileCacherBackend(metaclass=ABCMeta):
     def list(self):
         """List the files available in the storage.
 
-        return ([(unicode, unicode)]): a list of pairs, each
+        The files are produced while scanning the storage, so that
+        very large storages can be listed in constant memory.
+
+        return (iterable of (unicode, unicode)): pairs, each
             representing a file in the form (digest, description).
 
         """
@@ -188,22 +593,33 @@ class FSBackend(FileCacherBackend):
     course this directory can be shared, for example with NFS, acting
     as an actual remote file storage.
 
+    To keep directories small, files are spread in two levels of
+    subdirectories named after the first four characters of their
+    digest (e.g., 'ROOT/ab/cd/abcdef...'). Files stored directly in
+    the root, as older versions did, are still found, and can be moved
+    into place with migrate_layout() (see cmsMigrateFSStorage).
+
+    If the backend compresses the files it stores, their names have
+    the compression format as extension (e.g., 'ROOT/ab/cd/abcd...zlib');
+    files without extension are not compressed.
+
     TODO: Actually store the descriptions, that get discarded at the
     moment.
 
-    TODO: Use an additional level of directories, to alleviate the
-    work of the file system driver (e.g., 'ROOT/a/abcdef...' instead
-    of 'ROOT/abcdef...'.
-
     """
 
-    def __init__(self, path):
+    def __init__(self, path, compression=None):
         """Initialize the backend.
 
         path (string): the base path for the storage.
+        compression (str|None): the format in which to compress the
+            new files (see cmscommon.compression), or None to store
+            them as they are. Files already stored are read in any
+            case.
 
         """
         self.path = path
+        self.compression = compression
 
         # Create the directory if it doesn't exist
         try:
@@ -211,16 +627,65 @@ class FSBackend(FileCacherBackend):
         except OSError:
             pass
 
+    def _find(self, digest):
+        """Return where and how a file is stored.
+
+        digest (unicode): the digest of the file.
+
+        return ((string, str|None)): the path of the file and its
+            compression format.
+
+        raise (KeyError): if the file cannot be found.
+
+        """
+        for file_path in (self._get_path(digest),
+                          os.path.join(self.path, digest)):
+            if os.path.exists(file_path):
+                return file_path, None
+            for compression in COMPRESSION_FORMATS:
+                if os.path.exists("%s.%s" % (file_path, compression)):
+                    return "%s.%s" % (file_path, compression), compression
+        raise KeyError("File not found.")
+
+    def _get_path(self, digest):
+        """Return the path of an uncompressed file in the layout.
+
+        digest (unicode): the digest of the file.
+
+        return (string): the path, in its subdirectories.
+
+        """
+        return os.path.join(self.path, digest[:2], digest[2:4], digest)
+
+    def _place(self, src_path, digest, compression):
+        """Move a file to its place in the layout.
+
+        src_path (string): the current path of the file.
+        digest (unicode): its digest.
+        compression (str|None): its compression format.
+
+        """
+        file_path = self._get_path(digest)
+        if compression is not None:
+            file_path = "%s.%s" % (file_path, compression)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.rename(src_path, file_path)
+
+    @staticmethod
+    def _parse_name(name):
+        """Return the digest of the file with the given name."""
+        for compression in COMPRESSION_FORMATS:
+            if name.endswith(".%s" % compression):
+                return name[:-len(compression) - 1]
+        return name
+
     def get_file(self, digest):
         """See FileCacherBackend.get_file().
 
         """
-        file_path = os.path.join(self.path, digest)
+        file_path, compression = self._find(digest)
 
-        if not os.path.exists(file_path):
-            raise KeyError("File not found.")
-
-        return open(file_path, 'rb')
+        return open_decompressed(open(file_path, 'rb'), compression)
 
     def create_file(self, digest):
         """See FileCacherBackend.create_file().
@@ -228,16 +693,21 @@ class FSBackend(FileCacherBackend):
         """
         # Check if the file already exists. Return None if so, to inform the
         # caller they don't need to store the file.
-        file_path = os.path.join(self.path, digest)
-
-        if os.path.exists(file_path):
-            return None
+        if digest is not None:
+            try:
+                self._find(digest)
+            except KeyError:
+                pass
+            else:
+                return None
 
         # Create a temporary file in the same directory
         temp_file = tempfile.NamedTemporaryFile('wb', delete=False,
                                                 prefix=".tmp.",
-                                                suffix=digest,
+                                                suffix=digest or "",
                                                 dir=self.path)
+        if self.compression is not None:
+            return CompressingWriter(temp_file, self.compression)
         return temp_file
 
     def commit_file(self, fobj, digest, desc=""):
@@ -245,29 +715,42 @@ class FSBackend(FileCacherBackend):
 
         """
         fobj.close()
+        if isinstance(fobj, CompressingWriter):
+            temp_path = fobj.fobj.name
+            compression = self.compression
+        else:
+            temp_path = fobj.name
+            compression = None
 
-        file_path = os.path.join(self.path, digest)
         # Move it into place in the cache. Skip if it already exists, and
         # delete the temporary file instead.
-        if not os.path.exists(file_path):
+        try:
+            self._find(digest)
+        except KeyError:
             # There is a race condition here if someone else puts the file here
             # between checking and renaming. Put it doesn't matter in practice,
             # because rename will replace the file anyway (which should be
             # identical).
-            os.rename(fobj.name, file_path)
+            self._place(temp_path, digest, compression)
             return True
         else:
-            os.unlink(fobj.name)
+            os.unlink(temp_path)
             return False
 
+    def discard_file(self, fobj):
+        """See FileCacherBackend.discard_file().
+
+        """
+        fobj.close()
+        if isinstance(fobj, CompressingWriter):
+            fobj = fobj.fobj
+        os.unlink(fobj.name)
+
     def describe(self, digest):
         """See FileCacherBackend.describe().
 
         """
-        file_path = os.path.join(self.path, digest)
-
-        if not os.path.exists(file_path):
-            raise KeyError("File not found.")
+        self._find(digest)
 
         return ""
 
@@ -275,29 +758,63 @@ class FSBackend(FileCacherBackend):
         """See FileCacherBackend.get_size().
 
         """
-        file_path = os.path.join(self.path, digest)
-
-        if not os.path.exists(file_path):
-            raise KeyError("File not found.")
+        file_path, compression = self._find(digest)
 
-        return os.stat(file_path).st_size
+        if compression is None:
+            return os.stat(file_path).st_size
+        return _get_uncompressed_size(self.get_file(digest))
 
     def delete(self, digest):
         """See FileCacherBackend.delete().
 
         """
-        file_path = os.path.join(self.path, digest)
-
         try:
+            file_path, _ = self._find(digest)
             os.unlink(file_path)
-        except OSError:
+        except (KeyError, OSError):
             pass
 
     def list(self):
         """See FileCacherBackend.list().
 
         """
-        return list((x, "") for x in os.listdir(self.path))
+        # Temporary files (.tmp.*) are not stored files yet.
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if not entry.is_dir(follow_symlinks=False):
+                    # A file in the old, flat, layout.
+                    yield self._parse_name(entry.name), ""
+                    continue
+                with os.scandir(entry.path) as subdirs:
+                    for subdir in subdirs:
+                        with os.scandir(subdir.path) as files:
+                            for file_ in files:
+                                yield self._parse_name(file_.name), ""
+
+    def migrate_layout(self):
+        """Move the files stored in the old, flat, layout into their
+        subdirectories.
+
+        return (int): the number of files moved.
+
+        """
+        moved = 0
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") \
+                        or entry.is_dir(follow_symlinks=False):
+                    continue
+                digest = self._parse_name(entry.name)
+                compression = None
+                if digest != entry.name:
+                    compression = entry.name[len(digest) + 1:]
+                self._place(entry.path, digest, compression)
+                moved += 1
+                if moved % 1000 == 0:
+                    logger.info("%d files moved.", moved)
+        return moved
 
 
 class DBBackend(FileCacherBackend):
@@ -307,6 +824,32 @@ class DBBackend(FileCacherBackend):
 
     """
 
+    # How many rows list() fetches from the database at once.
+    LIST_BATCH_SIZE = 1000
+
+    def __init__(self, compression=None):
+        """Initialize the backend.
+
+        compression (str|None): the format in which to compress the
+            new files (see cmscommon.compression), or None to store
+            them as they are. Files already stored are read in any
+            case, according to their FSObject.
+
+        """
+        self.compression = compression
+
+    def _new_lobject(self):
+        """Return a new large object to write a file into."""
+        lobj = LargeObject(0, mode='wb')
+        if self.compression is not None:
+            return CompressingWriter(lobj, self.compression)
+        return lobj
+
+    @staticmethod
+    def _open_lobject(loid, compression):
+        """Return the content of a large object, decompressed."""
+        return open_decompressed(LargeObject(loid, mode='rb'), compression)
+
     def get_file(self, digest):
         """See FileCacherBackend.get_file().
 
@@ -317,12 +860,33 @@ class DBBackend(FileCacherBackend):
             if fso is None:
                 raise KeyError("File not found.")
 
-            return fso.get_lobject(mode='rb')
+            return fso.open_content()
+
+    def get_files(self, digests):
+        """See FileCacherBackend.get_files().
+
+        The large objects are looked up with a single query, but each
+        of them is then read over its own connection (see LargeObject),
+        so the number of connections open at the same time is bounded
+        by how many files the caller reads at once, not by the number
+        of digests.
+
+        """
+        with SessionGen() as session:
+            loids = session.query(
+                FSObject.digest, FSObject.loid, FSObject.compression)\
+                .filter(FSObject.digest.in_(digests)).all()
+
+        return dict((digest, partial(self._open_lobject, loid, compression))
+                    for digest, loid, compression in loids)
 
     def create_file(self, digest):
         """See FileCacherBackend.create_file().
 
         """
+        if digest is None:
+            return self._new_lobject()
+
         with SessionGen() as session:
             fso = FSObject.get_from_digest(digest, session)
 
@@ -338,18 +902,34 @@ class DBBackend(FileCacherBackend):
             else:
                 # Create the large object first. This should be populated
                 # and committed before putting it into the FSObjects table.
-                return LargeObject(0, mode='wb')
+                return self._new_lobject()
 
     def commit_file(self, fobj, digest, desc=""):
         """See FileCacherBackend.commit_file().
 
         """
         fobj.close()
+        compression = None
+        size = None
+        if isinstance(fobj, CompressingWriter):
+            compression = self.compression
+            size = fobj.size
+            fobj = fobj.fobj
         try:
             with SessionGen() as session:
+                # The file may have been created without knowing its
+                # digest, so it may be a duplicate.
+                if FSObject.get_from_digest(digest, session) is not None:
+                    LargeObject.unlink(fobj.loid)
+                    logger.debug("File %s already stored on database, "
+                                 "discarding the new copy.", digest)
+                    return False
+
                 fso = FSObject(description=desc)
                 fso.digest = digest
                 fso.loid = fobj.loid
+                fso.compression = compression
+                fso.size = size
 
                 session.add(fso)
 
@@ -367,6 +947,15 @@ class DBBackend(FileCacherBackend):
             return False
         return True
 
+    def discard_file(self, fobj):
+        """See FileCacherBackend.discard_file().
+
+        """
+        fobj.close()
+        if isinstance(fobj, CompressingWriter):
+            fobj = fobj.fobj
+        LargeObject.unlink(fobj.loid)
+
     def describe(self, digest):
         """See FileCacherBackend.describe().
 
@@ -391,6 +980,10 @@ class DBBackend(FileCacherBackend):
             if fso is None:
                 raise KeyError("File not found.")
 
+            if fso.size is not None:
+                return fso.size
+            if fso.compression is not None:
+                return _get_uncompressed_size(fso.open_content())
             with fso.get_lobject(mode='rb') as lobj:
                 return lobj.seek(0, io.SEEK_END)
 
@@ -423,14 +1016,18 @@ class DBBackend(FileCacherBackend):
             """Do the work assuming session is valid.
 
             """
-            return list((x.digest, x.description)
-                        for x in session.query(FSObject))
+            # Use a server-side cursor, not to load all rows at once.
+            query = session.query(FSObject.digest, FSObject.description)\
+                .execution_options(stream_results=True)\
+                .yield_per(self.LIST_BATCH_SIZE)
+            for digest, description in query:
+                yield digest, description
 
         if session is not None:
-            return _list(session)
+            yield from _list(session)
         else:
             with SessionGen() as session:
-                return _list(session)
+                yield from _list(session)
 
 
 class NullBackend(FileCacherBackend):
@@ -460,7 +1057,7 @@ class NullBackend(FileCacherBackend):
         pass
 
     def list(self):
-        return list()
+        return iter(())
 
 
 class FileCacher:
@@ -483,11 +1080,58 @@ class FileCacher:
     # CHUNK_SIZE should be a multiple of these values.
     CHUNK_SIZE = 16 * 1024  # 16 KiB
 
-    def __init__(self, service=None, path=None, null=False):
+    # Up to this size, put_file_from_fobj keeps the file in memory
+    # while hashing it, and sends it to the backend only if it is not
+    # already there.
+    PUT_BUFFER_SIZE = 1024 * 1024  # 1 MiB
+
+    # How many files load_many looks up in the backend at once, and how
+    # many it fetches at the same time by default.
+    LOAD_BATCH_SIZE = 100
+    LOAD_CONCURRENCY = 4
+
+    # The size of the reads of check_backend_integrity, which hashes
+    # each chunk in a thread.
+    CHECK_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+    # The outcomes of the check of a file in check_backend_integrity.
+    INTEGRITY_OK = "ok"
+    INTEGRITY_CORRUPTED = "corrupted"
+    INTEGRITY_MISSING = "missing"
+
+    # The default maximum size of the files kept in memory, when the
+    # memory cache is enabled.
+    MEMORY_CACHE_MAX_FILE_SIZE = 64 * 1024  # 64 KiB
+
+    # Seconds between attempts to take the lock to load a file into a
+    # shared cache, while another process holds it.
+    LOCK_POLL_INTERVAL = 0.1
+
+    # The permissions of the files in the local cache: they are never
+    # modified, and read-only files can be hardlinked as they are.
+    CACHE_FILE_MODE = 0o444
+
+    # The ways link_file_to_path can materialize a file.
+    LINK_REFLINK = "reflink"
+    LINK_HARDLINK = "hardlink"
+    LINK_COPY = "copy"
+
+    # The FICLONE ioctl of Linux (_IOW(0x94, 9, int)), which makes a
+    # file share the extents of another one, copy-on-write, on the
+    # filesystems that support it (e.g., btrfs, xfs).
+    _FICLONE = 0x40049409
+
+    def __init__(self, service=None, path=None, null=False,
+                 max_cache_size=None, max_cache_files=None,
+                 eviction_policy=None, peers=None, shared=False,
+                 compression=None, memory_cache_size=None,
+                 memory_cache_max_file_size=None):
         """Initialize.
 
         By default the database-powered backend will be used, but this
-        can be changed using the parameters.
+        can be changed using the parameters. Also by default the local
+        cache grows without limits, but it can be bounded in size and
+        number of files.
 
         service (Service|None): the service we are running for. Only
             used if present to determine the location of the
@@ -501,22 +1145,63 @@ class FileCacher:
         null (bool): if True, back the FileCacher with a NullBackend,
             that just discards every file it receives. This setting
             takes priority over path.
+        max_cache_size (int|None): if given, the maximum total size
+            in bytes of the files in the local cache.
+        max_cache_files (int|None): if given, the maximum number of
+            files in the local cache.
+        eviction_policy (str|None): how to choose the files to evict
+            when a limit is exceeded, see CacheIndex.
+        peers (object|None): if given, files missing from the cache
+            are first requested to it, and taken from the backend only
+            if it cannot provide them. It must have a method
+            get_file(digest) returning a readable binary file-like
+            object or raising KeyError (see WorkerPeers); its content
+            is verified against the digest.
+        shared (bool): if True, use a file-system cache shared by all
+            the FileCachers on the host that have this option, instead
+            of one for each service. Files appear in the cache
+            atomically, so reading needs no locking; loading a file
+            takes a lock, so that only one process loads it. The
+            limits on the cache apply to the whole shared directory.
+        compression (str|None): the format in which the backend
+            compresses the new files it stores; if not given, the
+            storage_compression configuration is used. Digests are
+            always of the uncompressed content, and existing files are
+            read whatever their format.
+        memory_cache_size (int|None): if given, keep in memory the
+            content of the small files that are read, up to this total
+            size in bytes (see MemoryCache).
+        memory_cache_max_file_size (int|None): the maximum size in
+            bytes of the files kept in memory; by default,
+            MEMORY_CACHE_MAX_FILE_SIZE.
 
         """
         self.service = service
-
+        self.peers = peers
+        self.shared = shared
+        # The loads in progress, to make concurrent loads of the same
+        # file wait for the first one instead of repeating it.
+        # Type: {str: AsyncResult}
+        self._loading = {}
+
+        if compression is None:
+            compression = config.storage_compression
+        if compression is not None and compression not in COMPRESSION_FORMATS:
+            raise ValueError("Unknown compression format %r." % compression)
         if null:
             self.backend = NullBackend()
         elif path is None:
-            self.backend = DBBackend()
+            self.backend = DBBackend(compression)
         else:
-            self.backend = FSBackend(path)
+            self.backend = FSBackend(path, compression)
 
         # First we create the config directories.
         self._create_directory_or_die(config.temp_dir)
         self._create_directory_or_die(config.cache_dir)
 
-        if service is None:
+        if shared:
+            self.file_dir = os.path.join(config.cache_dir, "fs-cache-shared")
+        elif service is None:
             self.file_dir = tempfile.mkdtemp(dir=config.temp_dir)
             # Delete this directory on exit since it has a random name and
             # won't be used again.
@@ -534,6 +1219,26 @@ class FileCacher:
         # Just to make sure it was created.
         self._create_directory_or_die(self.file_dir)
 
+        # The lock files coordinating the loads into a shared cache.
+        self.lock_dir = os.path.join(self.file_dir, "_locks")
+        if shared:
+            self._create_directory_or_die(self.lock_dir)
+        # The descriptors of the pin files we hold a shared lock on,
+        # so that other processes sharing the cache don't evict the
+        # files we pinned.
+        self._pin_fds = {}
+
+        self.cache_index = CacheIndex(
+            max_cache_size, max_cache_files, eviction_policy)
+        self.memory_cache = None
+        if memory_cache_size is not None:
+            if memory_cache_max_file_size is None:
+                memory_cache_max_file_size = self.MEMORY_CACHE_MAX_FILE_SIZE
+            self.memory_cache = MemoryCache(
+                memory_cache_size, memory_cache_max_file_size)
+        self._index_existing_cache()
+        self._enforce_cache_limits()
+
     @staticmethod
     def _create_directory_or_die(directory):
         """Create directory and ensure it exists, or raise a RuntimeError."""
@@ -542,6 +1247,270 @@ class FileCacher:
             logger.error(msg)
             raise RuntimeError(msg)
 
+    def _index_existing_cache(self):
+        """Add to the cache index the files already in the cache.
+
+        The cache of a service survives restarts, so we need to know
+        about the files left by previous runs, in order of last access
+        as far as we can tell.
+
+        """
+        entries = []
+        for filename in os.listdir(self.file_dir):
+            # Skip the temporary directories and files.
+            if filename.startswith(("_", ".")):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.file_dir, filename))
+            except OSError:
+                continue
+            entries.append((stat.st_atime, filename, stat.st_size))
+        for _, digest, size in sorted(entries):
+            self.cache_index.add(digest, size)
+
+    def _cache_file_added(self, digest):
+        """Record that a file was put in the cache, and evict others
+        if the cache is now above its limits.
+
+        digest (str): the digest of the file just cached.
+
+        """
+        cache_file_path = os.path.join(self.file_dir, digest)
+        self.cache_index.add(digest, os.stat(cache_file_path).st_size)
+        # The file we just added must survive, even if it alone does
+        # not fit within the limits, as the caller is about to use it.
+        self.cache_index.pin(digest)
+        try:
+            self._enforce_cache_limits()
+        finally:
+            self.cache_index.unpin(digest)
+
+    def _enforce_cache_limits(self):
+        """Evict unpinned files until the cache is within its limits.
+
+        With a shared cache, the index is first brought in line with
+        the content of the directory, so that the limits count the
+        files of all the processes; the files pinned by other processes
+        are skipped, so the cache may stay above its limits until a
+        later eviction.
+
+        """
+        if self.shared and (self.cache_index.max_size is not None
+                            or self.cache_index.max_files is not None):
+            self._sync_shared_index()
+        for digest in self.cache_index.victims():
+            with self._eviction_lock(digest) as evictable:
+                if not evictable:
+                    logger.debug("Not evicting file %s from the cache, "
+                                 "pinned by another process.", digest)
+                    continue
+                logger.debug("Evicting file %s from the cache.", digest)
+                self._remove_cache_file(digest)
+                self.cache_index.remove(digest, evicted=True)
+
+    def _sync_shared_index(self):
+        """Make the index of a shared cache reflect its directory.
+
+        The files added by other processes are recorded as just used,
+        and those they evicted are forgotten.
+
+        """
+        present = {}
+        with os.scandir(self.file_dir) as entries:
+            for entry in entries:
+                # Skip the temporary directories and files.
+                if entry.name.startswith(("_", ".")):
+                    continue
+                try:
+                    present[entry.name] = entry.stat().st_size
+                except OSError:
+                    continue
+        for digest in self.cache_index:
+            if digest not in present:
+                self.cache_index.remove(digest)
+        for digest, size in present.items():
+            if digest not in self.cache_index:
+                self.cache_index.add(digest, size)
+
+    def _remove_cache_file(self, digest):
+        """Delete a file from the cache directory, if there.
+
+        digest (unicode): the digest of the file.
+
+        """
+        paths = [os.path.join(self.file_dir, digest)]
+        if self.shared:
+            # Removing a lock file while some other process holds the
+            # lock could only cause a file to be loaded twice.
+            paths.append(os.path.join(self.lock_dir, digest))
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    @contextmanager
+    def _host_lock(self, digest):
+        """Hold the lock for loading a file into a shared cache.
+
+        Other processes sharing the cache wait for the lock before
+        loading the same file. With a non-shared cache, do nothing.
+
+        digest (unicode): the digest of the file.
+
+        yield (bool): whether we had to wait for another process.
+
+        """
+        if not self.shared:
+            yield False
+            return
+
+        fd = os.open(os.path.join(self.lock_dir, digest),
+                     os.O_CREAT | os.O_RDWR, 0o660)
+        try:
+            waited = False
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Don't block the other greenlets.
+                    waited = True
+                    gevent.sleep(self.LOCK_POLL_INTERVAL)
+                else:
+                    break
+            try:
+                yield waited
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def _pin_file_path(self, digest):
+        """Return the path of the pin file of a digest.
+
+        In a shared cache, each process pinning a file holds a shared
+        lock on its pin file, and a process must get an exclusive lock
+        on it to evict the file.
+
+        digest (unicode): the digest of the file.
+
+        return (str): the path of the pin file.
+
+        """
+        return os.path.join(self.lock_dir, "%s.pin" % digest)
+
+    def _lock_pin_file(self, digest):
+        """Take a shared lock on the pin file of a digest.
+
+        digest (unicode): the digest of the file.
+
+        return (int): the descriptor of the pin file; closing it
+            releases the lock.
+
+        """
+        path = self._pin_file_path(digest)
+        while True:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o660)
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Someone is evicting the file, which takes little.
+                    gevent.sleep(self.LOCK_POLL_INTERVAL)
+                else:
+                    break
+            # An evicting process unlinks the pin file before releasing
+            # its lock: if so, our lock protects nothing and we retry
+            # with a new pin file.
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    @contextmanager
+    def _eviction_lock(self, digest):
+        """Hold the right to evict a file from the cache.
+
+        With a shared cache, this is the exclusive lock on the pin
+        file, which we cannot get if other processes pinned the file;
+        the pin file is removed together with the file. With a
+        non-shared cache, the local pins are all that counts.
+
+        digest (unicode): the digest of the file.
+
+        yield (bool): whether the file can be evicted.
+
+        """
+        if not self.shared:
+            yield True
+            return
+
+        path = self._pin_file_path(digest)
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o660)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        finally:
+            os.close(fd)
+
+    def pin(self, digests):
+        """Prevent files from being evicted from the local cache.
+
+        Pinning does not load the files; it just guarantees that they
+        won't be evicted if they are (or will be) in the cache, until
+        they are unpinned. Pins are counted, so each call must be
+        matched by a call to unpin with the same digests. With a
+        shared cache, the pins hold also against the other processes.
+
+        digests ([str]): the digests of the files to pin.
+
+        """
+        for digest in digests:
+            self.cache_index.pin(digest)
+            if self.shared and digest not in self._pin_fds:
+                fd = self._lock_pin_file(digest)
+                # Another greenlet may have locked it in the meantime.
+                if self._pin_fds.setdefault(digest, fd) != fd:
+                    os.close(fd)
+
+    def unpin(self, digests):
+        """Allow again files pinned with pin to be evicted.
+
+        digests ([str]): the digests of the files to unpin.
+
+        """
+        for digest in digests:
+            self.cache_index.unpin(digest)
+            if digest in self._pin_fds \
+                    and not self.cache_index.is_pinned(digest):
+                os.close(self._pin_fds.pop(digest))
+        self._enforce_cache_limits()
+
+    def get_cache_status(self):
+        """Return statistics about the local cache.
+
+        return (dict): see CacheIndex.get_status; if the memory cache
+            is enabled, its statistics (see MemoryCache.get_status) are
+            under the "memory" key.
+
+        """
+        status = self.cache_index.get_status()
+        if self.memory_cache is not None:
+            status["memory"] = self.memory_cache.get_status()
+        return status
+
     def load(self, digest, if_needed=False):
         """Load the file with the given digest into the cache.
 
@@ -560,24 +1529,184 @@ class FileCacher:
             raise TombstoneError()
         cache_file_path = os.path.join(self.file_dir, digest)
         if if_needed and os.path.exists(cache_file_path):
+            if not self.cache_index.touch(digest):
+                self._cache_file_added(digest)
             return
 
+        self._load(digest, partial(self.backend.get_file, digest))
+
+    def _load(self, digest, open_fobj):
+        """Load a file into the cache, from the peers if possible.
+
+        If the same file is already being loaded (by this FileCacher
+        or, with a shared cache, by another process), wait for that
+        load to finish instead of starting another one.
+
+        digest (unicode): the digest of the file.
+        open_fobj (function): a function returning a readable binary
+            file-like object with the content of the file, from the
+            backend.
+
+        raise (KeyError): if the backend cannot find the file.
+
+        """
+        loading = self._loading.get(digest)
+        if loading is not None:
+            loading.get()
+            return
+
+        loading = gevent.event.AsyncResult()
+        self._loading[digest] = loading
+        try:
+            with self._host_lock(digest) as waited:
+                if waited and os.path.exists(
+                        os.path.join(self.file_dir, digest)):
+                    # Another process loaded it in the meantime.
+                    self._cache_file_added(digest)
+                else:
+                    self._load_unlocked(digest, open_fobj)
+        except Exception as error:
+            loading.set_exception(error)
+            raise
+        else:
+            loading.set()
+        finally:
+            del self._loading[digest]
+
+    def _load_unlocked(self, digest, open_fobj):
+        """Load a file into the cache, from the peers if possible.
+
+        See _load, which takes care of concurrent loads.
+
+        """
+        if self.peers is not None:
+            try:
+                self._load_from(digest, partial(self.peers.get_file, digest),
+                                verify=True)
+            except (KeyError, OSError) as error:
+                logger.debug("Cannot load file %s from peers: %s.",
+                             digest, error)
+            else:
+                return
+        self._load_from(digest, open_fobj)
+
+    def _load_from(self, digest, open_fobj, verify=False):
+        """Copy a file provided by the backend into the cache.
+
+        digest (unicode): the digest of the file.
+        open_fobj (function): a function returning a readable binary
+            file-like object with the content of the file.
+        verify (bool): whether to check the content against the
+            digest before putting it in the cache.
+
+        raise (KeyError): if the backend cannot find the file.
+        raise (OSError): if the content does not match the digest.
+
+        """
+        cache_file_path = os.path.join(self.file_dir, digest)
         ftmp_handle, temp_file_path = tempfile.mkstemp(dir=self.temp_dir,
                                                        text=False)
-        with open(ftmp_handle, 'wb') as ftmp, \
-                self.backend.get_file(digest) as fobj:
-            copyfileobj(fobj, ftmp, self.CHUNK_SIZE)
+        try:
+            with open(ftmp_handle, 'wb') as ftmp, open_fobj() as fobj:
+                if not verify:
+                    copyfileobj(fobj, ftmp, self.CHUNK_SIZE)
+                else:
+                    d = Digester()
+                    buf = fobj.read(self.CHUNK_SIZE)
+                    while len(buf) > 0:
+                        d.update(buf)
+                        ftmp.write(buf)
+                        # Cooperative yield.
+                        gevent.sleep(0)
+                        buf = fobj.read(self.CHUNK_SIZE)
+                    if d.digest() != digest:
+                        raise OSError("Content does not match digest %s."
+                                      % digest)
+        except Exception:
+            os.unlink(temp_file_path)
+            raise
 
         # Then move it to its real location (this operation is atomic
         # by POSIX requirement)
+        os.chmod(temp_file_path, self.CACHE_FILE_MODE)
         os.rename(temp_file_path, cache_file_path)
+        self._cache_file_added(digest)
+
+    def load_many(self, digests, concurrency=None, progress_callback=None):
+        """Load many files into the cache, if not already there.
+
+        The files are looked up in the backend in batches, and fetched
+        with a bounded number of concurrent transfers (with the database
+        backend, each transfer uses its own connection). They are loaded
+        in the given order, so callers should put first the files that
+        are going to be needed first.
+
+        digests ([unicode]): the digests of the files to load.
+        concurrency (int|None): the maximum number of files fetched at
+            the same time (LOAD_CONCURRENCY if not given).
+        progress_callback (function|None): if given, called with the
+            number of files processed so far and the total number of
+            files, each time a file is processed.
+
+        return ({unicode}): the digests of the files that could not be
+            loaded.
+
+        """
+        if concurrency is None:
+            concurrency = FileCacher.LOAD_CONCURRENCY
+        digests = [digest for digest in digests
+                   if digest != Digest.TOMBSTONE]
+        total = len(digests)
+        missing = set()
+        progress = {"done": 0}
+
+        def done(digest, success):
+            if not success:
+                missing.add(digest)
+            progress["done"] += 1
+            if progress_callback is not None:
+                progress_callback(progress["done"], total)
+
+        def fetch(digest, open_fobj):
+            try:
+                self._load(digest, open_fobj)
+            except (KeyError, OSError) as error:
+                logger.warning("Cannot load file %s: %r.", digest, error)
+                done(digest, False)
+            else:
+                done(digest, True)
+
+        pool = gevent.pool.Pool(concurrency)
+        for start in range(0, total, FileCacher.LOAD_BATCH_SIZE):
+            batch = []
+            for digest in digests[start:start + FileCacher.LOAD_BATCH_SIZE]:
+                if os.path.exists(os.path.join(self.file_dir, digest)):
+                    if not self.cache_index.touch(digest):
+                        self._cache_file_added(digest)
+                    done(digest, True)
+                else:
+                    batch.append(digest)
+            if len(batch) == 0:
+                continue
+
+            openers = self.backend.get_files(batch)
+            for digest in batch:
+                if digest not in openers:
+                    done(digest, False)
+                else:
+                    # This blocks while the pool is full.
+                    pool.spawn(fetch, digest, openers[digest])
+        pool.join()
+
+        return missing
 
     def get_file(self, digest):
         """Retrieve a file from the storage.
 
         If it's available in the cache use that copy, without querying
         the backend. Otherwise ask the backend to provide it, and store
-        it in the cache for the benefit of future accesses.
+        it in the cache for the benefit of future accesses. Small files
+        are also kept in memory, if the memory cache is enabled.
 
         The file is returned as a file-object. Other interfaces are
         available as `get_file_content', `get_file_to_fobj' and `get_
@@ -594,11 +1723,18 @@ class FileCacher:
         """
         if digest == Digest.TOMBSTONE:
             raise TombstoneError()
+        if self.memory_cache is not None:
+            content = self.memory_cache.get(digest)
+            if content is not None:
+                return io.BytesIO(content)
         cache_file_path = os.path.join(self.file_dir, digest)
 
         logger.debug("Getting file %s.", digest)
 
-        if not os.path.exists(cache_file_path):
+        try:
+            fobj = open(cache_file_path, 'rb')
+        except FileNotFoundError:
+            self.cache_index.misses += 1
             logger.debug("File %s not in cache, downloading "
                          "from database.", digest)
 
@@ -606,7 +1742,20 @@ class FileCacher:
 
             logger.debug("File %s downloaded.", digest)
 
-        return open(cache_file_path, 'rb')
+            fobj = open(cache_file_path, 'rb')
+        else:
+            self.cache_index.hits += 1
+            if not self.cache_index.touch(digest):
+                # Someone else put the file in the cache behind our back.
+                self._cache_file_added(digest)
+
+        if self.memory_cache is not None and os.fstat(fobj.fileno()).st_size \
+                <= self.memory_cache.max_file_size:
+            with fobj:
+                content = fobj.read()
+            self.memory_cache.put(digest, content)
+            return io.BytesIO(content)
+        return fobj
 
     def get_file_content(self, digest):
         """Retrieve a file from the storage.
@@ -665,6 +1814,68 @@ class FileCacher:
             with open(dst_path, 'wb') as dst:
                 copyfileobj(src, dst, self.CHUNK_SIZE)
 
+    def link_file_to_path(self, digest, dst_path, hardlink_mode=None):
+        """Materialize a file of the storage at the given location,
+        avoiding copying its content if possible.
+
+        The file is first loaded in the local cache (as in `get_file'),
+        then the new file is created as a reflink of the cached one
+        (an independent copy-on-write clone) if the filesystem supports
+        it, otherwise as a hardlink to the cached file, if allowed and
+        if both are on the same filesystem, otherwise by copying.
+
+        A hardlink shares the inode, and thus content and permissions,
+        with the cached file: it is made only if the cached file already
+        has the requested permissions, and the caller must ensure that
+        neither the content nor the permissions are ever changed, or the
+        cache would be corrupted.
+
+        digest (unicode): the digest of the file to get.
+        dst_path (string): a location on the file-system where no file
+            exists yet.
+        hardlink_mode (int|None): the permission bits that a hardlinked
+            file must have (e.g., CACHE_FILE_MODE), or None if a
+            hardlink is not acceptable.
+
+        return (str): how the file was materialized, one of LINK_*.
+
+        raise (KeyError): if the file cannot be found.
+        raise (TombstoneError): if the digest is the tombstone.
+
+        """
+        if digest == Digest.TOMBSTONE:
+            raise TombstoneError()
+        cache_file_path = os.path.join(self.file_dir, digest)
+        # Keeping the cached file open makes the copy possible even if
+        # the file is evicted in the meantime.
+        with self.get_file(digest) as src:
+            with open(dst_path, 'xb') as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), self._FICLONE, src.fileno())
+                except OSError:
+                    pass
+                else:
+                    return self.LINK_REFLINK
+
+            try:
+                cache_file_mode = os.stat(cache_file_path).st_mode & 0o7777
+            except OSError:
+                cache_file_mode = None
+            if hardlink_mode is not None \
+                    and cache_file_mode == hardlink_mode:
+                os.unlink(dst_path)
+                try:
+                    os.link(cache_file_path, dst_path)
+                except OSError:
+                    # Typically, different filesystems (EXDEV).
+                    pass
+                else:
+                    return self.LINK_HARDLINK
+
+            with open(dst_path, 'wb') as dst:
+                copyfileobj(src, dst, self.CHUNK_SIZE)
+            return self.LINK_COPY
+
     def save(self, digest, desc=""):
         """Save the file with the given digest into the backend.
 
@@ -692,12 +1903,32 @@ class FileCacher:
 
         self.backend.commit_file(fobj, digest, desc)
 
+    @staticmethod
+    def _write_all(fobj, data):
+        """Write all data to a file-like object, cooperatively.
+
+        fobj (fileobj): a writable binary file-like object.
+        data (bytes): the data to write.
+
+        """
+        while len(data) > 0:
+            written = fobj.write(data)
+            # Cooperative yield.
+            gevent.sleep(0)
+            if written is None:
+                break
+            data = data[written:]
+
     def put_file_from_fobj(self, src, desc=""):
         """Store a file in the storage.
 
-        If it's already (for some reason...) in the cache send that
-        copy to the backend. Otherwise store it in the file-system
-        cache first.
+        The file is hashed while it is written to the file-system
+        cache; then, if the backend does not have it yet, it is sent
+        to the backend from memory (if small), or reading src again
+        (if seekable). Large files that cannot be read twice are
+        instead sent to the backend while hashing them, and the
+        backend copy is committed under the digest, or discarded if
+        the backend already had the file.
 
         The file is obtained from a file-object. Other interfaces are
         available as `put_file_content', `put_file_from_path'.
@@ -712,45 +1943,81 @@ class FileCacher:
         """
         logger.debug("Reading input file to store on the database.")
 
-        # Unfortunately, we have to read the whole file-obj to compute
-        # the digest but we take that chance to save it to a temporary
-        # path so that we then just need to move it. Hoping that both
-        # locations will be on the same filesystem, that should be way
-        # faster than reading the whole file-obj again (as it could be
-        # compressed or require network communication).
-        # XXX We're *almost* reimplementing copyfileobj.
-        with tempfile.NamedTemporaryFile('wb', delete=False,
-                                         dir=self.temp_dir) as dst:
-            d = Digester()
-            buf = src.read(self.CHUNK_SIZE)
-            while len(buf) > 0:
-                d.update(buf)
-                while len(buf) > 0:
-                    written = dst.write(buf)
-                    # Cooperative yield.
-                    gevent.sleep(0)
-                    if written is None:
-                        break
-                    buf = buf[written:]
+        try:
+            start = src.tell() if src.seekable() else None
+        except (AttributeError, OSError):
+            start = None
+
+        # We have to read the whole file-obj to compute the digest, so
+        # we take that chance to save it to a temporary path in the
+        # cache, so that we then just need to move it.
+        dst = tempfile.NamedTemporaryFile('wb', delete=False,
+                                          dir=self.temp_dir)
+        backend_fobj = None
+        try:
+            with dst:
+                d = Digester()
+                size = 0
+                # The content read so far, while it is small.
+                chunks = []
                 buf = src.read(self.CHUNK_SIZE)
-            digest = d.digest()
-            dst.flush()
+                while len(buf) > 0:
+                    d.update(buf)
+                    size += len(buf)
+                    self._write_all(dst, buf)
+                    if backend_fobj is not None:
+                        self._write_all(backend_fobj, buf)
+                    elif chunks is not None:
+                        chunks.append(buf)
+                        if size > self.PUT_BUFFER_SIZE:
+                            if start is None:
+                                # The file cannot be read again: send
+                                # it while hashing, and the backend
+                                # will drop it at commit if duplicate.
+                                backend_fobj = self.backend.create_file(None)
+                                if backend_fobj is not None:
+                                    for chunk in chunks:
+                                        self._write_all(backend_fobj, chunk)
+                            chunks = None
+                    buf = src.read(self.CHUNK_SIZE)
+                digest = d.digest()
 
             logger.debug("File has digest %s.", digest)
 
-            cache_file_path = os.path.join(self.file_dir, digest)
+            # Store the file in the backend. We do that even if the
+            # file was already in the cache because there's a (small)
+            # chance that the file got removed from the backend but
+            # somehow remained in the cache.
+            streamed = backend_fobj is not None
+            if not streamed:
+                backend_fobj = self.backend.create_file(digest)
+                if backend_fobj is not None:
+                    if chunks is not None:
+                        for chunk in chunks:
+                            self._write_all(backend_fobj, chunk)
+                    else:
+                        src.seek(start)
+                        copyfileobj(src, backend_fobj, self.CHUNK_SIZE)
+            if backend_fobj is not None:
+                # From now on, the backend owns the file.
+                fobj, backend_fobj = backend_fobj, None
+                stored = self.backend.commit_file(fobj, digest, desc)
+                if stored and streamed:
+                    logger.debug("File %s sent to the backend while "
+                                 "hashing it, saving a re-read of %d "
+                                 "bytes.", digest, size)
 
+            cache_file_path = os.path.join(self.file_dir, digest)
             if not os.path.exists(cache_file_path):
+                os.chmod(dst.name, self.CACHE_FILE_MODE)
                 os.rename(dst.name, cache_file_path)
-            else:
+            self._cache_file_added(digest)
+        finally:
+            if backend_fobj is not None:
+                self.backend.discard_file(backend_fobj)
+            if os.path.exists(dst.name):
                 os.unlink(dst.name)
 
-        # Store the file in the backend. We do that even if the file
-        # was already in the cache (that is, we ignore the check above)
-        # because there's a (small) chance that the file got removed
-        # from the backend but somehow remained in the cache.
-        self.save(digest, desc)
-
         return digest
 
     def put_file_content(self, content, desc=""):
@@ -814,6 +2081,16 @@ class FileCacher:
         """
         if digest == Digest.TOMBSTONE:
             raise TombstoneError()
+        if self.memory_cache is not None:
+            size = self.memory_cache.get_size(digest)
+            if size is not None:
+                return size
+        # The backend may need to read the whole file to know its size,
+        # if compressed.
+        try:
+            return os.stat(os.path.join(self.file_dir, digest)).st_size
+        except FileNotFoundError:
+            pass
         return self.backend.get_size(digest)
 
     def delete(self, digest):
@@ -835,18 +2112,28 @@ class FileCacher:
         """
         if digest == Digest.TOMBSTONE:
             return
-        cache_file_path = os.path.join(self.file_dir, digest)
-
-        try:
-            os.unlink(cache_file_path)
-        except OSError:
-            pass
+        self._remove_cache_file(digest)
+        self.cache_index.remove(digest)
+        if self.memory_cache is not None:
+            self.memory_cache.remove(digest)
 
     def purge_cache(self):
         """Empty the local cache.
 
+        A shared cache is left alone, as the other processes using it
+        may be relying on its files; only the memory cache is emptied.
+
         """
+        if self.shared:
+            logger.warning("Not purging the shared cache in %s.",
+                           self.file_dir)
+            if self.memory_cache is not None:
+                self.memory_cache.clear()
+            return
         self.destroy_cache()
+        self.cache_index.clear()
+        if self.memory_cache is not None:
+            self.memory_cache.clear()
         if not mkdir(config.cache_dir) or not mkdir(self.file_dir):
             logger.error("Cannot create necessary directories.")
             raise RuntimeError("Cannot create necessary directories.")
@@ -863,13 +2150,15 @@ class FileCacher:
     def list(self):
         """List the files available in the storage.
 
-        return ([(unicode, unicode)]): a list of pairs, each
-            representing a file in the form (digest, description).
+        return (iterable of (unicode, unicode)): pairs, each
+            representing a file in the form (digest, description),
+            produced while scanning the storage.
 
         """
         return self.backend.list()
 
-    def check_backend_integrity(self, delete=False):
+    def check_backend_integrity(self, delete=False, digests=None,
+                                concurrency=1, skip=None, callback=None):
         """Check the integrity of the backend.
 
         Request all the files from the backend. For each of them the
@@ -880,23 +2169,80 @@ class FileCacher:
         severity. The method returns False if at least a mismatch is
         found, True otherwise.
 
+        Files are read concurrently, in greenlets, and hashed in
+        gevent's thread pool, so that large files can be hashed on
+        multiple cores at the same time.
+
         delete (bool): if True, files with wrong digest are deleted.
+        digests (iterable|None): if given, check only these files
+            (those missing from the backend are reported as such),
+            instead of all the files in the backend.
+        concurrency (int): how many files to check at the same time.
+        skip (set|None): if given, digests not to check (for example,
+            because they were checked by a previous run).
+        callback (function|None): if given, called after each file
+            with its digest and one of the INTEGRITY_* statuses.
+
+        return (bool): whether no problems were found.
 
         """
+        if digests is None:
+            digests = (digest for digest, _ in self.list())
         clean = True
-        for digest, _ in self.list():
-            d = Digester()
-            with self.backend.get_file(digest) as fobj:
-                buf = fobj.read(self.CHUNK_SIZE)
-                while len(buf) > 0:
-                    d.update(buf)
-                    buf = fobj.read(self.CHUNK_SIZE)
-            computed_digest = d.digest()
-            if digest != computed_digest:
-                logger.error("File with hash %s actually has hash %s",
-                             digest, computed_digest)
-                if delete:
-                    self.delete(digest)
+
+        def check(digest):
+            nonlocal clean
+            status = self._check_file(digest)
+            if status == self.INTEGRITY_CORRUPTED and delete:
+                self.delete(digest)
+            if status != self.INTEGRITY_OK:
                 clean = False
+            if callback is not None:
+                callback(digest, status)
+
+        pool = gevent.pool.Pool(concurrency)
+        for digest in digests:
+            if digest == Digest.TOMBSTONE \
+                    or (skip is not None and digest in skip):
+                continue
+            # This blocks while the pool is full, so that digests are
+            # consumed only as fast as they are checked.
+            pool.spawn(check, digest)
+        pool.join(raise_error=True)
 
         return clean
+
+    def _check_file(self, digest):
+        """Check a file in the backend against its digest.
+
+        digest (unicode): the digest of the file.
+
+        return (str): one of the INTEGRITY_* statuses.
+
+        """
+        try:
+            fobj = self.backend.get_file(digest)
+        except KeyError:
+            logger.error("File with hash %s is missing", digest)
+            return self.INTEGRITY_MISSING
+
+        d = Digester()
+        threadpool = gevent.get_hub().threadpool
+        try:
+            with fobj:
+                buf = fobj.read(self.CHECK_CHUNK_SIZE)
+                while len(buf) > 0:
+                    # hashlib releases the GIL while hashing.
+                    threadpool.apply(d.update, (buf,))
+                    buf = fobj.read(self.CHECK_CHUNK_SIZE)
+        except OSError as error:
+            logger.error("File with hash %s cannot be read: %s",
+                         digest, error)
+            return self.INTEGRITY_CORRUPTED
+
+        computed_digest = d.digest()
+        if digest != computed_digest:
+            logger.error("File with hash %s actually has hash %s",
+                         digest, computed_digest)
+            return self.INTEGRITY_CORRUPTED
+        return self.INTEGRITY_OK
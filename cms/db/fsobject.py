@@ -29,8 +29,9 @@ import psycopg2
 import psycopg2.extensions
 from sqlalchemy.dialects.postgresql import OID
 from sqlalchemy.schema import Column
-from sqlalchemy.types import String, Unicode
+from sqlalchemy.types import BigInteger, String, Unicode
 
+from cmscommon.compression import open_decompressed
 from . import Base, custom_psycopg2_connection
 
 
@@ -370,6 +371,20 @@ class FSObject(Base):
         Unicode,
         nullable=True)
 
+    # Format in which the content is compressed in the large object
+    # (see cmscommon.compression), or None if it is stored as is. The
+    # digest is always the one of the uncompressed content.
+    compression = Column(
+        Unicode,
+        nullable=True)
+
+    # Size of the uncompressed content of a compressed large object,
+    # which otherwise would need to be decompressed to find it out, or
+    # None if not compressed.
+    size = Column(
+        BigInteger,
+        nullable=True)
+
     def get_lobject(self, mode='rb'):
         """Return an open file bound to the represented large object.
 
@@ -391,6 +406,18 @@ class FSObject(Base):
         # FIXME Wrap with a io.BufferedReader/Writer/Random?
         return lobj
 
+    def open_content(self):
+        """Return an open file with the (uncompressed) content.
+
+        Unlike get_lobject, this takes care of decompressing the large
+        object if needed; the returned value is read-only.
+
+        return (fileobj): a readable binary file-like object.
+
+        """
+        return open_decompressed(self.get_lobject(mode='rb'),
+                                 self.compression)
+
     def delete(self):
         """Delete this file.
 
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Notifications sent by the database when there is new work to do.
+
+Triggers in the database send a notification (with PostgreSQL's
+NOTIFY) on some channels when submissions, user tests, tokens and
+submission results are created or change in a way that some service
+should act upon. The payload of each notification is the list of the
+ids of the object, separated by spaces. Services can receive them with
+a NotificationListener, as a faster (and cheaper) alternative to the
+RPCs and sweeps they otherwise rely on.
+
+"""
+
+import logging
+
+import gevent
+import gevent.socket
+from sqlalchemy import DDL, event
+
+from . import metadata, custom_psycopg2_connection
+
+
+logger = logging.getLogger(__name__)
+
+
+# A submission has been created; payload: its id.
+NEW_SUBMISSION = "cms_new_submission"
+# A user test has been created; payload: its id.
+NEW_USER_TEST = "cms_new_user_test"
+# A token has been played; payload: the id of its submission.
+NEW_TOKEN = "cms_new_token"
+# A submission result is ready to be scored; payload: the ids of its
+# submission and of its dataset.
+SUBMISSION_RESULT_TO_SCORE = "cms_submission_result_to_score"
+# A submission result has been scored; payload: the ids of its
+# submission and of its dataset.
+SUBMISSION_RESULT_SCORED = "cms_submission_result_scored"
+
+
+# For each channel: the table, the events and the condition (if any)
+# of its trigger, and the columns of the payload.
+TRIGGERS = [
+    (NEW_SUBMISSION, "submissions", "INSERT", None, ["id"]),
+    (NEW_USER_TEST, "user_tests", "INSERT", None, ["id"]),
+    (NEW_TOKEN, "tokens", "INSERT", None, ["submission_id"]),
+    (SUBMISSION_RESULT_TO_SCORE, "submission_results", "INSERT OR UPDATE",
+     "NEW.score IS NULL AND (NEW.compilation_outcome = 'fail' "
+     "OR NEW.evaluation_outcome IS NOT NULL)",
+     ["submission_id", "dataset_id"]),
+    (SUBMISSION_RESULT_SCORED, "submission_results", "UPDATE",
+     "OLD.score IS NULL AND NEW.score IS NOT NULL",
+     ["submission_id", "dataset_id"]),
+]
+
+
+def get_create_commands():
+    """Return the commands creating the triggers.
+
+    return ([DDL]): the commands, to run after the tables exist.
+
+    """
+    # The function takes the channel and the names of the columns of
+    # the payload as arguments of the trigger.
+    commands = [DDL(
+        "CREATE FUNCTION cms_notify() RETURNS trigger AS $$ "
+        "DECLARE "
+        "    payload text[] := '{}'; "
+        "BEGIN "
+        "    FOR i IN 1 .. TG_NARGS - 1 LOOP "
+        "        payload := payload || (to_json(NEW) ->> TG_ARGV[i]); "
+        "    END LOOP; "
+        "    PERFORM pg_notify(TG_ARGV[0], array_to_string(payload, ' ')); "
+        "    RETURN NULL; "
+        "END; "
+        "$$ LANGUAGE plpgsql")]
+    for channel, table, events, condition, columns in TRIGGERS:
+        commands.append(DDL(
+            "CREATE TRIGGER %(channel)s AFTER %(events)s ON %(table)s "
+            "FOR EACH ROW %(condition)s"
+            "EXECUTE PROCEDURE cms_notify(%(arguments)s)",
+            context={
+                "channel": channel,
+                "events": events,
+                "table": table,
+                "condition": "WHEN (%s) " % condition
+                             if condition is not None else "",
+                "arguments": ", ".join("'%s'" % argument
+                                       for argument in [channel] + columns),
+            }))
+    return commands
+
+
+for command in get_create_commands():
+    event.listen(metadata, "after_create", command)
+
+
+class NotificationListener:
+    """Receive the notifications sent by the database and call the
+    functions interested in them.
+
+    A dedicated connection to the database is kept open, listening on
+    the channels of interest, and is opened again if lost. Since the
+    notifications sent in the meantime are lost, the listener can be
+    told what to call to recover them (e.g., a sweep).
+
+    """
+
+    # Seconds to wait before connecting again.
+    RECONNECT_DELAY = 5.0
+
+    def __init__(self, callbacks, on_reconnect=None):
+        """Create a listener.
+
+        callbacks ({str: function}): for each channel, the function to
+            call (in a new greenlet) with the ids in the payload of
+            each notification, as integers.
+        on_reconnect (function|None): a function to call after the
+            connection has been lost and opened again.
+
+        """
+        self._callbacks = callbacks
+        self._on_reconnect = on_reconnect
+        self._greenlet = None
+
+    def start(self):
+        """Start listening in the background."""
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        """Listen forever, reconnecting as needed."""
+        first = True
+        while True:
+            try:
+                self._listen(first)
+            except Exception:
+                logger.error("Lost the connection for the notifications from "
+                             "the database.", exc_info=True)
+            first = False
+            gevent.sleep(self.RECONNECT_DELAY)
+
+    def _listen(self, first):
+        """Open a connection and dispatch its notifications.
+
+        first (bool): whether this is the first connection.
+
+        """
+        connection = custom_psycopg2_connection()
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                for channel in self._callbacks:
+                    cursor.execute("LISTEN %s;" % channel)
+            logger.info("Listening for notifications from the database.")
+            if not first and self._on_reconnect is not None:
+                self._on_reconnect()
+
+            while True:
+                gevent.socket.wait_read(connection.fileno())
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self._dispatch(notify.channel, notify.payload)
+        finally:
+            connection.close()
+
+    def _dispatch(self, channel, payload):
+        """Call the function for a notification.
+
+        channel (str): the channel of the notification.
+        payload (str): the ids, separated by spaces.
+
+        """
+        try:
+            ids = [int(id_) for id_ in payload.split()]
+        except ValueError:
+            logger.error("Invalid notification %r on channel %s.",
+                         payload, channel)
+            return
+        logger.debug("Notification %s on channel %s.", ids, channel)
+        gevent.spawn(self._call, channel, ids)
+
+    def _call(self, channel, ids):
+        """Call the function for a channel, logging its errors.
+
+        channel (str): the channel of the notification.
+        ids ([int]): the ids in the notification.
+
+        """
+        try:
+            self._callbacks[channel](*ids)
+        except Exception:
+            logger.error("Error while handling notification %s on channel "
+                         "%s.", ids, channel, exc_info=True)
@@ -746,6 +746,14 @@ class Evaluation(Base):
         Unicode,
         nullable=True)
 
+    # Whether the evaluation was copied from the one on another
+    # dataset with the same testcase and limits, instead of being
+    # performed (see cms.service.esoperations.reuse_evaluations).
+    reused = Column(
+        Boolean,
+        nullable=False,
+        default=False)
+
     @property
     def codename(self):
         """Return the codename of the testcase."""
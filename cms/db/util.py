@@ -32,7 +32,7 @@ from cms import ConfigError
 from . import SessionGen, Digest, Contest, Participation, Statement, \
     Attachment, Task, Manager, Dataset, Testcase, Submission, File, \
     SubmissionResult, Executable, UserTest, UserTestFile, UserTestManager, \
-    UserTestResult, UserTestExecutable, PrintJob
+    UserTestResult, UserTestExecutable, PrintJob, CompilationCacheEntry
 
 
 def test_db_connection():
@@ -329,5 +329,13 @@ def enumerate_files(
 
     # union(...).execute() would be executed outside of the session.
     digests = set(r[0] for r in session.execute(union(*queries)))
+
+    if not skip_generated:
+        # The executables in the compilation cache are in a JSON dict.
+        for executables, in dataset_q.join(
+                CompilationCacheEntry,
+                CompilationCacheEntry.dataset_id == Dataset.id)\
+                .with_entities(CompilationCacheEntry.executables):
+            digests.update(executables.values())
     digests.discard(Digest.TOMBSTONE)
     return digests
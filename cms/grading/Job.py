@@ -156,6 +156,18 @@ class Job:
             }
         return res
 
+    def get_digests(self):
+        """Return the digests of the files the job needs as input.
+
+        return ({str}): the digests of the files, managers and
+            executables of the job.
+
+        """
+        digests = set()
+        for files in (self.files, self.managers, self.executables):
+            digests.update(f.digest for f in files.values())
+        return digests
+
     @staticmethod
     def import_from_dict_with_type(data):
         """Create a Job from a dict having a type information.
@@ -492,6 +504,11 @@ class EvaluationJob(Job):
             })
         return res
 
+    def get_digests(self):
+        digests = Job.get_digests(self)
+        digests.update(d for d in (self.input, self.output) if d is not None)
+        return digests
+
     @staticmethod
     def from_submission(operation, submission, dataset):
         """Create an EvaluationJob from a submission.
@@ -559,6 +576,33 @@ class EvaluationJob(Job):
             evaluation_sandbox=":".join(self.sandboxes),
             testcase=sr.dataset.testcases[self.operation.testcase_codename])]
 
+    def to_evaluation_row(self, sr):
+        """Return the row of the evaluation table for the job result.
+
+        This is the same evaluation that to_submission adds, to be
+        inserted in bulk with the ones of other jobs.
+
+        sr (SubmissionResult): the DB object the evaluation belongs to.
+
+        return ({str: object}): the values of the columns of the row.
+
+        """
+        return {
+            "submission_id": sr.submission_id,
+            "dataset_id": sr.dataset_id,
+            "testcase_id":
+                sr.dataset.testcases[self.operation.testcase_codename].id,
+            "text": self.text,
+            "outcome": self.outcome,
+            "execution_time": self.plus.get('execution_time'),
+            "execution_wall_clock_time": self.plus.get(
+                'execution_wall_clock_time'),
+            "execution_memory": self.plus.get('execution_memory'),
+            "evaluation_shard": self.shard,
+            "evaluation_sandbox": ":".join(self.sandboxes),
+            "reused": False,
+        }
+
     @staticmethod
     def from_user_test(operation, user_test, dataset):
         """Create an EvaluationJob from a user test.
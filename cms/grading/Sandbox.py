@@ -27,9 +27,12 @@ import select
 import stat
 import tempfile
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 from functools import wraps, partial
+from shutil import copyfileobj
 
 import gevent
+import gevent.local
 from gevent import subprocess
 
 from cms import config, rmtree
@@ -60,6 +63,32 @@ def with_log(func):
     return newfunc
 
 
+# The slot of the Worker running a job in the current greenlet, as set
+# by use_slot; sandboxes take from it their box ids and CPUs.
+_slot = gevent.local.local()
+
+
+@contextmanager
+def use_slot(index, cpus=None):
+    """Make the sandboxes created in the current greenlet belong to a
+    slot of the Worker, that is, to one of the jobs it runs in
+    parallel.
+
+    index (int): the index of the slot, from 0 to the number of slots
+        of the Worker (config.worker_slots) excluded.
+    cpus ({int}|None): the CPUs on which the processes run in the
+        sandboxes must be pinned, or None not to pin them.
+
+    """
+    _slot.index = index
+    _slot.cpus = cpus
+    try:
+        yield
+    finally:
+        del _slot.index
+        del _slot.cpus
+
+
 def wait_without_std(procs):
     """Wait for the conclusion of the processes in the list, avoiding
     starving for input and output.
@@ -186,6 +215,12 @@ class SandboxBase(metaclass=ABCMeta):
     EXIT_TIMEOUT_WALL = 'wall timeout'
     EXIT_NONZERO_RETURN = 'nonzero return'
 
+    # Whether files from the storage may be hardlinked from the cache
+    # (when config.sandbox_link_cached_files is set). This is safe only
+    # if the sandboxed processes cannot write to files they do not own
+    # and if the sandbox never makes the linked files writable.
+    HARDLINK_FROM_STORAGE = False
+
     def __init__(self, file_cacher, name=None, temp_dir=None):
         """Initialization.
 
@@ -216,6 +251,15 @@ class SandboxBase(metaclass=ABCMeta):
 
         self.max_processes = 1
 
+        # The slot this sandbox belongs to, and the CPUs its processes
+        # are pinned to (if any), see use_slot.
+        self.slot = getattr(_slot, "index", 0)
+        self.cpus = getattr(_slot, "cpus", None)
+
+        # The real paths of the files hardlinked from the cache, that
+        # must never become writable.
+        self._linked_paths = set()
+
         # Set common environment variables.
         # Specifically needed by Python, that searches the home for
         # packages.
@@ -365,8 +409,30 @@ class SandboxBase(metaclass=ABCMeta):
         executable (bool): to set permissions.
 
         """
-        with self.create_file(path, executable) as dest_fobj:
-            self.file_cacher.get_file_to_fobj(digest, dest_fobj)
+        if not config.sandbox_link_cached_files:
+            with self.create_file(path, executable) as dest_fobj:
+                self.file_cacher.get_file_to_fobj(digest, dest_fobj)
+            return
+
+        logger.debug("Linking file %s from storage in sandbox.", path)
+        real_path = self.relative_path(path)
+        # The inode of a hardlink is shared with the cache, so its
+        # permissions cannot be changed: it is made only if the cached
+        # file is already read-only and executable as needed.
+        hardlink_mode = None
+        if self.HARDLINK_FROM_STORAGE:
+            hardlink_mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+            if executable:
+                hardlink_mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        method = self.file_cacher.link_file_to_path(
+            digest, real_path, hardlink_mode=hardlink_mode)
+        if method == self.file_cacher.LINK_HARDLINK:
+            self._linked_paths.add(real_path)
+            return
+        mod = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH | stat.S_IWUSR
+        if executable:
+            mod |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        os.chmod(real_path, mod)
 
     def create_file_from_string(self, path, content, executable=False):
         """Write some data to a file in the sandbox.
@@ -472,7 +538,9 @@ class SandboxBase(metaclass=ABCMeta):
         path (string): relative path of the file inside the sandbox.
 
         """
-        os.remove(self.relative_path(path))
+        real_path = self.relative_path(path)
+        os.remove(real_path)
+        self._linked_paths.discard(real_path)
 
     @abstractmethod
     def execute_without_std(self, command, wait=False):
@@ -843,13 +911,21 @@ class IsolateSandbox(SandboxBase):
        command number N.
 
     """
-    next_id = 0
+    # For each slot, the number of sandboxes created so far.
+    next_id = {}
+
+    # How many box ids are reserved for each slot of each Worker.
+    BOXES_PER_SLOT = 10
 
     # If the command line starts with this command name, we are just
     # going to execute it without sandboxing, and with all permissions
     # on the current directory.
     SECURE_COMMANDS = ["/bin/cp", "/bin/mv", "/usr/bin/zip", "/usr/bin/unzip"]
 
+    # Sandboxed processes run as a different user, so they cannot write
+    # to the (read-only) files hardlinked from the cache.
+    HARDLINK_FROM_STORAGE = True
+
     def __init__(self, file_cacher, name=None, temp_dir=None):
         """Initialization.
 
@@ -858,19 +934,23 @@ class IsolateSandbox(SandboxBase):
         """
         SandboxBase.__init__(self, file_cacher, name, temp_dir)
 
-        # Isolate only accepts ids between 0 and 999 (by default). We assign
-        # the range [(shard+1)*10, (shard+2)*10) to each Worker and keep the
-        # range [0, 10) for other uses (command-line scripts like cmsMake or
-        # direct console users of isolate). Inside each range ids are assigned
-        # sequentially, with a wrap-around.
+        # Isolate only accepts ids between 0 and sandbox_num_boxes - 1
+        # (its num_boxes setting, 1000 by default). We assign a range of
+        # BOXES_PER_SLOT ids to each slot of each Worker, starting from
+        # BOXES_PER_SLOT, and keep the range [0, BOXES_PER_SLOT) for other
+        # uses (command-line scripts like cmsMake or direct console users
+        # of isolate). Inside each range ids are assigned sequentially,
+        # with a wrap-around.
         # FIXME This is the only use of FileCacher.service, and it's an
         # improper use! Avoid it!
+        next_id = IsolateSandbox.next_id.get(self.slot, 0)
+        box_id = next_id % IsolateSandbox.BOXES_PER_SLOT
         if file_cacher is not None and file_cacher.service is not None:
-            box_id = ((file_cacher.service.shard + 1) * 10
-                      + (IsolateSandbox.next_id % 10)) % 1000
-        else:
-            box_id = IsolateSandbox.next_id % 10
-        IsolateSandbox.next_id += 1
+            first_box_id = IsolateSandbox.BOXES_PER_SLOT * (
+                1 + file_cacher.service.shard * config.worker_slots
+                + self.slot)
+            box_id = (first_box_id + box_id) % config.sandbox_num_boxes
+        IsolateSandbox.next_id[self.slot] = next_id + 1
 
         # We create a directory "home" inside the outer temporary directory,
         # that will be bind-mounted to "/tmp" inside the sandbox (some
@@ -964,7 +1044,9 @@ class IsolateSandbox(SandboxBase):
         """
         os.chmod(self._home, 0o777)
         for filename in os.listdir(self._home):
-            os.chmod(os.path.join(self._home, filename), 0o777)
+            path = os.path.join(self._home, filename)
+            if path not in self._linked_paths:
+                os.chmod(path, 0o777)
 
     def allow_writing_none(self):
         """Set permissions in such a way that the user cannot write anything.
@@ -972,7 +1054,9 @@ class IsolateSandbox(SandboxBase):
         """
         os.chmod(self._home, 0o755)
         for filename in os.listdir(self._home):
-            os.chmod(os.path.join(self._home, filename), 0o755)
+            path = os.path.join(self._home, filename)
+            if path not in self._linked_paths:
+                os.chmod(path, 0o755)
 
     def allow_writing_only(self, inner_paths):
         """Set permissions in so that the user can write only some paths.
@@ -1003,9 +1087,12 @@ class IsolateSandbox(SandboxBase):
             outer_paths.append(outer_path)
 
         # If one of the specified file do not exists, we touch it to
-        # assign the correct permissions.
+        # assign the correct permissions. If it is linked from the
+        # cache, we replace it with a private copy.
         for path in outer_paths:
-            if not os.path.exists(path):
+            if path in self._linked_paths:
+                self._unlink_from_cache(path)
+            elif not os.path.exists(path):
                 open(path, "wb").close()
 
         # Close everything, then open only the specified.
@@ -1013,6 +1100,18 @@ class IsolateSandbox(SandboxBase):
         for path in outer_paths:
             os.chmod(path, 0o722)
 
+    def _unlink_from_cache(self, path):
+        """Replace a file hardlinked from the cache with a copy.
+
+        path (str): the real path of the file.
+
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self._home, prefix=".copy")
+        with open(path, "rb") as src, open(fd, "wb") as dst:
+            copyfileobj(src, dst)
+        os.rename(temp_path, path)
+        self._linked_paths.discard(path)
+
     def get_root_path(self):
         """Return the toplevel path of the sandbox.
 
@@ -1325,10 +1424,14 @@ class IsolateSandbox(SandboxBase):
         with open(self.cmd_file, 'at', encoding="utf-8") as commands:
             commands.write("%s\n" % (pretty_print_cmdline(args)))
         os.chmod(self._home, prev_permissions)
+        preexec_fn = None
+        if self.cpus is not None:
+            # The affinity is inherited by the sandboxed processes.
+            preexec_fn = partial(os.sched_setaffinity, 0, self.cpus)
         try:
             p = subprocess.Popen(args,
                                  stdin=stdin, stdout=stdout, stderr=stderr,
-                                 close_fds=close_fds)
+                                 close_fds=close_fds, preexec_fn=preexec_fn)
         except OSError:
             logger.critical("Failed to execute program in sandbox "
                             "with command: %s", pretty_print_cmdline(args),
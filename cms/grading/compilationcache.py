@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reuse of the outcome of compilations.
+
+The outcome of a compilation depends only on the task type (and its
+parameters), the language, the source files and the managers that go
+in the compilation sandbox; compilations where all of these are the
+same (resubmissions of the same files, or the same submission against
+another dataset of the task) can reuse the executables and the text of
+the first one instead of running the compiler again.
+
+"""
+
+import hashlib
+import json
+import logging
+
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from cms.db import CompilationCacheEntry, Executable
+from cms.grading.languagemanager import get_language
+from cms.grading.steps import COMPILATION_MESSAGES
+from cms.grading.tasktypes import is_manager_for_compilation
+from cmscommon.datetime import make_datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_key(job):
+    """Return the key of the compilation of a job in the cache.
+
+    job (CompilationJob): the job.
+
+    return (str|None): the key, or None if the job cannot be cached
+        (for example, because there is nothing to compile).
+
+    """
+    if job.language is None or job.operation is None:
+        return None
+    try:
+        language = get_language(job.language)
+    except KeyError:
+        return None
+    data = [
+        job.task_type,
+        job.task_type_parameters,
+        job.language,
+        sorted((codename, file_.digest)
+               for codename, file_ in job.files.items()),
+        sorted((filename, manager.digest)
+               for filename, manager in job.managers.items()
+               if is_manager_for_compilation(filename, language)),
+    ]
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_from_cache(session, job):
+    """Fill a job with the outcome of the same compilation, if cached.
+
+    Errors of the database are logged and treated as a miss, so that
+    the job is compiled anyway.
+
+    session (Session): the DB session to use.
+    job (CompilationJob): the job to fill.
+
+    return (bool): whether the job was found in the cache (and thus
+        filled).
+
+    """
+    key = get_cache_key(job)
+    if key is None:
+        return False
+    try:
+        entry = session.query(CompilationCacheEntry).get(key)
+    except SQLAlchemyError:
+        logger.warning("Couldn't look up the compilation in the cache.",
+                       exc_info=True)
+        session.rollback()
+        return False
+    if entry is None:
+        return False
+    job.success = True
+    job.compilation_success = entry.compilation_success
+    job.text = list(entry.text)
+    job.plus = dict(entry.plus)
+    job.executables = dict(
+        (filename, Executable(filename, digest))
+        for filename, digest in entry.executables.items())
+    return True
+
+
+def store_in_cache(session, job):
+    """Store the outcome of the compilation of a job in the cache.
+
+    Compilations that did not complete, or that timed out (which may
+    depend on the load of the worker), are not stored. The cache is
+    only an optimization, so errors of the database are logged and
+    otherwise ignored, not to lose the outcome of the job.
+
+    session (Session): the DB session to use.
+    job (CompilationJob): the job, already executed.
+
+    return (bool): whether the outcome has been stored.
+
+    """
+    key = get_cache_key(job)
+    if key is None or not job.success:
+        return False
+    if not job.compilation_success and len(job.text) > 0 and \
+            job.text[0] == COMPILATION_MESSAGES.get("timeout").message:
+        return False
+    entry = CompilationCacheEntry(
+        timestamp=make_datetime(),
+        compilation_success=job.compilation_success,
+        text=job.text,
+        plus=job.plus if job.plus is not None else {},
+        executables=dict((filename, executable.digest)
+                         for filename, executable
+                         in job.executables.items()))
+    entry.key = key
+    entry.dataset_id = job.operation.dataset_id
+    session.add(entry)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Another worker stored the same compilation in the meantime.
+        session.rollback()
+        return False
+    except SQLAlchemyError:
+        logger.warning("Couldn't store the compilation in the cache.",
+                       exc_info=True)
+        session.rollback()
+        return False
+    return True
@@ -46,3 +46,8 @@ class GroupMin(ScoreTypeGroup):
     def reduce(self, outcomes, unused_parameter):
         """See ScoreTypeGroup."""
         return min(outcomes)
+
+    def is_settled(self, outcomes, unused_parameter):
+        """See ScoreTypeGroup."""
+        # A zero outcome makes the subtask worth zero.
+        return any(outcome <= 0.0 for outcome in outcomes)
@@ -48,3 +48,8 @@ class GroupMul(ScoreTypeGroup):
     def reduce(self, outcomes, unused_parameter):
         """See ScoreTypeGroup."""
         return reduce(lambda x, y: x * y, outcomes)
+
+    def is_settled(self, outcomes, unused_parameter):
+        """See ScoreTypeGroup."""
+        # A zero outcome makes the subtask worth zero.
+        return any(outcome <= 0.0 for outcome in outcomes)
@@ -53,3 +53,9 @@ class GroupThreshold(ScoreTypeGroup):
             return 1.0
         else:
             return 0.0
+
+    def is_settled(self, outcomes, parameter):
+        """See ScoreTypeGroup."""
+        # A single outcome out of range makes the subtask worth zero.
+        threshold = parameter[2]
+        return not all(0 < outcome <= threshold for outcome in outcomes)
@@ -168,6 +168,23 @@ class ScoreType(metaclass=ABCMeta):
         """
         pass
 
+    def get_irrelevant_testcases(self, unused_outcomes):
+        """Return the testcases whose outcome cannot change the score.
+
+        Used to avoid evaluating a submission on testcases that would
+        not affect its score given the outcomes already known (see
+        lazy_evaluation in the configuration). By default, all
+        testcases are relevant.
+
+        unused_outcomes ({str: float}): the outcomes of the submission
+            in the testcases already evaluated, by codename.
+
+        return ({str}): the codenames of the testcases not yet
+            evaluated that need not be.
+
+        """
+        return set()
+
 
 class ScoreTypeAlone(ScoreType):
     """Intermediate class to manage tasks where the score of a
@@ -438,6 +455,60 @@ class ScoreTypeGroup(ScoreTypeAlone):
 
         return score, subtasks, public_score, public_subtasks, ranking_details
 
+    def get_irrelevant_testcases(self, outcomes):
+        """See ScoreType.get_irrelevant_testcases.
+
+        A testcase is irrelevant if the score of each subtask it
+        belongs to is already determined (see is_settled). The outcomes
+        of private testcases are not used to skip public testcases, not
+        to reveal them through the latter.
+
+        """
+        targets = self.retrieve_target_testcases()
+        # For each group, whether it is settled by the outcomes of its
+        # public testcases, and by all the known outcomes; and for each
+        # testcase, the indices of the groups it belongs to.
+        settled_public = []
+        settled_all = []
+        groups = {}
+        for idx, (target, parameter) in enumerate(
+                zip(targets, self.parameters)):
+            known = [tc_idx for tc_idx in target if tc_idx in outcomes]
+            settled_all.append(self.is_settled(
+                [outcomes[tc_idx] for tc_idx in known], parameter))
+            settled_public.append(self.is_settled(
+                [outcomes[tc_idx] for tc_idx in known
+                 if self.public_testcases[tc_idx]], parameter))
+            for tc_idx in target:
+                groups.setdefault(tc_idx, []).append(idx)
+
+        irrelevant = set()
+        for codename, public in self.public_testcases.items():
+            if codename in outcomes or codename not in groups:
+                continue
+            settled = settled_public if public else settled_all
+            if all(settled[idx] for idx in groups[codename]):
+                irrelevant.add(codename)
+        return irrelevant
+
+    def is_settled(self, unused_outcomes, unused_parameter):
+        """Return whether the score of a subtask is determined by some
+        of the outcomes of its testcases, whatever the others are.
+
+        When settled, reduce must give the same result for any outcome
+        of the other testcases, including 0.0 (the outcome recorded for
+        skipped testcases).
+
+        unused_outcomes ([float]): the known outcomes of the
+            submission in the testcases of the group.
+        unused_parameter (list): the parameters of the group.
+
+        return (bool): whether the other outcomes are irrelevant. By
+            default, False.
+
+        """
+        return False
+
     @abstractmethod
     def get_public_outcome(self, unused_outcome, unused_parameter):
         """Return a public outcome from an outcome.
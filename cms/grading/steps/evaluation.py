@@ -79,6 +79,12 @@ EVALUATION_MESSAGES = MessageCollection([
                  N_("Execution failed because the return code was nonzero"),
                  N_("Your submission failed because it exited with a return "
                     "code different from 0.")),
+    HumanMessage("skipped",
+                 N_("Not evaluated"),
+                 N_("Your submission was not evaluated on this testcase "
+                    "because the outcome could not change its score: it "
+                    "already failed another testcase of each subtask "
+                    "containing this one.")),
 ])
 
 
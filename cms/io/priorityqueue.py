@@ -33,26 +33,44 @@ which is supposed to be the timestamp in which the operation was
 requested for the first time. Timestamp is only used to discern
 between entries with the same priority.
 
+Optionally, the queue ages its entries: every aging_interval seconds,
+the effective priority of all of them increases by one level, so that
+an entry waits at most a few intervals (one per level of difference
+and one more) behind entries pushed after it. This is implemented
+keeping the rank of each entry, its priority plus the number of
+intervals elapsed (on a common clock) when it was pushed: the
+effective priority is the rank minus the current number of intervals,
+so that the order of the ranks is the same at all times.
+
 The queue stores entries in the QueueEntry format, a class that stores
 together the three data point: item, priority, and timestamp.
 
+FairShareQueue offers the same interface, but splits the items among
+shares (for example, the participations they belong to) that take
+turns within the same priority.
+
 """
 
+import heapq
 from functools import total_ordering
 
 from gevent.event import Event
 
-from cmscommon.datetime import make_datetime, make_timestamp
+from cmscommon.datetime import make_datetime, make_timestamp, \
+    monotonic_time
 
 
 class QueueItem:
 
     """Payload of an item in the queue.
 
-    Must be hashable.
+    Must be hashable. Subclasses that may be queued in large numbers
+    should define __slots__ (and then to_dict) to save memory.
 
     """
 
+    __slots__ = ()
+
     def to_dict(self):
         """Return a dict() representation of the object."""
         return self.__dict__
@@ -65,13 +83,18 @@ class QueueEntry:
 
     """
 
-    def __init__(self, item, priority, timestamp, index):
+    __slots__ = ("item", "priority", "timestamp", "index", "rank")
+
+    def __init__(self, item, priority, timestamp, index, rank=None):
         """Create a QueueEntry object.
 
         item (QueueItem): the payload.
         priority (int): the priority.
         timestamp (datetime): the timestamp of first request.
         index (int): used to enforce strict ordering.
+        rank (int|None): the priority plus the aging intervals elapsed
+            when the entry was pushed, or None for just the priority
+            (see PriorityQueue).
 
         """
         # TODO: item is not actually necessary, as we store the whole
@@ -80,16 +103,22 @@ class QueueEntry:
         self.priority = priority
         self.timestamp = timestamp
         self.index = index
+        self.rank = rank if rank is not None else priority
 
     def __eq__(self, other):
         """Return whether self and other have the same priority."""
-        return (self.priority, self.timestamp, self.index) \
-               == (other.priority, other.timestamp, other.index)
+        return (self.rank, self.timestamp, self.index) \
+               == (other.rank, other.timestamp, other.index)
 
     def __lt__(self, other):
         """Return whether self has higher priority than other."""
-        return (self.priority, self.timestamp, self.index) \
-               < (other.priority, other.timestamp, other.index)
+        # Field by field rather than with tuples: this is the hot path
+        # of the heap operations.
+        if self.rank != other.rank:
+            return self.rank < other.rank
+        if self.timestamp != other.timestamp:
+            return self.timestamp < other.timestamp
+        return self.index < other.index
 
 
 class PriorityQueue:
@@ -111,8 +140,16 @@ class PriorityQueue:
     PRIORITY_LOW = 3
     PRIORITY_EXTRA_LOW = 4
 
-    def __init__(self):
-        """Create a priority queue."""
+    def __init__(self, aging_interval=None):
+        """Create a priority queue.
+
+        aging_interval (float|None): how often, in seconds, the
+            entries gain one level of priority, or None not to age
+            them.
+
+        """
+        self._aging_interval = aging_interval
+
         # The queue: a min-heap whose elements are of the form
         # (priority, timestamp, item), where item is the actual data.
         self._queue = []
@@ -130,6 +167,17 @@ class PriorityQueue:
     def __len__(self):
         return len(self._queue)
 
+    def _get_age(self):
+        """Return the number of aging intervals elapsed so far.
+
+        return (int): the intervals on the monotonic clock, or 0 if
+            the queue does not age its entries.
+
+        """
+        if self._aging_interval is None:
+            return 0
+        return int(monotonic_time() // self._aging_interval)
+
     def _verify(self):
         """Make sure that the internal state of the queue is consistent.
 
@@ -181,13 +229,20 @@ class PriorityQueue:
         return (int): the new index of the element.
 
         """
+        # Move the parents down into the hole left by the element, and
+        # put it (and update its reverse index) only at the end.
+        queue = self._queue
+        entry = queue[idx]
         while idx > 0:
             parent = (idx - 1) // 2
-            if self._queue[idx] < self._queue[parent]:
-                self._swap(parent, idx)
+            if entry < queue[parent]:
+                queue[idx] = queue[parent]
+                self._reverse[queue[idx].item] = idx
                 idx = parent
             else:
                 break
+        queue[idx] = entry
+        self._reverse[entry.item] = idx
         return idx
 
     def _down_heap(self, idx):
@@ -199,17 +254,22 @@ class PriorityQueue:
         return (int): the new index of the element.
 
         """
-        last = len(self._queue) - 1
+        # As in _up_heap, move the children up into the hole.
+        queue = self._queue
+        entry = queue[idx]
+        last = len(queue) - 1
         while 2 * idx + 1 <= last:
             child = 2 * idx + 1
-            if 2 * idx + 2 <= last and \
-                    self._queue[2 * idx + 2] < self._queue[child]:
-                child = 2 * idx + 2
-            if self._queue[child] < self._queue[idx]:
-                self._swap(child, idx)
+            if child + 1 <= last and queue[child + 1] < queue[child]:
+                child += 1
+            if queue[child] < entry:
+                queue[idx] = queue[child]
+                self._reverse[queue[idx].item] = idx
                 idx = child
             else:
                 break
+        queue[idx] = entry
+        self._reverse[entry.item] = idx
         return idx
 
     def _updown_heap(self, idx):
@@ -249,7 +309,8 @@ class PriorityQueue:
         index = self._next_index
         self._next_index += 1
 
-        self._queue.append(QueueEntry(item, priority, timestamp, index))
+        self._queue.append(QueueEntry(item, priority, timestamp, index,
+                                      priority + self._get_age()))
         last = len(self._queue) - 1
         self._reverse[item] = last
         self._up_heap(last)
@@ -343,9 +404,20 @@ class PriorityQueue:
 
         """
         pos = self._reverse[item]
-        self._queue[pos].priority = priority
+        entry = self._queue[pos]
+        # The entry keeps the age it had.
+        entry.rank += priority - entry.priority
+        entry.priority = priority
         self._updown_heap(pos)
 
+    def get_entries(self):
+        """Return the entries in the queue, not in order.
+
+        return ([QueueEntry]): the entries.
+
+        """
+        return list(self._queue)
+
     def length(self):
         """Return the number of elements in the queue.
 
@@ -367,16 +439,307 @@ class PriorityQueue:
         correct, but the first element is the one at the top.
 
         return ([QueueEntry]): a list of entries containing the
-            representation of the item, the priority and the
+            representation of the item, the priority, the effective
+            priority (lower than the priority if it aged) and the
             timestamp.
 
         """
+        age = self._get_age()
         return [{'item': entry.item.to_dict(),
                  'priority': entry.priority,
+                 'effective_priority': entry.rank - age,
                  'timestamp': make_timestamp(entry.timestamp)}
                 for entry in self._queue]
 
 
+class FairShareQueue:
+
+    """A priority queue sharing its turns fairly among groups of items.
+
+    The items are grouped in shares, each kept in its own
+    PriorityQueue. Priorities (the effective ones, if the queue ages
+    its items) are still strict, but among the items with the same
+    priority the shares take turns, each share getting
+    a number of turns proportional to its weight, independently of
+    how many items it has in the queue (this is stride scheduling).
+    Within a share, items follow the order of PriorityQueue.
+
+    The interface is the same as PriorityQueue.
+
+    """
+
+    def __init__(self, get_share, get_weight=None, aging_interval=None):
+        """Create a fair share queue.
+
+        get_share (function): given an item, return its share (any
+            hashable value); called once, when pushing the item.
+        get_weight (function|None): given a share, return its weight
+            (a positive number), or None to give weight 1 to all.
+        aging_interval (float|None): as in PriorityQueue.
+
+        """
+        self._get_share = get_share
+        self._get_weight = get_weight
+        self._aging_interval = aging_interval
+
+        # The queue of each share with items in it.
+        self._queues = {}
+
+        # The share of each item in the queue.
+        self._shares = {}
+
+        # The pass of each share with items in it: the next turn goes
+        # to the share with the lowest one, and then its pass grows by
+        # the inverse of its weight.
+        self._passes = {}
+
+        # The pass of the last share served. Shares joining the queue
+        # start from it, so they cannot claim the turns they did not
+        # use while they had no items.
+        self._virtual_time = 0.0
+
+        # A min-heap of the keys of the shares, i.e., tuples (rank,
+        # pass, timestamp, index, sequence number, share) describing
+        # their first entry. A share is only at the key in _keys, the
+        # others in the heap are stale, and skipped.
+        self._heap = []
+        self._keys = {}
+        self._next_sequence = 0
+
+        # Event to signal that there are items in the queue.
+        self._event = Event()
+
+    def __len__(self):
+        return len(self._shares)
+
+    def _verify(self):
+        """Make sure that the internal state of the queue is consistent.
+
+        This is used only for testing.
+
+        """
+        if len(self._shares) != \
+                sum(len(queue) for queue in self._queues.values()):
+            return False
+        if set(self._queues) != set(self._passes) \
+                or set(self._queues) != set(self._keys):
+            return False
+        for share, queue in self._queues.items():
+            if queue.empty() or not queue._verify():
+                return False
+        for item, share in self._shares.items():
+            if item not in self._queues[share]:
+                return False
+        if self._event.isSet() == self.empty():
+            return False
+        return True
+
+    def __contains__(self, item):
+        """Implement the 'in' operator for an item in the queue.
+
+        item (QueueItem): an item to search.
+
+        return (bool): True if item is in the queue.
+
+        """
+        return item in self._shares
+
+    def _update_share(self, share):
+        """Update the key of a share after a change to its queue.
+
+        share (object): the share.
+
+        """
+        queue = self._queues[share]
+        if queue.empty():
+            del self._queues[share]
+            del self._passes[share]
+            del self._keys[share]
+            return
+
+        first = queue.top()
+        old_key = self._keys.get(share)
+        if old_key is not None and old_key[:4] == (
+                first.rank, self._passes[share], first.timestamp,
+                first.index):
+            return
+        key = (first.rank, self._passes[share], first.timestamp,
+               first.index, self._next_sequence, share)
+        self._next_sequence += 1
+        self._keys[share] = key
+        heapq.heappush(self._heap, key)
+
+        # Drop the stale keys when they are too many.
+        if len(self._heap) > 2 * len(self._keys) + 16:
+            self._heap = list(self._keys.values())
+            heapq.heapify(self._heap)
+
+    def _first_share(self, wait):
+        """Return the share whose turn is next.
+
+        wait (bool): if True, block until an element is present.
+
+        return (object): the share.
+
+        raise (LookupError): on empty queue if wait was false.
+
+        """
+        while self.empty():
+            if not wait:
+                raise LookupError("Empty queue.")
+            self._event.wait()
+        while True:
+            share = self._heap[0][-1]
+            if self._keys.get(share) is self._heap[0]:
+                return share
+            heapq.heappop(self._heap)
+
+    def push(self, item, priority=None, timestamp=None):
+        """Push an item in the queue, in the queue of its share.
+
+        item (QueueItem): the item to add to the queue.
+        priority (int|None): the priority of the item, or None for
+            medium priority.
+        timestamp (datetime|None): the time of the submission, or None
+            to use now.
+
+        return (bool): false if the element was already in the queue
+            and was not pushed again, true otherwise.
+
+        """
+        if item in self._shares:
+            return False
+
+        share = self._get_share(item)
+        queue = self._queues.get(share)
+        if queue is None:
+            queue = PriorityQueue(self._aging_interval)
+            self._queues[share] = queue
+            self._passes[share] = self._virtual_time
+        queue.push(item, priority, timestamp)
+        self._shares[item] = share
+        self._update_share(share)
+
+        # Signal to listener greenlets that there might be something.
+        self._event.set()
+
+        return True
+
+    def top(self, wait=False):
+        """Return the first element in the queue without extracting it.
+
+        wait (bool): if True, block until an element is present.
+
+        return (QueueEntry): first element in the queue.
+
+        raise (LookupError): on empty queue if wait was false.
+
+        """
+        return self._queues[self._first_share(wait)].top()
+
+    def pop(self, wait=False):
+        """Extract (and return) the first element in the queue.
+
+        wait (bool): if True, block until an element is present.
+
+        return (QueueEntry): first element in the queue.
+
+        raise (LookupError): on empty queue, if wait was false.
+
+        """
+        share = self._first_share(wait)
+        entry = self._queues[share].pop()
+        del self._shares[entry.item]
+
+        weight = 1 if self._get_weight is None else self._get_weight(share)
+        self._virtual_time = max(self._virtual_time, self._passes[share])
+        self._passes[share] += 1.0 / weight
+        self._update_share(share)
+
+        if self.empty():
+            # Signal that there is nothing left for listeners.
+            self._event.clear()
+        return entry
+
+    def remove(self, item):
+        """Remove an item from the queue. Raise a KeyError if not present.
+
+        item (QueueItem): the item to remove.
+
+        return (QueueEntry): the complete entry removed.
+
+        raise (KeyError): if item not present.
+
+        """
+        share = self._shares[item]
+        entry = self._queues[share].remove(item)
+        del self._shares[item]
+        self._update_share(share)
+
+        if self.empty():
+            self._event.clear()
+
+        return entry
+
+    def set_priority(self, item, priority):
+        """Change the priority of an item inside the queue. Raises an
+        exception if the item is not in the queue.
+
+        item (QueueItem): the item whose priority needs to change.
+        priority (int): the new priority.
+
+        raise (LookupError): if item not present.
+
+        """
+        share = self._shares[item]
+        self._queues[share].set_priority(item, priority)
+        self._update_share(share)
+
+    def get_entries(self):
+        """Return the entries in the queue, not in order.
+
+        return ([QueueEntry]): the entries.
+
+        """
+        return [entry
+                for queue in self._queues.values()
+                for entry in queue.get_entries()]
+
+    def length(self):
+        """Return the number of elements in the queue.
+
+        return (int): length of the queue
+
+        """
+        return len(self._shares)
+
+    def empty(self):
+        """Return if the queue is empty.
+
+        return (bool): is the queue empty?
+
+        """
+        return self.length() == 0
+
+    def get_status(self):
+        """Return the content of the queue. Note that the order may be not
+        correct, but the first element is the one at the top.
+
+        return ([QueueEntry]): a list of entries containing the
+            representation of the item, the priority and the
+            timestamp.
+
+        """
+        if self.empty():
+            return []
+        first_share = self._first_share(False)
+        status = self._queues[first_share].get_status()
+        for share, queue in self._queues.items():
+            if share != first_share:
+                status.extend(queue.get_status())
+        return status
+
+
 # Fake objects for testing follow.
 
 
@@ -48,18 +48,21 @@ class Executor(metaclass=ABCMeta):
 
     """
 
-    def __init__(self, batch_executions=False):
+    def __init__(self, batch_executions=False, queue=None):
         """Create an executor.
 
         batch_executions (bool): if True, the executor will receive a
             list of operations in the queue instead of one operation
             at a time.
+        queue (PriorityQueue|FairShareQueue|None): the queue of the
+            operations, or None to use a new PriorityQueue.
 
         """
         super().__init__()
 
         self._batch_executions = batch_executions
-        self._operation_queue = PriorityQueue()
+        self._operation_queue = queue if queue is not None \
+            else PriorityQueue()
 
     def __contains__(self, item):
         """Return whether the item is in the queue.
@@ -117,7 +120,8 @@ class Executor(metaclass=ABCMeta):
             # Wait for the queue to be non-empty.
             to_execute = [self._operation_queue.pop(wait=True)]
             if self._batch_executions:
-                max_operations = self.max_operations_per_batch()
+                max_operations = self.max_operations_per_batch(
+                    to_execute[0])
                 while not self._operation_queue.empty() and (
                         max_operations == 0 or
                         len(to_execute) < max_operations):
@@ -150,13 +154,16 @@ class Executor(metaclass=ABCMeta):
                         "Unexpected error when executing operation `%s'.",
                         to_execute[0].item, exc_info=True)
 
-    def max_operations_per_batch(self):
+    def max_operations_per_batch(self, first):
         """Return the maximum number of operations in a batch.
 
         If the service has batch executions, this method returns the
         maximum size of a batch (the batch might be smaller if not
         enough operations are present in the queue).
 
+        first (QueueEntry): the first entry of the batch, already
+            extracted from the queue.
+
         return (int): the maximum number of operations, or 0 to
             indicate no limits.
 
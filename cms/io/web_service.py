@@ -28,8 +28,10 @@ from gevent.pywsgi import WSGIServer
 from werkzeug.contrib.fixers import ProxyFix
 from werkzeug.wsgi import DispatcherMiddleware, SharedDataMiddleware
 
+from cms import config
 from cms.db.filecacher import FileCacher
 from cms.server.file_middleware import FileServerMiddleware
+from .rpc import rpc_method
 from .service import Service
 from .web_rpc import RPCMiddleware
 
@@ -67,7 +69,13 @@ class WebService(Service):
                 cache=True, cache_timeout=SECONDS_IN_A_YEAR,
                 fallback_mimetype="application/octet-stream")
 
-        self.file_cacher = FileCacher(self)
+        memory_cache_size = None
+        if config.web_memory_cache_size_mib is not None:
+            memory_cache_size = config.web_memory_cache_size_mib * 1024 * 1024
+        self.file_cacher = FileCacher(
+            self, memory_cache_size=memory_cache_size,
+            memory_cache_max_file_size=
+            config.web_memory_cache_max_file_kib * 1024)
         self.wsgi_app = FileServerMiddleware(self.file_cacher, self.wsgi_app)
 
         if rpc_enabled:
@@ -108,6 +116,15 @@ class WebService(Service):
         """
         return self.wsgi_app(environ, start_response)
 
+    @rpc_method
+    def file_cache_status(self):
+        """Return statistics about the caches of the served files.
+
+        return (dict): see FileCacher.get_cache_status.
+
+        """
+        return self.file_cacher.get_cache_status()
+
     def run(self):
         """Start the WebService.
 
@@ -87,6 +87,7 @@ from .task import \
     StatementHandler, \
     AddAttachmentHandler, \
     AttachmentHandler, \
+    ClearCompilationCacheHandler, \
     TaskListHandler, \
     RemoveTaskHandler
 from .user import \
@@ -171,6 +172,8 @@ HANDLERS = [
     (r"/task/([0-9]+)/statement/([0-9]+)", StatementHandler),
     (r"/task/([0-9]+)/attachments/add", AddAttachmentHandler),
     (r"/task/([0-9]+)/attachment/([0-9]+)", AttachmentHandler),
+    (r"/task/([0-9]+)/clear_compilation_cache",
+     ClearCompilationCacheHandler),
 
     # Datasets
 
@@ -34,7 +34,7 @@ import zipfile
 
 import tornado.web
 
-from cms.db import Dataset, Manager, Message, Participation, \
+from cms.db import Dataset, Evaluation, Manager, Message, Participation, \
     Session, Submission, Task, Testcase
 from cms.grading.scoring import compute_changes_for_dataset
 from cmscommon.datetime import make_datetime
@@ -68,6 +68,10 @@ class DatasetSubmissionsHandler(BaseHandler):
             self.sql_session.query(Dataset)\
                             .filter(Dataset.task == task)\
                             .order_by(Dataset.description).all()
+        self.r_params["reused_evaluation_count"] = \
+            self.sql_session.query(Evaluation)\
+                            .filter(Evaluation.dataset_id == dataset.id)\
+                            .filter(Evaluation.reused.is_(True)).count()
         self.render("dataset.html", **self.r_params)
 
 
@@ -281,8 +285,8 @@ class ActivateDatasetHandler(BaseHandler):
 
             # This kicks off judging of any submissions which were previously
             # unloved, but are now part of an autojudged taskset.
-            self.service\
-                .evaluation_service.search_operations_not_done()
+            self.service.get_evaluation_service(task)\
+                .search_operations_not_done()
             self.service\
                 .scoring_service.search_operations_not_done()
 
@@ -326,8 +330,8 @@ class ToggleAutojudgeDatasetHandler(BaseHandler):
 
             # This kicks off judging of any submissions which were previously
             # unloved, but are now part of an autojudged taskset.
-            self.service\
-                .evaluation_service.search_operations_not_done()
+            self.service.get_evaluation_service(dataset.task)\
+                .search_operations_not_done()
             self.service\
                 .scoring_service.search_operations_not_done()
 
@@ -473,6 +477,9 @@ class AddTestcaseHandler(BaseHandler):
         if self.try_commit():
             # max_score and/or extra_headers might have changed.
             self.service.proxy_service.reinitialize()
+            # The existing submissions must be evaluated on it.
+            self.service.get_evaluation_service(task)\
+                .search_operations_not_done()
             self.redirect(self.url("task", task.id))
         else:
             self.redirect(fallback_page)
@@ -539,6 +546,7 @@ class AddTestcasesHandler(BaseHandler):
         self.service.add_notification(
             make_datetime(), successful_subject, successful_text)
         self.service.proxy_service.reinitialize()
+        self.service.get_evaluation_service(task).search_operations_not_done()
         self.redirect(self.url("task", task.id))
 
 
@@ -31,7 +31,8 @@ import traceback
 
 import tornado.web
 
-from cms.db import Attachment, Dataset, Session, Statement, Submission, Task
+from cms.db import Attachment, CompilationCacheEntry, Dataset, Session, \
+    Statement, Submission, Task
 from cmscommon.datetime import make_datetime
 from .base import BaseHandler, SimpleHandler, require_permission
 
@@ -444,6 +445,29 @@ class AddDatasetHandler(BaseHandler):
             self.redirect(fallback_page)
 
 
+class ClearCompilationCacheHandler(BaseHandler):
+    """Remove the cached compilations of the datasets of a task, for
+    example after changing the compilers on the workers.
+
+    """
+    @require_permission(BaseHandler.PERMISSION_ALL)
+    def post(self, task_id):
+        task = self.safe_get_item(Task, task_id)
+
+        count = self.sql_session.query(CompilationCacheEntry)\
+            .filter(CompilationCacheEntry.dataset_id.in_(
+                self.sql_session.query(Dataset.id)
+                .filter(Dataset.task == task)))\
+            .delete(synchronize_session=False)
+
+        if self.try_commit():
+            self.service.add_notification(
+                make_datetime(),
+                "Removed %d cached compilations." % count, "")
+
+        self.write("./%d" % task.id)
+
+
 class TaskListHandler(SimpleHandler("tasks.html")):
     """Get returns the list of all tasks, post perform operations on
     a specific task (removing them from CMS).
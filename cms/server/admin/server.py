@@ -33,6 +33,7 @@ from cms import config, ServiceCoord, get_service_shards
 from cms.db import SessionGen, Dataset, Submission, SubmissionResult, Task
 from cms.io import WebService, rpc_method
 from cms.service import EvaluationService
+from cms.service.espartition import get_shard_count, get_task_shard
 from cmscommon.binary import hex_to_bin
 from .authentication import AWSAuthMiddleware
 from .handlers import HANDLERS
@@ -72,8 +73,11 @@ class AdminWebServer(WebService):
 
         self.admin_web_server = self.connect_to(
             ServiceCoord("AdminWebServer", 0))
-        self.evaluation_service = self.connect_to(
-            ServiceCoord("EvaluationService", 0))
+        # Each shard of EvaluationService judges some of the tasks
+        # (see cms.service.espartition).
+        self.evaluation_services = [
+            self.connect_to(ServiceCoord("EvaluationService", i))
+            for i in range(get_shard_count())]
         self.scoring_service = self.connect_to(
             ServiceCoord("ScoringService", 0))
 
@@ -92,6 +96,16 @@ class AdminWebServer(WebService):
         return rpc_authorization_checker(self.auth_handler.admin_id,
                                          service, shard, method)
 
+    def get_evaluation_service(self, task):
+        """Return the shard of EvaluationService judging a task.
+
+        task (Task): a task.
+
+        return (RemoteServiceClient): the client for the shard.
+
+        """
+        return self.evaluation_services[get_task_shard(task)]
+
     def add_notification(self, timestamp, subject, text):
         """Store a new notification to send at the first
         opportunity (i.e., at the first request for db notifications).
@@ -87,7 +87,7 @@ class SubmitHandler(ContestHandler):
             logger.info("Sent error: `%s' - `%s'", e.subject, e.text)
             self.notify_error(e.subject, e.text)
         else:
-            self.service.evaluation_service.new_submission(
+            self.service.get_evaluation_service(task).new_submission(
                 submission_id=submission.id)
             self.notify_success(N_("Submission received"),
                                 N_("Your submission has been received "
@@ -140,7 +140,7 @@ class UserTestHandler(ContestHandler):
             logger.info("Sent error: `%s' - `%s'", e.subject, e.text)
             self.notify_error(e.subject, e.text)
         else:
-            self.service.evaluation_service.new_user_test(
+            self.service.get_evaluation_service(task).new_user_test(
                 user_test_id=user_test.id)
             self.notify_success(N_("Test received"),
                                 N_("Your test has been received "
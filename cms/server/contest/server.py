@@ -44,6 +44,7 @@ from werkzeug.wsgi import SharedDataMiddleware
 from cms import ConfigError, ServiceCoord, config
 from cms.io import WebService
 from cms.locale import get_translations
+from cms.service.espartition import get_shard_count, get_task_shard
 from cms.server.contest.jinja2_toolbox import CWS_ENVIRONMENT
 from cmscommon.binary import hex_to_bin
 from .handlers import HANDLERS
@@ -116,8 +117,11 @@ class ContestWebServer(WebService):
         # Retrieve the available translations.
         self.translations = get_translations()
 
-        self.evaluation_service = self.connect_to(
-            ServiceCoord("EvaluationService", 0))
+        # Each shard of EvaluationService judges some of the tasks
+        # (see cms.service.espartition).
+        self.evaluation_services = [
+            self.connect_to(ServiceCoord("EvaluationService", i))
+            for i in range(get_shard_count())]
         self.scoring_service = self.connect_to(
             ServiceCoord("ScoringService", 0))
 
@@ -131,6 +135,16 @@ class ContestWebServer(WebService):
             ServiceCoord("PrintingService", 0),
             must_be_present=printing_enabled)
 
+    def get_evaluation_service(self, task):
+        """Return the shard of EvaluationService judging a task.
+
+        task (Task): a task.
+
+        return (RemoteServiceClient): the client for the shard.
+
+        """
+        return self.evaluation_services[get_task_shard(task)]
+
     def add_notification(self, username, timestamp, subject, text, level):
         """Store a new notification to send to a user at the first
         opportunity (i.e., at the first request fot db notifications).
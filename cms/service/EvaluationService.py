@@ -31,25 +31,36 @@ the current ranking.
 """
 
 import logging
-from collections import defaultdict
+import os
+from collections import OrderedDict, defaultdict
 from datetime import timedelta
 from functools import wraps
 
+import gevent
 import gevent.lock
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
 from sqlalchemy.exc import IntegrityError
 
-from cms import ServiceCoord, get_service_shards
+from cms import ServiceCoord, config, mkdir
 from cms.db import SessionGen, Digest, Dataset, Evaluation, Submission, \
-    SubmissionResult, Testcase, UserTest, UserTestResult, get_submissions, \
-    get_submission_results, get_datasets_to_judge
-from cms.grading.Job import JobGroup
-from cms.io import Executor, TriggeredService, rpc_method
+    SubmissionResult, Task, Testcase, UserTest, UserTestResult, \
+    get_submissions, get_submission_results, get_datasets_to_judge, \
+    NotificationListener
+from cms.db.notifications import NEW_SUBMISSION, NEW_USER_TEST
+from cms.grading.Job import Job, JobGroup
+from cms.grading.steps import EVALUATION_MESSAGES
+from cms.io import Executor, FairShareQueue, PriorityQueue, \
+    TriggeredService, rpc_method
+from cmscommon.datetime import make_datetime, monotonic_time
+from .espartition import get_partition, get_shard_count, \
+    get_task_filter, get_task_shard, get_worker_shard, get_workers
 from .esoperations import ESOperation, get_relevant_operations, \
     get_submissions_operations, get_user_tests_operations, \
-    submission_get_operations, submission_to_evaluate, \
+    reuse_evaluations, submission_get_operations, submission_to_evaluate, \
     user_test_get_operations
+from .fairshare import LatencyTracker, get_share, get_share_weight
 from .flushingdict import FlushingDict
+from .queuesnapshot import load_queue_snapshot, save_queue_snapshot
 from .workerpool import WorkerPool
 
 
@@ -61,13 +72,26 @@ class EvaluationExecutor(Executor):
     # Real maximum number of operations to be sent to a worker.
     MAX_OPERATIONS_PER_BATCH = 25
 
+    # Lower bound, in seconds, for the estimated duration of an
+    # operation used in sizing the batches.
+    MIN_DURATION = 0.001
+
     def __init__(self, evaluation_service):
         """Create the single executor for ES.
 
         The executor just delegates work to the worker pool.
 
         """
-        super().__init__(True)
+        # The operations take turns by participation and/or task, if
+        # so configured (see cms.service.fairshare), and their priority
+        # increases while they wait, if so configured.
+        if len(config.evaluation_fair_share) > 0:
+            queue = FairShareQueue(evaluation_service.get_operation_share,
+                                   get_share_weight,
+                                   config.queue_aging_interval_s)
+        else:
+            queue = PriorityQueue(config.queue_aging_interval_s)
+        super().__init__(True, queue)
 
         self.evaluation_service = evaluation_service
         self.pool = WorkerPool(self.evaluation_service)
@@ -79,7 +103,12 @@ class EvaluationExecutor(Executor):
         # Lock used to guard the currently executing operations
         self._current_execution_lock = gevent.lock.RLock()
 
-        for i in range(get_service_shards("Worker")):
+        # Each shard of ES has its own workers (see espartition).
+        workers = get_workers(self.evaluation_service.shard)
+        if len(workers) == 0:
+            logger.warning("No workers for shard %d of EvaluationService.",
+                           self.evaluation_service.shard)
+        for i in workers:
             worker = ServiceCoord("Worker", i)
             self.pool.add_worker(worker)
 
@@ -97,19 +126,45 @@ class EvaluationExecutor(Executor):
                 or item in self._currently_executing
                 or item in self.pool)
 
-    def max_operations_per_batch(self):
+    def get_operations(self):
+        """Return the operations in the queue or in execution.
+
+        return ([(ESOperation, int, datetime)]): the operations, each
+            with its priority and timestamp.
+
+        """
+        operations = [(entry.item, entry.priority, entry.timestamp)
+                      for entry in self._operation_queue.get_entries()]
+        with self._current_execution_lock:
+            executing = self._currently_executing + self.pool.get_operations()
+        operations.extend((operation,) + operation.side_data
+                          for operation in executing)
+        return operations
+
+    def max_operations_per_batch(self, first):
         """Return the maximum number of operations per batch.
 
-        We derive the number from the length of the queue divided by
-        the number of workers, with a cap at MAX_OPERATIONS_PER_BATCH.
+        We aim at batches taking worker_batch_wall_time_s seconds,
+        according to how long the operations like the first of the
+        batch (same type, same dataset) took so far. The batches are
+        also kept small enough to spread the queue among all the active
+        workers, with a cap at MAX_OPERATIONS_PER_BATCH; they are
+        anyway allowed to fill all the slots of a worker.
+
+        first (QueueEntry): the first entry of the batch.
 
         """
-        # TODO: len(self.pool) is the total number of workers,
-        # included those that are disabled.
-        ratio = len(self._operation_queue) // len(self.pool) + 1
-        ret = min(max(ratio, 1), EvaluationExecutor.MAX_OPERATIONS_PER_BATCH)
-        logger.info("Ratio is %d, executing %d operations together.",
-                    ratio, ret)
+        estimate = self.pool.estimate_duration(first.item)
+        by_time = int(config.worker_batch_wall_time_s
+                      / max(estimate, EvaluationExecutor.MIN_DURATION))
+        by_share = len(self._operation_queue) \
+            // max(self.pool.count_active_workers(), 1) + 1
+        ret = min(max(min(by_time, by_share), config.worker_slots, 1),
+                  max(EvaluationExecutor.MAX_OPERATIONS_PER_BATCH,
+                      config.worker_slots))
+        logger.info("Operations like `%s' take %.3fs, queue share is %d, "
+                    "executing %d operations together.",
+                    first.item, estimate, by_share, ret)
         return ret
 
     def execute(self, entries):
@@ -212,11 +267,28 @@ class EvaluationService(TriggeredService):
     # The maximum time since the last result before processing.
     MAX_FLUSHING_TIME_SECONDS = 2
 
+    # How long we wait for the other shards when asking them for
+    # their status.
+    OTHER_SHARDS_TIMEOUT_SECONDS = 5
+
+    # How many shares of submissions and user tests we remember.
+    MAX_CACHED_SHARES = 100000
+
     def __init__(self, shard, contest_id=None):
         super().__init__(shard)
 
         self.contest_id = contest_id
 
+        # The share (see cms.service.fairshare) of the submissions and
+        # user tests with operations, by (for_submission, object_id),
+        # from the least to the most recently used.
+        self._shares = OrderedDict()
+
+        # The time to the first verdict of the submissions of each
+        # participation, from the ones submitted after the start.
+        self.latencies = LatencyTracker()
+        self._start_time = make_datetime()
+
         # Cache holding the results from the worker until they are
         # written to the DB.
         self.result_cache = FlushingDict(
@@ -247,12 +319,46 @@ class EvaluationService(TriggeredService):
         # operations in state 4.
         self.post_finish_lock = gevent.lock.RLock()
 
+        # The sweeper usually only looks at the submissions (and user
+        # tests) with an id at least the ones here, and looks at all
+        # of them only in a full sweep, that happens every now and
+        # then or when requested (see _missing_operations).
+        self._sweep_min_submission_id = None
+        self._sweep_min_user_test_id = None
+        self._full_sweep_requested = True
+        self._next_full_sweep = monotonic_time()
+
         self.scoring_service = self.connect_to(
             ServiceCoord("ScoringService", 0))
 
+        # This shard only judges its own tasks (see espartition), but
+        # forwards to the others the requests about theirs, so that
+        # any shard (e.g., the first one, as AWS does) can be asked
+        # about all of them.
+        self.other_shards = dict(
+            (i, self.connect_to(ServiceCoord("EvaluationService", i)))
+            for i in range(get_shard_count()) if i != self.shard)
+
         self.add_executor(EvaluationExecutor(self))
+
+        # The operations of the previous run, if saved, are resumed
+        # right away (see cms.service.queuesnapshot).
+        if config.queue_snapshot_interval_s is not None:
+            self.restore_queue()
+            self.add_timeout(self.save_queue, None,
+                             config.queue_snapshot_interval_s,
+                             immediately=False)
+
         self.start_sweeper(117.0)
 
+        # The sweeper stays as a fallback: after the listener lost
+        # some notifications, it looks for their operations.
+        if config.db_notifications:
+            NotificationListener({
+                NEW_SUBMISSION: self.new_submission,
+                NEW_USER_TEST: self.new_user_test,
+            }, on_reconnect=self.search_operations_not_done).start()
+
         self.add_timeout(self.check_workers_timeout, None,
                          EvaluationService.WORKER_TIMEOUT_CHECK_TIME
                          .total_seconds(),
@@ -270,9 +376,17 @@ class EvaluationService(TriggeredService):
         return (int): the number of actually enqueued operations.
 
         """
+        self.remember_share(True, submission)
         new_operations = 0
         for dataset in get_datasets_to_judge(submission.task):
             submission_result = submission.get_result(dataset)
+            if config.evaluation_reuse:
+                reused = reuse_evaluations(submission_result)
+                if reused > 0:
+                    logger.info("Reused %d evaluations from other datasets "
+                                "for result %d(%d).", reused, submission.id,
+                                dataset.id)
+                    submission_result.sa_session.commit()
             number_of_operations = 0
             for operation, priority, timestamp in submission_get_operations(
                     submission_result, submission, dataset):
@@ -301,6 +415,7 @@ class EvaluationService(TriggeredService):
         return (int): the number of actually enqueued operations.
 
         """
+        self.remember_share(False, user_test)
         new_operations = 0
         for dataset in get_datasets_to_judge(user_test.task):
             for operation, priority, timestamp in user_test_get_operations(
@@ -316,32 +431,333 @@ class EvaluationService(TriggeredService):
         evaluated for no good reasons. Put the missing operation in
         the queue.
 
+        Usually, only the submissions (and user tests) from the oldest
+        one that had operations to do in the previous sweep onwards are
+        examined; new work for older ones (for example, after a change
+        to a dataset) is found by a full sweep, that happens every
+        full_sweep_interval_s seconds or after a call to
+        search_operations_not_done.
+
         """
+        full_sweep = self._full_sweep_requested \
+            or monotonic_time() >= self._next_full_sweep
+        if full_sweep:
+            logger.info("Looking for missing operations in all submissions.")
+            self._full_sweep_requested = False
+            self._next_full_sweep = \
+                monotonic_time() + config.full_sweep_interval_s
+            self._sweep_min_submission_id = None
+            self._sweep_min_user_test_id = None
+
         counter = 0
         with SessionGen() as session:
-
-            for operation, timestamp, priority in \
-                    get_submissions_operations(session, self.contest_id):
-                if self.enqueue(operation, timestamp, priority):
+            # Submissions and user tests created from now on will be
+            # examined by the next sweep in any case.
+            next_min_submission_id = \
+                (session.query(func.max(Submission.id)).scalar() or 0) + 1
+            next_min_user_test_id = \
+                (session.query(func.max(UserTest.id)).scalar() or 0) + 1
+
+            # Submissions with new evaluations to do, if they can be
+            # reused from other datasets.
+            to_reuse = set()
+            for operation, timestamp, priority in get_submissions_operations(
+                    session, self.contest_id, self._sweep_min_submission_id,
+                    get_task_filter(self.shard)):
+                next_min_submission_id = min(next_min_submission_id,
+                                             operation.object_id)
+                if config.evaluation_reuse \
+                        and operation.type_ == ESOperation.EVALUATION \
+                        and operation not in self.get_executor() \
+                        and operation not in self.result_cache:
+                    to_reuse.add(operation.object_id)
+                elif self.enqueue(operation, timestamp, priority):
                     counter += 1
-
-            for operation, timestamp, priority in \
-                    get_user_tests_operations(session, self.contest_id):
+            for submission_id in to_reuse:
+                submission = Submission.get_from_id(submission_id, session)
+                counter += self.submission_enqueue_operations(submission)
+
+            for operation, timestamp, priority in get_user_tests_operations(
+                    session, self.contest_id, self._sweep_min_user_test_id,
+                    get_task_filter(self.shard)):
+                next_min_user_test_id = min(next_min_user_test_id,
+                                            operation.object_id)
                 if self.enqueue(operation, timestamp, priority):
                     counter += 1
 
+        self._sweep_min_submission_id = next_min_submission_id
+        self._sweep_min_user_test_id = next_min_user_test_id
         return counter
 
+    def remember_share(self, for_submission, object_):
+        """Remember the share of the operations of an object.
+
+        for_submission (bool): whether the object is a submission or a
+            user test.
+        object_ (Submission|UserTest): the object.
+
+        """
+        if len(config.evaluation_fair_share) == 0:
+            return
+        key = (for_submission, object_.id)
+        self._shares.pop(key, None)
+        self._shares[key] = \
+            get_share(object_.participation_id, object_.task_id)
+        while len(self._shares) > EvaluationService.MAX_CACHED_SHARES:
+            self._shares.popitem(last=False)
+
+    def get_operation_share(self, operation):
+        """Return the share of an operation, for the fair share queue.
+
+        operation (ESOperation): an operation.
+
+        return ((int, ...)): its share (see cms.service.fairshare).
+
+        """
+        key = (operation.for_submission(), operation.object_id)
+        share = self._shares.get(key)
+        if share is not None:
+            self._shares.move_to_end(key)
+        else:
+            # Not seen yet (e.g., found by the sweeper).
+            cls = Submission if operation.for_submission() else UserTest
+            with SessionGen() as session:
+                object_ = cls.get_from_id(operation.object_id, session)
+                if object_ is None:
+                    return get_share(None, None)
+                self.remember_share(operation.for_submission(), object_)
+                share = self._shares[key]
+        return share
+
+    def record_latency(self, submission_result):
+        """Record the time to the first verdict of a submission.
+
+        Only the verdicts on the active dataset, for the submissions
+        arrived since the service started, are recorded.
+
+        submission_result (SubmissionResult): a submission result,
+            just compiled with failure or evaluated.
+
+        """
+        submission = submission_result.submission
+        if submission_result.dataset_id != submission.task.active_dataset_id \
+                or submission.timestamp < self._start_time:
+            return
+        self.latencies.record(
+            submission.participation_id, submission.id,
+            (make_datetime() - submission.timestamp).total_seconds())
+
+    def get_queue_snapshot_path(self):
+        """Return the path of the snapshot of the queue.
+
+        """
+        return os.path.join(config.data_dir, "%s_%d_queue.json"
+                            % (self.name, self.shard))
+
+    def save_queue(self):
+        """Save a snapshot of the operations to do, to be restored
+        by restore_queue after a restart.
+
+        """
+        min_submission_id = self._sweep_min_submission_id
+        min_user_test_id = self._sweep_min_user_test_id
+        # The results not yet written would be lost in a restart: make
+        # the sweeper look for their operations again.
+        for operation in self.result_cache.keys():
+            if operation.for_submission():
+                if min_submission_id is not None:
+                    min_submission_id = min(min_submission_id,
+                                            operation.object_id)
+            elif min_user_test_id is not None:
+                min_user_test_id = min(min_user_test_id, operation.object_id)
+
+        path = self.get_queue_snapshot_path()
+        mkdir(os.path.dirname(path))
+        try:
+            save_queue_snapshot(path, self.contest_id, get_partition(),
+                                self.get_executor().get_operations(),
+                                min_submission_id, min_user_test_id)
+        except OSError:
+            logger.error("Couldn't save the queue snapshot to %s.", path,
+                         exc_info=True)
+        return True
+
+    def restore_queue(self):
+        """Enqueue the operations saved by save_queue, if any.
+
+        The sweeper resumes from where it was, instead of looking at
+        all the submissions right away, and the operations are checked
+        against the database in the background.
+
+        """
+        snapshot = load_queue_snapshot(self.get_queue_snapshot_path(),
+                                       self.contest_id, get_partition())
+        if snapshot is None:
+            return
+        operations, min_submission_id, min_user_test_id = snapshot
+
+        for operation, priority, timestamp in operations:
+            self.enqueue(operation, priority, timestamp)
+        if min_submission_id is not None and min_user_test_id is not None:
+            self._sweep_min_submission_id = min_submission_id
+            self._sweep_min_user_test_id = min_user_test_id
+            self._full_sweep_requested = False
+            self._next_full_sweep = \
+                monotonic_time() + config.full_sweep_interval_s
+        logger.info("Restored %d operation(s) from the queue snapshot.",
+                    len(operations))
+
+        gevent.spawn(self.drop_operations_done,
+                     [operation for operation, _, _ in operations])
+
+    def drop_operations_done(self, operations):
+        """Remove from the queue the operations that, according to
+        the database, are not to do anymore, or not by this shard.
+
+        operations ([ESOperation]): the operations to check.
+
+        """
+        by_object = defaultdict(list)
+        for operation in operations:
+            by_object[(operation.for_submission(), operation.object_id,
+                       operation.dataset_id)].append(operation)
+
+        counter = 0
+        for key, operations in by_object.items():
+            for_submission, object_id, dataset_id = key
+            with SessionGen() as session:
+                dataset = Dataset.get_from_id(dataset_id, session)
+                if for_submission:
+                    object_ = Submission.get_from_id(object_id, session)
+                else:
+                    object_ = UserTest.get_from_id(object_id, session)
+
+                to_do = set()
+                if dataset is None or object_ is None:
+                    pass
+                elif get_task_shard(dataset.task) != self.shard:
+                    # The task may have moved to a contest of another
+                    # shard since the snapshot.
+                    pass
+                elif for_submission:
+                    to_do.update(
+                        operation for operation, _, _
+                        in submission_get_operations(
+                            object_.get_result(dataset), object_, dataset))
+                else:
+                    to_do.update(
+                        operation for operation, _, _
+                        in user_test_get_operations(object_, dataset))
+
+            for operation in operations:
+                if operation not in to_do:
+                    try:
+                        self.dequeue(operation)
+                    except KeyError:
+                        pass  # Ok, the operation has been executed.
+                    else:
+                        counter += 1
+
+        logger.info("Removed %d restored operation(s) already done.",
+                    counter)
+
     @rpc_method
-    def workers_status(self):
+    def search_operations_not_done(self):
+        """Make the sweeper loop fire a full sweep as soon as possible.
+
+        """
+        self._full_sweep_requested = True
+        super().search_operations_not_done()
+
+    def ask_other_shards(self, shards, method, **kwargs):
+        """Call a RPC method on some other shards and wait for them.
+
+        shards ([int]): the shards to call.
+        method (str): the name of the method.
+        kwargs (dict): the arguments of the method.
+
+        return ([object]): the results of the shards that answered
+            successfully in time.
+
+        """
+        results = [getattr(self.other_shards[shard], method)(**kwargs)
+                   for shard in shards]
+        gevent.wait(results,
+                    timeout=EvaluationService.OTHER_SHARDS_TIMEOUT_SECONDS)
+        ret = []
+        for shard, result in zip(shards, results):
+            if result.ready() and result.successful():
+                ret.append(result.value)
+            else:
+                logger.warning("Shard %d of EvaluationService didn't answer "
+                               "to %s.", shard, method)
+        return ret
+
+    @rpc_method
+    def workers_status(self, all_shards=True):
         """Returns a dictionary (indexed by shard number) whose values
         are the information about the corresponding worker. See
         WorkerPool.get_status for more details.
 
+        all_shards (bool): whether to include the workers of the other
+            shards of ES.
+
         returns (dict): the dict with the workers information.
 
         """
-        return self.get_executor().pool.get_status()
+        status = self.get_executor().pool.get_status()
+        if all_shards:
+            for other_status in self.ask_other_shards(
+                    list(self.other_shards), "workers_status",
+                    all_shards=False):
+                status.update(other_status)
+        return status
+
+    @rpc_method
+    def precache_progress(self, shard, contest_id, done, total):
+        """Receive from a worker the progress of its precaching.
+
+        shard (int): the shard of the worker.
+        contest_id (int): the contest whose files are being cached.
+        done (int): how many files have been processed.
+        total (int): how many files are to be processed.
+
+        returns (bool): True if the worker is known.
+
+        """
+        logger.debug("Worker %s precached %d/%d files.", shard, done, total)
+        try:
+            self.get_executor().pool.set_precache_progress(
+                shard, contest_id, done, total)
+        except ValueError:
+            return False
+        return True
+
+    @rpc_method
+    def placement_status(self):
+        """Returns statistics about the placement of the operations on
+        the workers, see WorkerPool.get_placement_status.
+
+        returns (dict): the statistics.
+
+        """
+        return self.get_executor().pool.get_placement_status()
+
+    @rpc_method
+    def slots_status(self, shard, slots):
+        """Receive from a worker the status of its slots.
+
+        shard (int): the shard of the worker.
+        slots ([dict]): the status of each of its slots.
+
+        returns (bool): True if the worker is known.
+
+        """
+        try:
+            self.get_executor().pool.set_slots_status(shard, slots)
+        except ValueError:
+            return False
+        return True
 
     def check_workers_timeout(self):
         """We ask WorkerPool for the unresponsive workers, and we put
@@ -429,16 +845,56 @@ class EvaluationService(TriggeredService):
         if job_group_success:
             for job in job_group.jobs:
                 operation = job.operation
-                if job.success:
-                    logger.info("`%s' succeeded.", operation)
-                else:
-                    logger.error("`%s' failed, see worker logs and (possibly) "
-                                 "sandboxes at '%s'.",
-                                 operation, " ".join(job.sandboxes))
                 if isinstance(to_ignore, list) and operation in to_ignore:
-                    logger.info("`%s' result ignored as requested", operation)
+                    logger.info("`%s' result ignored as requested (or "
+                                "already received).", operation)
                 else:
-                    self.result_cache.add(operation, Result(job, job.success))
+                    self._add_result(job)
+
+    def _add_result(self, job):
+        """Queue the result of a job to be written to the DB.
+
+        job (Job): the job, as executed by a worker.
+
+        """
+        operation = job.operation
+        if job.success:
+            logger.info("`%s' succeeded.", operation)
+        else:
+            logger.error("`%s' failed, see worker logs and (possibly) "
+                         "sandboxes at '%s'.",
+                         operation, " ".join(job.sandboxes))
+        self.result_cache.add(operation, Result(job, job.success))
+
+    @rpc_method
+    def job_finished(self, shard, job_dict):
+        """Receive from a worker the result of a job, before the end of
+        the group it belongs to (see worker_stream_results).
+
+        The worker is released only when the whole group is done (in
+        action_finished), but the result is written to the DB right
+        away, so that, for example, the evaluations of a compiled
+        submission can be assigned to other workers.
+
+        shard (int): the shard of the worker.
+        job_dict (dict): the Job, exported to dict.
+
+        returns (bool): whether the result has been accepted.
+
+        """
+        try:
+            job = Job.import_from_dict_with_type(job_dict)
+        except Exception:
+            logger.error("Couldn't build Job for data %s.", job_dict,
+                         exc_info=True)
+            return False
+        if not self.get_executor().pool.accept_streamed_result(
+                shard, job.operation):
+            logger.info("Ignored streamed result of `%s' from worker %s.",
+                        job.operation, shard)
+            return False
+        self._add_result(job)
+        return True
 
     @with_post_finish_lock
     def write_results(self, items):
@@ -465,6 +921,9 @@ class EvaluationService(TriggeredService):
             by_object_and_type[t].append((operation, result))
 
         with SessionGen() as session:
+            # The successful evaluations are inserted all together at
+            # the end, the other results are written one by one.
+            evaluation_results = []
             for key, operation_results in by_object_and_type.items():
                 type_, object_id, dataset_id = key
 
@@ -490,27 +949,39 @@ class EvaluationService(TriggeredService):
                         continue
                     object_result = object_.get_result_or_create(dataset)
 
+                if type_ == ESOperation.EVALUATION:
+                    evaluation_results.extend(
+                        (object_result, operation, result)
+                        for operation, result in operation_results
+                        if result.job_success)
+                    operation_results = [
+                        (operation, result)
+                        for operation, result in operation_results
+                        if not result.job_success]
+
                 self.write_results_one_object_and_type(
                     session, object_result, operation_results)
 
+            self.write_evaluations_in_bulk(session, evaluation_results)
+
             logger.info("Committing evaluations...")
             session.commit()
 
-            num_testcases_per_dataset = dict()
-            for type_, object_id, dataset_id in by_object_and_type.keys():
-                if type_ == ESOperation.EVALUATION:
-                    if dataset_id not in num_testcases_per_dataset:
-                        num_testcases_per_dataset[dataset_id] = session\
-                            .query(func.count(Testcase.id))\
-                            .filter(Testcase.dataset_id == dataset_id).scalar()
-                    num_evaluations = session\
-                        .query(func.count(Evaluation.id)) \
-                        .filter(Evaluation.dataset_id == dataset_id) \
-                        .filter(Evaluation.submission_id == object_id).scalar()
-                    if num_evaluations == num_testcases_per_dataset[dataset_id]:
-                        submission_result = SubmissionResult.get_from_id(
-                            (object_id, dataset_id), session)
-                        submission_result.set_evaluation_outcome()
+            if config.lazy_evaluation:
+                for type_, object_id, dataset_id in by_object_and_type.keys():
+                    if type_ == ESOperation.EVALUATION:
+                        self.skip_irrelevant_evaluations(
+                            session, object_id, dataset_id)
+                logger.info("Committing skipped evaluations...")
+                session.commit()
+
+            for submission_result in self.get_evaluated_submission_results(
+                    session,
+                    [(object_id, dataset_id)
+                     for type_, object_id, dataset_id
+                     in by_object_and_type.keys()
+                     if type_ == ESOperation.EVALUATION]):
+                submission_result.set_evaluation_outcome()
 
             logger.info("Committing evaluation outcomes...")
             session.commit()
@@ -538,6 +1009,121 @@ class EvaluationService(TriggeredService):
 
         logger.info("Done")
 
+    def skip_irrelevant_evaluations(self, session, submission_id,
+                                    dataset_id):
+        """Skip the evaluations that cannot change the score of a
+        submission, according to its score type and the evaluations
+        done so far.
+
+        The skipped operations are removed from the queue (or their
+        results ignored, if a worker is executing them), and an
+        evaluation with outcome 0.0 and the "skipped" message is
+        recorded for their testcases.
+
+        session (Session): the DB session to use.
+        submission_id (int): the id of the submission.
+        dataset_id (int): the id of the dataset.
+
+        """
+        submission_result = SubmissionResult.get_from_id(
+            (submission_id, dataset_id), session)
+        if submission_result is None:
+            return
+        dataset = submission_result.dataset
+        try:
+            score_type = dataset.score_type_object
+        except (KeyError, ValueError):
+            return
+        outcomes = dict((evaluation.codename, float(evaluation.outcome))
+                        for evaluation in submission_result.evaluations
+                        if evaluation.outcome is not None)
+
+        for codename in sorted(score_type.get_irrelevant_testcases(outcomes)):
+            operation = ESOperation(ESOperation.EVALUATION,
+                                    submission_id, dataset_id, codename)
+            # Its result is already here, just not written yet.
+            if operation in self.result_cache:
+                continue
+            try:
+                self.dequeue(operation)
+            except KeyError:
+                pass  # Ok, the operation wasn't in the queue.
+            try:
+                self.get_executor().pool.ignore_operation(operation)
+            except LookupError:
+                pass  # Ok, the operation wasn't in the pool.
+            logger.info("Skipping `%s'.", operation)
+            submission_result.evaluations += [Evaluation(
+                text=[EVALUATION_MESSAGES.get("skipped").message],
+                outcome="0.0",
+                testcase=dataset.testcases[codename])]
+
+    @staticmethod
+    def get_evaluated_submission_results(session, keys):
+        """Return the submission results that have an evaluation for
+        each testcase of their dataset.
+
+        All the results are checked with a single query.
+
+        session (Session): the DB session to use.
+        keys ([(int, int)]): the submission and dataset ids of the
+            submission results to check.
+
+        return ([SubmissionResult]): the submission results among
+            those given that have all their evaluations.
+
+        """
+        if len(keys) == 0:
+            return []
+        num_testcases = session.query(Testcase.dataset_id,
+                                      func.count(Testcase.id).label("count"))\
+            .filter(Testcase.dataset_id.in_(set(
+                dataset_id for _, dataset_id in keys)))\
+            .group_by(Testcase.dataset_id)\
+            .subquery()
+        evaluated = session.query(Evaluation.submission_id,
+                                  Evaluation.dataset_id)\
+            .join(num_testcases,
+                  num_testcases.c.dataset_id == Evaluation.dataset_id)\
+            .filter(tuple_(Evaluation.submission_id, Evaluation.dataset_id)
+                    .in_(keys))\
+            .group_by(Evaluation.submission_id, Evaluation.dataset_id,
+                      num_testcases.c.count)\
+            .having(func.count(Evaluation.id) == num_testcases.c.count)\
+            .all()
+        return [SubmissionResult.get_from_id(key, session)
+                for key in evaluated]
+
+    def write_evaluations_in_bulk(self, session, evaluation_results):
+        """Write to the DB the results of successful evaluations.
+
+        All the evaluations are inserted with a single statement; if
+        this fails (for example, because one of them is already in the
+        DB), they are written one by one like the other results.
+
+        session (Session): the DB session to use.
+        evaluation_results ([(SubmissionResult, ESOperation,
+            WorkerResult)]): the results to write, each with the DB
+            object for its submission result.
+
+        """
+        if len(evaluation_results) == 0:
+            return
+        logger.info("Writing %d evaluations to db.", len(evaluation_results))
+        # The submission results must be there for the foreign keys.
+        session.flush()
+        try:
+            with session.begin_nested():
+                session.execute(Evaluation.__table__.insert().values([
+                    result.job.to_evaluation_row(object_result)
+                    for object_result, _, result in evaluation_results]))
+        except Exception:
+            logger.warning("Could not write the evaluations at once, writing "
+                           "them one by one.", exc_info=True)
+            for object_result, operation, result in evaluation_results:
+                self.write_results_one_object_and_type(
+                    session, object_result, [(operation, result)])
+
     def write_results_one_object_and_type(
             self, session, object_result, operation_results):
         """Write to the DB the results for one object and type.
@@ -647,6 +1233,7 @@ class EvaluationService(TriggeredService):
             logger.info("Submission %d(%d) did not compile.",
                         submission_result.submission_id,
                         submission_result.dataset_id)
+            self.record_latency(submission_result)
             self.scoring_service.new_evaluation(
                 submission_id=submission_result.submission_id,
                 dataset_id=submission_result.dataset_id)
@@ -690,6 +1277,7 @@ class EvaluationService(TriggeredService):
             logger.info("Submission %d(%d) was evaluated successfully.",
                         submission_result.submission_id,
                         submission_result.dataset_id)
+            self.record_latency(submission_result)
             self.scoring_service.new_evaluation(
                 submission_id=submission_result.submission_id,
                 dataset_id=submission_result.dataset_id)
@@ -800,6 +1388,10 @@ class EvaluationService(TriggeredService):
                 logger.error("[new_submission] Couldn't find submission "
                              "%d in the database.", submission_id)
                 return
+            if get_task_shard(submission.task) != self.shard:
+                logger.debug("[new_submission] Submission %d is judged by "
+                             "another shard.", submission_id)
+                return
 
             self.submission_enqueue_operations(submission)
 
@@ -822,6 +1414,10 @@ class EvaluationService(TriggeredService):
                 logger.error("[new_user_test] Couldn't find user test %d "
                              "in the database.", user_test_id)
                 return
+            if get_task_shard(user_test.task) != self.shard:
+                logger.debug("[new_user_test] User test %d is judged by "
+                             "another shard.", user_test_id)
+                return
 
             self.user_test_enqueue_operations(user_test)
 
@@ -835,7 +1431,8 @@ class EvaluationService(TriggeredService):
                               dataset_id=None,
                               participation_id=None,
                               task_id=None,
-                              level="compilation"):
+                              level="compilation",
+                              all_shards=True):
         """Request to invalidate some computed data.
 
         Invalidate the compilation and/or evaluation data of the
@@ -861,6 +1458,9 @@ class EvaluationService(TriggeredService):
             invalidate, or None.
         task_id (int|None): id of the task to invalidate, or None.
         level (string): 'compilation' or 'evaluation'
+        all_shards (bool): whether to forward the request to the other
+            shards of ES, each of them invalidating the data of its
+            own tasks.
 
         """
         logger.info("Invalidation request received.")
@@ -871,6 +1471,13 @@ class EvaluationService(TriggeredService):
             raise ValueError(
                 "Unexpected invalidation level `%s'." % level)
 
+        if all_shards:
+            for other_shard in self.other_shards.values():
+                other_shard.invalidate_submission(
+                    contest_id=contest_id, submission_id=submission_id,
+                    dataset_id=dataset_id, participation_id=participation_id,
+                    task_id=task_id, level=level, all_shards=False)
+
         if contest_id is None:
             contest_id = self.contest_id
 
@@ -881,6 +1488,8 @@ class EvaluationService(TriggeredService):
             if dataset_id is not None and task_id is None \
                     and submission_id is None:
                 task_id = Dataset.get_from_id(dataset_id, session).task_id
+            own_task_ids = session.query(Task.id)\
+                .filter(get_task_filter(self.shard))
             # First we load all involved submissions.
             submissions = get_submissions(
                 session,
@@ -888,7 +1497,8 @@ class EvaluationService(TriggeredService):
                 contest_id
                 if {participation_id, task_id, submission_id} == {None}
                 else None,
-                participation_id, task_id, submission_id).all()
+                participation_id, task_id, submission_id)\
+                .filter(Submission.task_id.in_(own_task_ids)).all()
 
             # Then we get all relevant operations, and we remove them
             # both from the queue and from the pool (i.e., we ignore
@@ -920,7 +1530,8 @@ class EvaluationService(TriggeredService):
                 # Provide the task_id only if the entire task has to be
                 # reevaluated and not only a specific dataset.
                 task_id if dataset_id is None else None,
-                submission_id, dataset_id).all()
+                submission_id, dataset_id)\
+                .filter(Submission.task_id.in_(own_task_ids)).all()
             logger.info("Submission results to invalidate %s for: %d.",
                         level, len(submission_results))
             for submission_result in submission_results:
@@ -948,6 +1559,11 @@ class EvaluationService(TriggeredService):
         returns (bool): True if everything went well.
 
         """
+        es_shard = get_worker_shard(shard)
+        if es_shard != self.shard:
+            return any(self.ask_other_shards(
+                [es_shard], "disable_worker", shard=shard))
+
         logger.info("Received request to disable worker %s.", shard)
 
         lost_operations = []
@@ -972,6 +1588,11 @@ class EvaluationService(TriggeredService):
         returns (bool): True if everything went well.
 
         """
+        es_shard = get_worker_shard(shard)
+        if es_shard != self.shard:
+            return any(self.ask_other_shards(
+                [es_shard], "enable_worker", shard=shard))
+
         logger.info("Received request to enable worker %s.", shard)
         try:
             self.get_executor().pool.enable_worker(shard)
@@ -981,7 +1602,18 @@ class EvaluationService(TriggeredService):
         return True
 
     @rpc_method
-    def queue_status(self):
+    def latency_status(self):
+        """Return the latencies to the first verdict of this shard.
+
+        return ({str: {str: float}}): for each participation id, the
+            statistics of the latencies of its submissions (see
+            LatencyTracker.get_status).
+
+        """
+        return self.latencies.get_status()
+
+    @rpc_method
+    def queue_status(self, all_shards=True):
         """Return the status of the queue.
 
         Parent method returns list of queues of each executor, but in
@@ -996,8 +1628,12 @@ class EvaluationService(TriggeredService):
         testcase which will be evaluated next. Moreover, we pass also
         the number of testcases in the queue.
 
-        The entries are then ordered by priority and timestamp (the
-        same criteria used to look at what to complete next).
+        The entries are then ordered by effective priority (that is,
+        after aging) and timestamp (the same criteria used to look at
+        what to complete next).
+
+        all_shards (bool): whether to include the queues of the other
+            shards of ES.
 
         return ([QueueEntry]): the list with the queued elements.
 
@@ -1013,6 +1649,13 @@ class EvaluationService(TriggeredService):
             else:
                 entries_by_key[key] = entry
                 entries_by_key[key]["item"]["multiplicity"] = 1
+        entries = list(entries_by_key.values())
+        if all_shards:
+            # The shards have disjoint operations.
+            for other_entries in self.ask_other_shards(
+                    list(self.other_shards), "queue_status",
+                    all_shards=False):
+                entries.extend(other_entries)
         return sorted(
-            entries_by_key.values(),
-            key=lambda x: (x["priority"], x["timestamp"]))
+            entries,
+            key=lambda x: (x["effective_priority"], x["timestamp"]))
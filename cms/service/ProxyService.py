@@ -39,8 +39,9 @@ import requests.exceptions
 from sqlalchemy import not_
 
 from cms import config
-from cms.db import SessionGen, Contest, Participation, Task, Submission, \
-    get_submissions
+from cms.db import SessionGen, Contest, Dataset, Participation, Task, \
+    Submission, get_submissions, NotificationListener
+from cms.db.notifications import NEW_TOKEN, SUBMISSION_RESULT_SCORED
 from cms.io import Executor, QueueItem, TriggeredService, rpc_method
 from cmscommon.datetime import make_timestamp
 
@@ -268,6 +269,12 @@ class ProxyService(TriggeredService):
 
         self.start_sweeper(347.0)
 
+        if config.db_notifications:
+            NotificationListener({
+                NEW_TOKEN: self.submission_tokened,
+                SUBMISSION_RESULT_SCORED: self._submission_result_scored,
+            }, on_reconnect=self.search_operations_not_done).start()
+
     def _missing_operations(self):
         """Return a generator of data to be sent to the rankings..
 
@@ -441,6 +448,22 @@ class ProxyService(TriggeredService):
         logger.info("Reinitializing rankings.")
         self.initialize()
 
+    def _submission_result_scored(self, submission_id, dataset_id):
+        """Notice that a submission result has been scored.
+
+        Called when notified by the database; only the scores on the
+        active dataset are of interest for the rankings.
+
+        submission_id (int): the id of the submission that changed.
+        dataset_id (int): the id of the dataset of the result.
+
+        """
+        with SessionGen() as session:
+            dataset = Dataset.get_from_id(dataset_id, session)
+            if dataset is None or dataset is not dataset.task.active_dataset:
+                return
+        self.submission_scored(submission_id)
+
     @rpc_method
     def submission_scored(self, submission_id):
         """Notice that a submission has been scored.
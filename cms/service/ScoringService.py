@@ -28,7 +28,9 @@
 import logging
 
 from cms import ServiceCoord, config
-from cms.db import SessionGen, Submission, Dataset, get_submission_results
+from cms.db import SessionGen, Submission, Dataset, \
+    get_submission_results, NotificationListener
+from cms.db.notifications import SUBMISSION_RESULT_TO_SCORE
 from cms.io import Executor, TriggeredService, rpc_method
 from cmscommon.datetime import make_datetime
 from .scoringoperations import ScoringOperation, get_operations
@@ -140,6 +142,11 @@ class ScoringService(TriggeredService):
         self.add_executor(ScoringExecutor(self.proxy_service))
         self.start_sweeper(347.0)
 
+        if config.db_notifications:
+            NotificationListener({
+                SUBMISSION_RESULT_TO_SCORE: self.new_evaluation,
+            }, on_reconnect=self.search_operations_not_done).start()
+
     def _missing_operations(self):
         """Return a generator of unscored submission results.
 
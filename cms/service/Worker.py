@@ -24,17 +24,25 @@
 
 """
 
+import base64
 import logging
+import os
 import time
 
 import gevent.lock
+import gevent.pool
 
+from cms import ServiceCoord, config
 from cms.db import SessionGen, Contest, enumerate_files
 from cms.db.filecacher import FileCacher, TombstoneError
 from cms.grading import JobException
 from cms.grading.Job import CompilationJob, EvaluationJob, JobGroup
+from cms.grading.Sandbox import use_slot
+from cms.grading.compilationcache import load_from_cache, store_in_cache
 from cms.grading.tasktypes import get_task_type
 from cms.io import Service, rpc_method
+from cms.service.espartition import get_worker_shard
+from cms.service.workerpeers import WorkerPeers
 
 
 logger = logging.getLogger(__name__)
@@ -51,9 +59,26 @@ class Worker(Service):
     JOB_TYPE_COMPILATION = "compile"
     JOB_TYPE_EVALUATION = "evaluate"
 
+    # Minimum interval, in seconds, between two reports of the
+    # progress of precaching to ES.
+    PRECACHE_PROGRESS_INTERVAL = 5.0
+
     def __init__(self, shard, fake_worker_time=None):
         Service.__init__(self, shard)
-        self.file_cacher = FileCacher(self)
+        max_cache_size = None
+        if config.worker_cache_max_size_mib is not None:
+            max_cache_size = config.worker_cache_max_size_mib * 1024 * 1024
+        peers = WorkerPeers(self) if config.worker_peer_fetch else None
+        self.file_cacher = FileCacher(
+            self,
+            max_cache_size=max_cache_size,
+            max_cache_files=config.worker_cache_max_files,
+            eviction_policy=config.worker_cache_eviction_policy,
+            peers=peers,
+            shared=config.worker_shared_cache)
+
+        self.evaluation_service = self.connect_to(
+            ServiceCoord("EvaluationService", get_worker_shard(self.shard)))
 
         self.work_lock = gevent.lock.RLock()
         self._last_end_time = None
@@ -61,8 +86,61 @@ class Worker(Service):
         self._total_busy_time = 0
         self._number_execution = 0
 
+        # The jobs of a group are run in parallel, each in a slot; for
+        # each slot, the CPUs its sandboxes are pinned on (if any) and
+        # its statistics.
+        n_slots = max(1, config.worker_slots)
+        self._slot_cpus = [None] * n_slots
+        if config.worker_pin_cpus:
+            self._slot_cpus = Worker._split_cpus(
+                sorted(os.sched_getaffinity(0)), n_slots)
+        self._slots_start_time = time.monotonic()
+        self._slots = [{"operation": None, "jobs": 0, "busy_time": 0.0}
+                       for _ in range(n_slots)]
+
         self._fake_worker_time = fake_worker_time
 
+    @staticmethod
+    def _split_cpus(cpus, n_slots):
+        """Split the CPUs among the slots.
+
+        cpus ([int]): the CPUs available, sorted.
+        n_slots (int): the number of slots.
+
+        return ([{int}|None]): for each slot, a contiguous share of the
+            CPUs, or None for all slots (i.e., no pinning) if the CPUs
+            are fewer than the slots.
+
+        """
+        if len(cpus) < n_slots:
+            logger.warning("Not pinning the %d slots on only %d CPUs.",
+                           n_slots, len(cpus))
+            return [None] * n_slots
+        return [set(cpus[i * len(cpus) // n_slots:
+                         (i + 1) * len(cpus) // n_slots])
+                for i in range(n_slots)]
+
+    def get_slots_status(self):
+        """Return the status of the slots.
+
+        return ([dict]): for each slot, the operation it is running (or
+            None), its CPUs (or None), how many jobs it ran, the time
+            it spent running them and its utilization (the fraction of
+            time it was busy since the worker started).
+
+        """
+        elapsed = time.monotonic() - self._slots_start_time
+        result = []
+        for slot, cpus in zip(self._slots, self._slot_cpus):
+            result.append({
+                "operation": slot["operation"],
+                "cpus": sorted(cpus) if cpus is not None else None,
+                "jobs": slot["jobs"],
+                "busy_time": slot["busy_time"],
+                "utilization":
+                    slot["busy_time"] / elapsed if elapsed > 0 else 0.0})
+        return result
+
     @rpc_method
     def precache_files(self, contest_id):
         """RPC to ask the worker to precache of files in the contest.
@@ -79,22 +157,120 @@ class Worker(Service):
             contest = Contest.get_from_id(contest_id, session)
             files = enumerate_files(session, contest, skip_submissions=True,
                                     skip_user_tests=True, skip_print_jobs=True)
-        for digest in files:
-            try:
-                self.file_cacher.load(digest, if_needed=True)
-            except KeyError:
-                # No problem (at this stage) if we cannot find the
-                # file
-                pass
+            files = Worker._sort_by_first_use(contest, files)
+
+        last_report = {"time": None}
+
+        def report_progress(done, total):
+            now = time.monotonic()
+            if done < total and last_report["time"] is not None and \
+                    now - last_report["time"] < \
+                    Worker.PRECACHE_PROGRESS_INTERVAL:
+                return
+            last_report["time"] = now
+            self.evaluation_service.precache_progress(
+                shard=self.shard, contest_id=contest_id,
+                done=done, total=total)
+
+        # No problem (at this stage) if we cannot find some files.
+        missing = self.file_cacher.load_many(
+            files, progress_callback=report_progress)
+        if len(files) == 0:
+            report_progress(0, 0)
+
+        logger.info("Precaching finished (%d files not found).",
+                    len(missing))
+
+    @staticmethod
+    def _sort_by_first_use(contest, digests):
+        """Sort the digests of the files of a contest by expected first
+        use in evaluations.
+
+        First come the managers of the active datasets, then their
+        testcases (input and output, in codename order); then the same
+        for the other datasets; finally all other files.
+
+        contest (Contest): the contest the files belong to.
+        digests ({str}): the digests of the files.
+
+        return ([str]): the digests, sorted.
+
+        """
+        active_datasets = []
+        other_datasets = []
+        for task in contest.tasks:
+            for dataset in task.datasets:
+                if dataset is task.active_dataset:
+                    active_datasets.append(dataset)
+                else:
+                    other_datasets.append(dataset)
+
+        order = {}
+        for datasets in (active_datasets, other_datasets):
+            for dataset in datasets:
+                for codename in sorted(dataset.managers):
+                    order.setdefault(dataset.managers[codename].digest,
+                                     len(order))
+            for dataset in datasets:
+                for codename in sorted(dataset.testcases):
+                    testcase = dataset.testcases[codename]
+                    order.setdefault(testcase.input, len(order))
+                    order.setdefault(testcase.output, len(order))
+
+        return sorted(digests,
+                      key=lambda digest: (order.get(digest, len(order)),
+                                          digest))
+
+    @rpc_method
+    def get_file_chunk(self, digest, offset, size):
+        """RPC to send to another worker part of a file of the cache.
+
+        If the file is not in the cache, it is loaded first.
+
+        digest (str): the digest of the file.
+        offset (int): the position of the first byte to send.
+        size (int): the maximum number of bytes to send.
 
-        logger.info("Precaching finished.")
+        return (str|None): the bytes, encoded in base64, or None if
+            the file is not available.
+
+        """
+        size = min(size, WorkerPeers.CHUNK_SIZE)
+        try:
+            with self.file_cacher.get_file(digest) as fobj:
+                fobj.seek(offset)
+                data = fobj.read(size)
+        except (KeyError, TombstoneError):
+            return None
+        return base64.b64encode(data).decode("ascii")
+
+    @rpc_method
+    def cache_status(self):
+        """RPC to obtain statistics about the local file cache.
+
+        return (dict): the occupation of the cache, its limits and the
+            number of hits, misses and evictions.
+
+        """
+        return self.file_cacher.get_cache_status()
+
+    @rpc_method
+    def slots_status(self):
+        """RPC to obtain the status of the slots running the jobs.
+
+        return ([dict]): see get_slots_status.
+
+        """
+        return self.get_slots_status()
 
     @rpc_method
-    def execute_job_group(self, job_group_dict):
-        """Receive a group of jobs in a list format and executes them one by
-        one.
+    def execute_job_group(self, job_group_dict, stream=False):
+        """Receive a group of jobs in a list format and executes them,
+        up to worker_slots at the same time.
 
         job_group_dict ({}): a JobGroup exported to dict.
+        stream (bool): whether to also send each job to ES (through its
+            job_finished RPC) as soon as it is done.
 
         return ({}): the same JobGroup in dict format, but containing
             the results.
@@ -106,25 +282,20 @@ class Worker(Service):
         if self.work_lock.acquire(False):
             try:
                 logger.info("Starting job group.")
+                free_slots = list(range(len(self._slots)))
+                pool = gevent.pool.Pool(len(self._slots))
+                failures = []
                 for job in job_group.jobs:
-                    logger.info("Starting job.",
-                                extra={"operation": job.info})
-
-                    job.shard = self.shard
-
-                    if self._fake_worker_time is None:
-                        task_type = get_task_type(job.task_type,
-                                                  job.task_type_parameters)
-                        try:
-                            task_type.execute_job(job, self.file_cacher)
-                        except TombstoneError:
-                            job.success = False
-                            job.plus = {"tombstone": True}
-                    else:
-                        self._fake_work(job)
-
-                    logger.info("Finished job.",
-                                extra={"operation": job.info})
+                    # Blocks until a slot is free; once a job failed,
+                    # the group fails and we do not start other jobs.
+                    pool.wait_available()
+                    if len(failures) > 0:
+                        break
+                    pool.spawn(self._execute_job_in_slot,
+                               job, free_slots, failures, stream)
+                pool.join()
+                if len(failures) > 0:
+                    raise failures[0]
 
                 logger.info("Finished job group.")
                 return job_group.export_to_dict()
@@ -136,6 +307,8 @@ class Worker(Service):
 
             finally:
                 self._finalize(start_time)
+                self.evaluation_service.slots_status(
+                    shard=self.shard, slots=self.get_slots_status())
                 self.work_lock.release()
 
         else:
@@ -147,9 +320,81 @@ class Worker(Service):
             self._finalize(start_time)
             raise JobException(err_msg)
 
+    def _execute_job_in_slot(self, job, free_slots, failures, stream):
+        """Execute a job in one of the free slots.
+
+        job (Job): the job to execute, that is filled with the results.
+        free_slots ([int]): the slots not running a job, one of which
+            is taken while executing this job.
+        failures ([Exception]): where to append the exception raised
+            by the job, if any.
+        stream (bool): whether to send the job to ES when done.
+
+        """
+        slot = free_slots.pop(0)
+        status = self._slots[slot]
+        status["operation"] = job.info
+        start_time = time.monotonic()
+        try:
+            logger.info("Starting job.", extra={"operation": job.info})
+
+            job.shard = self.shard
+
+            with use_slot(slot, self._slot_cpus[slot]):
+                if self._fake_worker_time is None:
+                    task_type = get_task_type(job.task_type,
+                                              job.task_type_parameters)
+                    # Keep the files the job needs in the cache until
+                    # it finishes.
+                    digests = job.get_digests()
+                    self.file_cacher.pin(digests)
+                    try:
+                        self._execute_job_cached(task_type, job)
+                    except TombstoneError:
+                        job.success = False
+                        job.plus = {"tombstone": True}
+                    finally:
+                        self.file_cacher.unpin(digests)
+                else:
+                    self._fake_work(job)
+
+            logger.info("Finished job.", extra={"operation": job.info})
+            if stream:
+                self.evaluation_service.job_finished(
+                    shard=self.shard, job_dict=job.export_to_dict())
+        except Exception as error:
+            failures.append(error)
+        finally:
+            status["operation"] = None
+            status["jobs"] += 1
+            status["busy_time"] += time.monotonic() - start_time
+            free_slots.append(slot)
+
+    def _execute_job_cached(self, task_type, job):
+        """Execute a job, reusing the outcome of the same compilation
+        if it is in the compilation cache (and the cache is enabled).
+
+        task_type (TaskType): the task type of the job.
+        job (Job): the job to execute, that is filled with the results.
+
+        """
+        if not config.compilation_cache \
+                or not isinstance(job, CompilationJob):
+            task_type.execute_job(job, self.file_cacher)
+            return
+
+        with SessionGen() as session:
+            if load_from_cache(session, job):
+                logger.info("Compilation found in the cache.",
+                            extra={"operation": job.info})
+                return
+        task_type.execute_job(job, self.file_cacher)
+        with SessionGen() as session:
+            store_in_cache(session, job)
+
     def _fake_work(self, job):
         """Fill the job with fake success data after waiting for some time."""
-        time.sleep(self._fake_worker_time)
+        gevent.sleep(self._fake_worker_time)
         job.success = True
         job.text = ["ok"]
         job.plus = {
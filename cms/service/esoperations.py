@@ -27,11 +27,13 @@ compute sets of operations to do.
 """
 
 import logging
+import sys
 
 from sqlalchemy import case, literal
 
 from cms.db import Dataset, Evaluation, Submission, SubmissionResult, \
     Task, Testcase, UserTest, UserTestResult
+from cms.grading.steps import EVALUATION_MESSAGES
 from cms.io import PriorityQueue, QueueItem
 
 
@@ -44,6 +46,11 @@ MAX_USER_TEST_COMPILATION_TRIES = 3
 MAX_USER_TEST_EVALUATION_TRIES = 3
 
 
+# How many rows to fetch at a time when looking for the operations to
+# do, to keep the memory bounded.
+SWEEP_BATCH_SIZE = 1000
+
+
 FILTER_SUBMISSION_DATASETS_TO_JUDGE = (
     (Dataset.id == Task.active_dataset_id) |
     (Dataset.autojudge.is_(True))
@@ -198,6 +205,85 @@ def submission_get_operations(submission_result, submission, dataset):
                     submission.timestamp
 
 
+def _evaluation_conditions(submission_result):
+    """Return what the evaluations of a submission result depend on,
+    except the testcases.
+
+    submission_result (SubmissionResult): a submission result.
+
+    return (tuple): the task type and its parameters, the limits, and
+        the digests of the managers and of the executables.
+
+    """
+    dataset = submission_result.dataset
+    return (
+        dataset.task_type,
+        dataset.task_type_parameters,
+        dataset.time_limit,
+        dataset.memory_limit,
+        dict((filename, manager.digest)
+             for filename, manager in dataset.managers.items()),
+        dict((filename, executable.digest)
+             for filename, executable
+             in submission_result.executables.items()),
+    )
+
+
+def reuse_evaluations(submission_result):
+    """Copy in a submission result the evaluations of the same
+    submission on other datasets that would give the same outcome.
+
+    An evaluation on another dataset is reused for a testcase if the
+    testcase has the same codename, input and output, and if the
+    executables, the managers (e.g., the checker), the task type
+    parameters and the limits are the same. Evaluations skipped (see
+    ScoreType.get_irrelevant_testcases) are not reused, since they
+    depend on the score type of their dataset.
+
+    submission_result (SubmissionResult): a submission result to
+        evaluate; the caller must commit the session.
+
+    return (int): the number of evaluations copied.
+
+    """
+    if not submission_to_evaluate(submission_result):
+        return 0
+
+    evaluated_testcase_ids = set(
+        evaluation.testcase_id
+        for evaluation in submission_result.evaluations)
+    missing = dict(
+        (codename, testcase)
+        for codename, testcase
+        in submission_result.dataset.testcases.items()
+        if testcase.id not in evaluated_testcase_ids)
+    if len(missing) == 0:
+        return 0
+
+    conditions = _evaluation_conditions(submission_result)
+    skipped_text = [EVALUATION_MESSAGES.get("skipped").message]
+    count = 0
+    for other_result in submission_result.submission.results:
+        if other_result is submission_result \
+                or not other_result.compilation_succeeded() \
+                or _evaluation_conditions(other_result) != conditions:
+            continue
+        for evaluation in other_result.evaluations:
+            testcase = missing.get(evaluation.codename)
+            if testcase is None \
+                    or testcase.input != evaluation.testcase.input \
+                    or testcase.output != evaluation.testcase.output \
+                    or evaluation.text == skipped_text:
+                continue
+            new_evaluation = evaluation.clone()
+            new_evaluation.reused = True
+            new_evaluation.submission_result = submission_result
+            new_evaluation.testcase = testcase
+            del missing[evaluation.codename]
+            count += 1
+    return count
+
+
 def user_test_get_operations(user_test, dataset):
     """Generate all operations originating from a user test for a given
     dataset.
@@ -283,23 +369,35 @@ def get_relevant_operations(level, submissions, dataset_id=None):
     return operations
 
 
-def get_submissions_operations(session, contest_id=None):
+def get_submissions_operations(session, contest_id=None,
+                               min_submission_id=None, task_filter=None):
     """Return all the operations to do for submissions in the contest.
 
+    The rows are fetched from the database a few at a time, while the
+    operations are consumed.
+
     session (Session): the database session to use.
     contest_id (int|None): the contest for which we want the operations.
         If none, get operations for any contest.
+    min_submission_id (int|None): if given, only look at the submissions
+        with at least this id.
+    task_filter (ColumnElement|None): if given, only look at the
+        submissions for the tasks satisfying this condition.
 
-    return ([ESOperation, float, int]): a list of operation, timestamp
-        and priority.
+    yield ((ESOperation, int, datetime)): the operations, with their
+        priority and timestamp.
 
     """
-    operations = []
-
     if contest_id is None:
         contest_filter = literal(True)
     else:
         contest_filter = Task.contest_id == contest_id
+    if task_filter is not None:
+        contest_filter = contest_filter & task_filter
+    if min_submission_id is None:
+        id_filter = literal(True)
+    else:
+        id_filter = Submission.id >= min_submission_id
 
     # Retrieve the compilation operations for all submissions without
     # the corresponding result for a dataset to judge. Since we have
@@ -313,7 +411,7 @@ def get_submissions_operations(session, contest_id=None):
                    (Dataset.id == SubmissionResult.dataset_id) &
                    (Submission.id == SubmissionResult.submission_id))\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
             (SubmissionResult.dataset_id.is_(None)))\
         .with_entities(Submission.id, Dataset.id,
@@ -321,17 +419,16 @@ def get_submissions_operations(session, contest_id=None):
                            (Dataset.id != Task.active_dataset_id,
                             literal(PriorityQueue.PRIORITY_EXTRA_LOW))
                            ], else_=literal(PriorityQueue.PRIORITY_HIGH)),
-                       Submission.timestamp)\
-        .all()
+                       Submission.timestamp)
 
     # Retrieve all the compilation operations for submissions
     # already having a result for a dataset to judge.
-    to_compile += session.query(Submission)\
+    to_compile_again = session.query(Submission)\
         .join(Submission.task)\
         .join(Submission.results)\
         .join(SubmissionResult.dataset)\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
             (FILTER_SUBMISSION_RESULTS_TO_COMPILE))\
         .with_entities(Submission.id, Dataset.id,
@@ -341,14 +438,14 @@ def get_submissions_operations(session, contest_id=None):
                            (SubmissionResult.compilation_tries == 0,
                             literal(PriorityQueue.PRIORITY_HIGH))
                            ], else_=literal(PriorityQueue.PRIORITY_MEDIUM)),
-                       Submission.timestamp)\
-        .all()
+                       Submission.timestamp)
 
-    for data in to_compile:
-        submission_id, dataset_id, priority, timestamp = data
-        operations.append((
-            ESOperation(ESOperation.COMPILATION, submission_id, dataset_id),
-            priority, timestamp))
+    for query in [to_compile, to_compile_again]:
+        for data in query.yield_per(SWEEP_BATCH_SIZE):
+            submission_id, dataset_id, priority, timestamp = data
+            yield ESOperation(ESOperation.COMPILATION,
+                              submission_id, dataset_id), \
+                priority, timestamp
 
     # Retrieve all the evaluation operations for a dataset to
     # judge. Again we need to pick all tuples (submission, dataset,
@@ -365,7 +462,7 @@ def get_submissions_operations(session, contest_id=None):
                    (Evaluation.dataset_id == Dataset.id) &
                    (Evaluation.testcase_id == Testcase.id))\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
             (FILTER_SUBMISSION_RESULTS_TO_EVALUATE) &
             (Evaluation.id.is_(None)))\
@@ -377,36 +474,44 @@ def get_submissions_operations(session, contest_id=None):
                             literal(PriorityQueue.PRIORITY_MEDIUM))
                            ], else_=literal(PriorityQueue.PRIORITY_LOW)),
                        Submission.timestamp,
-                       Testcase.codename)\
-        .all()
+                       Testcase.codename)
 
-    for data in to_evaluate:
+    for data in to_evaluate.yield_per(SWEEP_BATCH_SIZE):
         submission_id, dataset_id, priority, timestamp, codename = data
-        operations.append((
-            ESOperation(
-                ESOperation.EVALUATION, submission_id, dataset_id, codename),
-            priority, timestamp))
-
-    return operations
+        yield ESOperation(ESOperation.EVALUATION,
+                          submission_id, dataset_id, codename), \
+            priority, timestamp
 
 
-def get_user_tests_operations(session, contest_id=None):
+def get_user_tests_operations(session, contest_id=None, min_user_test_id=None,
+                              task_filter=None):
     """Return all the operations to do for user tests in the contest.
 
+    The rows are fetched from the database a few at a time, while the
+    operations are consumed.
+
     session (Session): the database session to use.
     contest_id (int|None): the contest for which we want the operations.
         If none, get operations for any contest.
+    min_user_test_id (int|None): if given, only look at the user tests
+        with at least this id.
+    task_filter (ColumnElement|None): if given, only look at the user
+        tests for the tasks satisfying this condition.
 
-    return ([ESOperation, float, int]): a list of operation, timestamp
-        and priority.
+    yield ((ESOperation, int, datetime)): the operations, with their
+        priority and timestamp.
 
     """
-    operations = []
-
     if contest_id is None:
         contest_filter = literal(True)
     else:
         contest_filter = Task.contest_id == contest_id
+    if task_filter is not None:
+        contest_filter = contest_filter & task_filter
+    if min_user_test_id is None:
+        id_filter = literal(True)
+    else:
+        id_filter = UserTest.id >= min_user_test_id
 
     # Retrieve the compilation operations for all user tests without
     # the corresponding result for a dataset to judge. Since we have
@@ -420,7 +525,7 @@ def get_user_tests_operations(session, contest_id=None):
                    (Dataset.id == UserTestResult.dataset_id) &
                    (UserTest.id == UserTestResult.user_test_id))\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (UserTestResult.dataset_id.is_(None)))\
         .with_entities(UserTest.id, Dataset.id,
@@ -428,17 +533,16 @@ def get_user_tests_operations(session, contest_id=None):
                            (Dataset.id != Task.active_dataset_id,
                             literal(PriorityQueue.PRIORITY_EXTRA_LOW))
                            ], else_=literal(PriorityQueue.PRIORITY_HIGH)),
-                       UserTest.timestamp)\
-        .all()
+                       UserTest.timestamp)
 
     # Retrieve all the compilation operations for user_tests
     # already having a result for a dataset to judge.
-    to_compile += session.query(UserTest)\
+    to_compile_again = session.query(UserTest)\
         .join(UserTest.task)\
         .join(UserTest.results)\
         .join(UserTestResult.dataset)\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (FILTER_USER_TEST_RESULTS_TO_COMPILE))\
         .with_entities(UserTest.id, Dataset.id,
@@ -448,15 +552,14 @@ def get_user_tests_operations(session, contest_id=None):
                            (UserTestResult.compilation_tries == 0,
                             literal(PriorityQueue.PRIORITY_HIGH))
                            ], else_=literal(PriorityQueue.PRIORITY_MEDIUM)),
-                       UserTest.timestamp)\
-        .all()
+                       UserTest.timestamp)
 
-    for data in to_compile:
-        user_test_id, dataset_id, priority, timestamp = data
-        operations.append((
-            ESOperation(ESOperation.USER_TEST_COMPILATION,
-                        user_test_id, dataset_id),
-            priority, timestamp))
+    for query in [to_compile, to_compile_again]:
+        for data in query.yield_per(SWEEP_BATCH_SIZE):
+            user_test_id, dataset_id, priority, timestamp = data
+            yield ESOperation(ESOperation.USER_TEST_COMPILATION,
+                              user_test_id, dataset_id), \
+                priority, timestamp
 
     # Retrieve all the evaluation operations for a dataset to judge,
     # that is, all pairs (user_test, dataset) for which we have a
@@ -466,7 +569,7 @@ def get_user_tests_operations(session, contest_id=None):
         .join(UserTest.results)\
         .join(UserTestResult.dataset)\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (FILTER_USER_TEST_RESULTS_TO_EVALUATE))\
         .with_entities(UserTest.id, Dataset.id,
@@ -476,21 +579,30 @@ def get_user_tests_operations(session, contest_id=None):
                            (UserTestResult.evaluation_tries == 0,
                             literal(PriorityQueue.PRIORITY_MEDIUM))
                            ], else_=literal(PriorityQueue.PRIORITY_LOW)),
-                       UserTest.timestamp)\
-        .all()
+                       UserTest.timestamp)
 
-    for data in to_evaluate:
+    for data in to_evaluate.yield_per(SWEEP_BATCH_SIZE):
         user_test_id, dataset_id, priority, timestamp = data
-        operations.append((
-            ESOperation(
-                ESOperation.USER_TEST_EVALUATION, user_test_id, dataset_id),
-            priority, timestamp))
+        yield ESOperation(ESOperation.USER_TEST_EVALUATION,
+                          user_test_id, dataset_id), \
+            priority, timestamp
 
-    return operations
+
+# Canonical instances of the dataset ids of the operations, so that the
+# (possibly millions of) queued operations share them.
+_DATASET_IDS = {}
 
 
 class ESOperation(QueueItem):
 
+    # A rejudge can queue hundreds of thousands of operations: avoid
+    # a __dict__ per instance and share the repeated values.
+    # side_data is not part of the identity of the operation: ES
+    # attaches to it the priority and timestamp of its queue entry
+    # while it is in execution, to re-enqueue it if needed.
+    __slots__ = ("type_", "object_id", "dataset_id", "testcase_codename",
+                 "side_data")
+
     COMPILATION = "compile"
     EVALUATION = "evaluate"
     USER_TEST_COMPILATION = "compile_test"
@@ -498,10 +610,12 @@ class ESOperation(QueueItem):
 
     # Testcase codename is only needed for EVALUATION type of operation
     def __init__(self, type_, object_id, dataset_id, testcase_codename=None):
-        self.type_ = type_
+        self.type_ = sys.intern(type_)
         self.object_id = object_id
-        self.dataset_id = dataset_id
-        self.testcase_codename = testcase_codename
+        self.dataset_id = _DATASET_IDS.setdefault(dataset_id, dataset_id)
+        self.testcase_codename = sys.intern(testcase_codename) \
+            if testcase_codename is not None else None
+        self.side_data = None
 
     @staticmethod
     def from_dict(d):
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Partition of the work among the shards of EvaluationService.
+
+When more than one shard of EvaluationService is configured, each of
+them judges the submissions and user tests of its own tasks, with its
+own workers. Tasks are assigned to the shards by their id, or by the
+id of their contest (according to config.evaluation_partition),
+modulo the number of shards; workers likewise by their shard number.
+
+"""
+
+from sqlalchemy import func, literal
+
+from cms import config, get_service_shards
+from cms.db import Task
+
+
+def get_shard_count():
+    """Return the number of shards of EvaluationService.
+
+    return (int): the number of shards (at least one).
+
+    """
+    return max(get_service_shards("EvaluationService"), 1)
+
+
+def get_partition():
+    """Return what determines which shard judges each task.
+
+    return ((int, str)): the number of shards and the kind of
+        partition (config.evaluation_partition).
+
+    """
+    return get_shard_count(), config.evaluation_partition
+
+
+def get_task_shard(task):
+    """Return the shard of EvaluationService judging a task.
+
+    task (Task): a task.
+
+    return (int): the shard.
+
+    """
+    if config.evaluation_partition == "contest":
+        key = task.contest_id if task.contest_id is not None else 0
+    else:
+        key = task.id
+    return key % get_shard_count()
+
+
+def get_task_filter(shard):
+    """Return a condition selecting the tasks judged by a shard.
+
+    shard (int): a shard of EvaluationService.
+
+    return (ColumnElement): a condition on Task.
+
+    """
+    count = get_shard_count()
+    if count == 1:
+        return literal(True)
+    if config.evaluation_partition == "contest":
+        key = func.coalesce(Task.contest_id, 0)
+    else:
+        key = Task.id
+    return key % count == shard
+
+
+def get_worker_shard(worker_shard):
+    """Return the shard of EvaluationService a worker works for.
+
+    worker_shard (int): the shard of the worker.
+
+    return (int): the shard of EvaluationService.
+
+    """
+    return worker_shard % get_shard_count()
+
+
+def get_workers(shard):
+    """Return the workers of a shard of EvaluationService.
+
+    shard (int): a shard of EvaluationService.
+
+    return ([int]): the shards of its workers.
+
+    """
+    return [worker_shard
+            for worker_shard in range(get_service_shards("Worker"))
+            if get_worker_shard(worker_shard) == shard]
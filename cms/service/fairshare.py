@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fair share scheduling of the operations of EvaluationService.
+
+When config.evaluation_fair_share is not empty, the queue of ES is a
+FairShareQueue: the operations with the same priority are split in
+shares, by participation and/or by task, that take turns, so that a
+user resubmitting many times or a task with many testcases does not
+delay the others. The latency to the first verdict of each
+participation is tracked to see the effect.
+
+"""
+
+import math
+from collections import OrderedDict, deque
+
+from cms import config
+
+
+def get_share(participation_id, task_id):
+    """Return the share of an operation.
+
+    participation_id (int): the participation of the operation.
+    task_id (int): the task of the operation.
+
+    return ((int, ...)): the share, a tuple with the ids of the
+        objects listed in config.evaluation_fair_share.
+
+    """
+    ids = {"participation": participation_id, "task": task_id}
+    return tuple(ids[kind] for kind in config.evaluation_fair_share)
+
+
+def get_share_weight(share):
+    """Return the weight of a share.
+
+    The weight is the product of the ones given in
+    config.evaluation_fair_share_weights to the objects of the share
+    (e.g., "participation:12" or "task:3"), which default to 1.
+
+    share ((int, ...)): a share, as returned by get_share.
+
+    return (float): the weight.
+
+    """
+    weight = 1.0
+    for kind, id_ in zip(config.evaluation_fair_share, share):
+        weight *= config.evaluation_fair_share_weights.get(
+            "%s:%s" % (kind, id_), 1.0)
+    return weight
+
+
+class LatencyTracker:
+
+    """Latencies of a set of objects, grouped by key.
+
+    Only the first latency of each object is recorded, and only the
+    latest ones for each key are kept. The objects already recorded
+    are remembered up to a limit, forgetting the oldest ones.
+
+    """
+
+    # How many latencies are kept for each key.
+    MAX_SAMPLES = 1000
+    # How many recorded objects are remembered.
+    MAX_RECORDED = 100000
+
+    def __init__(self):
+        # The latest latencies of each key.
+        self._samples = {}
+        # The objects whose latency was recorded, oldest first.
+        # Type: OrderedDict {object: None}
+        self._recorded = OrderedDict()
+
+    def record(self, key, object_id, latency):
+        """Record the latency of an object, if it is the first one.
+
+        key (object): the group of the object (e.g., the participation
+            id).
+        object_id (object): the object (e.g., the submission id).
+        latency (float): the latency, in seconds.
+
+        return (bool): whether the latency was recorded.
+
+        """
+        if object_id in self._recorded:
+            return False
+        self._recorded[object_id] = None
+        while len(self._recorded) > LatencyTracker.MAX_RECORDED:
+            self._recorded.popitem(last=False)
+        self._samples.setdefault(
+            key, deque(maxlen=LatencyTracker.MAX_SAMPLES)).append(latency)
+        return True
+
+    @staticmethod
+    def percentile(samples, p):
+        """Return a percentile of some samples (nearest rank).
+
+        samples ([float]): the samples, sorted and not empty.
+        p (float): the percentile, between 0 and 100.
+
+        return (float): the percentile.
+
+        """
+        rank = max(int(math.ceil(p / 100.0 * len(samples))), 1)
+        return samples[rank - 1]
+
+    def get_status(self):
+        """Return the statistics of the latencies of each key.
+
+        return ({str: {str: float}}): for each key, the number of
+            latencies kept ("count") and their median ("p50"), 95th
+            percentile ("p95") and maximum ("max").
+
+        """
+        status = {}
+        for key, samples in self._samples.items():
+            samples = sorted(samples)
+            status[str(key)] = {
+                "count": len(samples),
+                "p50": self.percentile(samples, 50),
+                "p95": self.percentile(samples, 95),
+                "max": samples[-1]}
+        return status
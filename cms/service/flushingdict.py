@@ -82,6 +82,10 @@ class FlushingDict:
         self.callback(list(self.fd.items()))
         self.fd = dict()
 
+    def keys(self):
+        with self.d_lock:
+            return list(self.d) + list(self.fd)
+
     def __contains__(self, key):
         with self.d_lock:
             return key in self.d or key in self.fd
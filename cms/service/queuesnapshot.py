@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Snapshots of the operations of EvaluationService.
+
+ES periodically saves to a local file the operations in its queue or
+being executed, together with where its sweeper is at, so that after
+a restart it can resume them right away, instead of waiting for a
+sweep of all the submissions to find them again. The database stays
+the authority on what is to do: the snapshot is only a hint, that ES
+checks lazily after restoring it. Snapshots taken with a different
+partition of the tasks among the shards are ignored, as their
+operations may belong to other shards.
+
+"""
+
+import json
+import logging
+import os
+
+from cmscommon.datetime import make_datetime, make_timestamp
+from .esoperations import ESOperation
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bumped when the format changes; snapshots in other formats are
+# ignored.
+SNAPSHOT_VERSION = 2
+
+
+def save_queue_snapshot(path, contest_id, partition, operations,
+                        min_submission_id, min_user_test_id):
+    """Write a snapshot, replacing the previous one atomically.
+
+    path (str): the file to write.
+    contest_id (int|None): the contest ES is running for, if any.
+    partition ((int, str)): the partition of the tasks among the
+        shards of ES (see espartition.get_partition).
+    operations ([(ESOperation, int, datetime)]): the operations, each
+        with its priority and timestamp.
+    min_submission_id (int|None): the first submission the sweeper
+        looks at, or None for all of them.
+    min_user_test_id (int|None): the same, for user tests.
+
+    raise (OSError): if the snapshot cannot be written.
+
+    """
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "contest_id": contest_id,
+        "partition": list(partition),
+        "operations": [[operation.to_dict(), priority,
+                        make_timestamp(timestamp)]
+                       for operation, priority, timestamp in operations],
+        "min_submission_id": min_submission_id,
+        "min_user_test_id": min_user_test_id,
+    }
+    temp_path = "%s.tmp" % path
+    with open(temp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def load_queue_snapshot(path, contest_id, partition):
+    """Read a snapshot.
+
+    path (str): the file to read.
+    contest_id (int|None): the contest ES is running for, if any;
+        snapshots taken for another contest are ignored.
+    partition ((int, str)): the current partition of the tasks among
+        the shards of ES; snapshots taken with another one are
+        ignored.
+
+    return ((list, int|None, int|None)|None): the operations (as in
+        save_queue_snapshot), the first submission and the first user
+        test the sweeper looks at; or None if there is no usable
+        snapshot.
+
+    """
+    try:
+        with open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning("Cannot read the queue snapshot %s.", path,
+                       exc_info=True)
+        return None
+
+    try:
+        if data["version"] != SNAPSHOT_VERSION:
+            logger.warning("Ignoring queue snapshot %s in format %s.",
+                           path, data["version"])
+            return None
+        if data["contest_id"] != contest_id:
+            logger.warning("Ignoring queue snapshot %s taken for contest "
+                           "%s.", path, data["contest_id"])
+            return None
+        if data["partition"] != list(partition):
+            logger.warning("Ignoring queue snapshot %s taken with %s "
+                           "shard(s) partitioned by %s.", path,
+                           *data["partition"])
+            return None
+        operations = [(ESOperation.from_dict(operation), priority,
+                       make_datetime(timestamp))
+                      for operation, priority, timestamp
+                      in data["operations"]]
+        return operations, data["min_submission_id"], \
+            data["min_user_test_id"]
+    except (KeyError, TypeError, ValueError):
+        logger.warning("Invalid queue snapshot %s.", path, exc_info=True)
+        return None
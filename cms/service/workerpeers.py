@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Distribution of the cached files among the workers.
+
+Each file is assigned, based on its digest, to a "home" worker among
+those in the configuration. A worker missing a file asks its home
+worker for it, and the home worker takes it from the backend if it
+does not have it either (once, even if asked many times at once). In
+this way the backend serves each file roughly once for all workers.
+
+"""
+
+import base64
+import io
+import logging
+
+import gevent
+
+from cms import ServiceCoord, get_service_shards
+
+
+logger = logging.getLogger(__name__)
+
+
+class PeerFile(io.RawIOBase):
+    """A read-only file-like object with the content of a file in the
+    cache of another worker, transferred in chunks through RPCs.
+
+    """
+
+    def __init__(self, peers, client, digest):
+        """Initialize.
+
+        peers (WorkerPeers): the object that created this.
+        client (RemoteServiceClient): the worker holding the file.
+        digest (str): the digest of the file.
+
+        """
+        io.RawIOBase.__init__(self)
+        self._peers = peers
+        self._client = client
+        self._digest = digest
+        self._offset = 0
+        self._buffer = b""
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if len(self._buffer) == 0 and not self._eof:
+            data = self._peers.get_chunk(
+                self._client, self._digest, self._offset)
+            self._offset += len(data)
+            self._buffer = data
+            self._eof = len(data) < WorkerPeers.CHUNK_SIZE
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class WorkerPeers:
+    """The other workers, as a source of files for a FileCacher.
+
+    """
+
+    # Size of the chunks of the transfers between workers; the RPC
+    # messages containing them (in base64) must not exceed the maximum
+    # message size of the RPC layer.
+    CHUNK_SIZE = 512 * 1024
+
+    # Seconds to wait for each chunk. The first chunk may require the
+    # home worker to fetch the whole file from the backend.
+    FIRST_CHUNK_TIMEOUT = 600.0
+    CHUNK_TIMEOUT = 30.0
+
+    def __init__(self, service):
+        """Initialize, connecting to all the other workers.
+
+        service (Worker): the worker using this object.
+
+        """
+        self._shard = service.shard
+        self._shards = list(range(get_service_shards("Worker")))
+        self._workers = dict(
+            (shard, service.connect_to(ServiceCoord("Worker", shard)))
+            for shard in self._shards if shard != self._shard)
+
+    def get_home(self, digest):
+        """Return the shard of the worker responsible for a file.
+
+        digest (str): the digest of the file.
+
+        return (int|None): the shard of the home worker, or None if
+            there are no workers in the configuration.
+
+        """
+        if len(self._shards) == 0:
+            return None
+        return self._shards[int(digest[:8], 16) % len(self._shards)]
+
+    def get_file(self, digest):
+        """Return the content of a file from its home worker.
+
+        digest (str): the digest of the file.
+
+        return (fileobj): a readable binary file-like object.
+
+        raise (KeyError): if the file must not or cannot be taken from
+            its home worker (for example, if we are its home worker).
+
+        """
+        home = self.get_home(digest)
+        client = self._workers.get(home)
+        if client is None:
+            raise KeyError("We are the home worker of this file.")
+        if not client.connected:
+            raise KeyError("Worker %s is not connected." % home)
+        return PeerFile(self, client, digest)
+
+    def get_chunk(self, client, digest, offset):
+        """Get a chunk of a file from a worker.
+
+        client (RemoteServiceClient): the worker holding the file.
+        digest (str): the digest of the file.
+        offset (int): the position of the chunk in the file.
+
+        return (bytes): the chunk, shorter than CHUNK_SIZE only at the
+            end of the file.
+
+        raise (KeyError): if the worker cannot provide the file.
+        raise (OSError): if the transfer failed.
+
+        """
+        timeout = WorkerPeers.FIRST_CHUNK_TIMEOUT if offset == 0 \
+            else WorkerPeers.CHUNK_TIMEOUT
+        try:
+            data = client.get_file_chunk(
+                digest=digest, offset=offset,
+                size=WorkerPeers.CHUNK_SIZE).get(timeout=timeout)
+        except gevent.Timeout:
+            raise OSError("Timeout getting file %s from %s."
+                          % (digest, client.remote_service_coord))
+        except Exception as error:
+            raise OSError("Error getting file %s from %s: %s."
+                          % (digest, client.remote_service_coord, error))
+        if data is None:
+            raise KeyError("File %s not available from %s."
+                           % (digest, client.remote_service_coord))
+        return base64.b64decode(data)
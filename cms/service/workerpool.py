@@ -27,19 +27,180 @@
 
 import logging
 import random
+import time
+from collections import OrderedDict, defaultdict
 from datetime import timedelta
 
 import gevent.lock
 from gevent.event import Event
 
+from cms import config
 from cms.db import SessionGen
 from cms.grading.Job import JobGroup
 from cmscommon.datetime import make_datetime, make_timestamp
+from .esoperations import ESOperation
 
 
 logger = logging.getLogger(__name__)
 
 
+class WorkerAffinity:
+    """Memory of the workers likely to have in their cache the files
+    needed by an operation.
+
+    The worker that compiled a submission (or user test) against a
+    dataset holds its executables, and the workers recently given
+    operations on a dataset hold its testcases and managers.
+
+    """
+
+    # How many submissions and user tests to remember, and how many
+    # workers for each dataset.
+    MAX_OBJECTS = 10000
+    WORKERS_PER_DATASET = 3
+
+    # How much having compiled the object weighs in the score of a
+    # worker, compared to having recently worked on its dataset.
+    OBJECT_WEIGHT = 2
+
+    def __init__(self):
+        # The last worker given an operation on each object, and on
+        # each dataset the last workers, most recent first.
+        # Type: OrderedDict {(bool, int, int): int}
+        self._objects = OrderedDict()
+        # Type: {int: [int]}
+        self._datasets = {}
+
+    @staticmethod
+    def _object_key(operation):
+        return (operation.for_submission(), operation.object_id,
+                operation.dataset_id)
+
+    def record(self, shard, operations):
+        """Remember that a worker was given some operations.
+
+        shard (int): the worker.
+        operations ([ESOperation]): the operations given to it.
+
+        """
+        for operation in operations:
+            key = WorkerAffinity._object_key(operation)
+            self._objects.pop(key, None)
+            self._objects[key] = shard
+            while len(self._objects) > WorkerAffinity.MAX_OBJECTS:
+                self._objects.popitem(last=False)
+            recent = self._datasets.setdefault(operation.dataset_id, [])
+            if shard in recent:
+                recent.remove(shard)
+            recent.insert(0, shard)
+            del recent[WorkerAffinity.WORKERS_PER_DATASET:]
+
+    def get_scores(self, operations):
+        """Return how suited each worker is to some operations.
+
+        operations ([ESOperation]): the operations to assign.
+
+        return ({int: int}): the positive score of each worker that
+            likely has some of the files needed by the operations.
+
+        """
+        scores = defaultdict(int)
+        for operation in operations:
+            shard = self._objects.get(WorkerAffinity._object_key(operation))
+            if shard is not None:
+                scores[shard] += WorkerAffinity.OBJECT_WEIGHT
+            for shard in self._datasets.get(operation.dataset_id, []):
+                scores[shard] += 1
+        return scores
+
+    def get_holders(self, operations):
+        """Return the workers that were given operations on the same
+        objects, and so hold their executables.
+
+        operations ([ESOperation]): the operations to assign.
+
+        return ({int}): the workers.
+
+        """
+        holders = set()
+        for operation in operations:
+            shard = self._objects.get(WorkerAffinity._object_key(operation))
+            if shard is not None:
+                holders.add(shard)
+        return holders
+
+
+class OperationDurations:
+    """Estimates of how long the operations take, learnt from the time
+    the workers take to execute batches of them.
+
+    The estimates are exponential moving averages of the wall time per
+    operation in the batches, for each type of operation on each
+    dataset, and for each type of operation overall.
+
+    """
+
+    # Weight of a new observation in the averages.
+    ALPHA = 0.2
+
+    # Estimates, in seconds, for the operations of types never seen.
+    DEFAULTS = {
+        ESOperation.COMPILATION: 5.0,
+        ESOperation.EVALUATION: 1.0,
+        ESOperation.USER_TEST_COMPILATION: 5.0,
+        ESOperation.USER_TEST_EVALUATION: 1.0,
+    }
+
+    def __init__(self):
+        # Type: {(str, int): float}
+        self._by_dataset = {}
+        # Type: {str: float}
+        self._by_type = {}
+
+    @staticmethod
+    def _update(averages, key, value):
+        previous = averages.get(key)
+        if previous is None:
+            averages[key] = value
+        else:
+            averages[key] = previous + OperationDurations.ALPHA * (
+                value - previous)
+
+    def record(self, operations, wall_time):
+        """Learn from the execution of a batch of operations.
+
+        operations ([ESOperation]): the operations in the batch.
+        wall_time (float): the seconds the batch took.
+
+        """
+        if len(operations) == 0:
+            return
+        per_operation = wall_time / len(operations)
+        keys = set((operation.type_, operation.dataset_id)
+                   for operation in operations)
+        for key in keys:
+            OperationDurations._update(self._by_dataset, key, per_operation)
+        for type_ in set(key[0] for key in keys):
+            OperationDurations._update(self._by_type, type_, per_operation)
+
+    def estimate(self, operation):
+        """Return how long an operation is expected to take.
+
+        operation (ESOperation): the operation.
+
+        return (float): the expected wall time, in seconds, of the
+            operation when executed in a batch.
+
+        """
+        estimate = self._by_dataset.get(
+            (operation.type_, operation.dataset_id))
+        if estimate is None:
+            estimate = self._by_type.get(operation.type_)
+        if estimate is None:
+            estimate = OperationDurations.DEFAULTS.get(operation.type_, 1.0)
+        return estimate
+
+
 class WorkerPool:
     """This class keeps the state of the workers attached to ES, and
     allow the ES to get a usable worker when it needs it.
@@ -78,6 +239,12 @@ class WorkerPool:
         self._schedule_disabling = {}
         # Type: {int: bool}
         self._ignore = {}
+        # The last progress of precaching reported by each worker.
+        # Type: {int: dict|None}
+        self._precache = {}
+        # The last status of its slots reported by each worker.
+        # Type: {int: [dict]|None}
+        self._slots = {}
 
         # TODO: given the number of pieces data associated to each
         # worker, this class could be simplified by creating a new
@@ -87,6 +254,19 @@ class WorkerPool:
         # checks cannot be excluded. A refactoring of this class
         # should take that into account.
 
+        # Where the files needed by the operations likely are; when
+        # the suited workers are all busy, until when (in monotonic
+        # time) we wait for one of them before using any other; and
+        # how the operations have been placed so far.
+        self._affinity = WorkerAffinity()
+        self._affinity_deadline = None
+        self._placement_stats = {
+            "hits": 0, "misses": 0, "no_affinity": 0, "waits": 0}
+
+        # How long the operations take, from the batches executed so
+        # far.
+        self._durations = OperationDurations()
+
         # A reverse lookup dictionary mapping operations to shards.
         # Type: {ESOperation: int}
         self._operations_reverse = dict()
@@ -107,6 +287,27 @@ class WorkerPool:
     def __contains__(self, operation):
         return operation in self._operations_reverse
 
+    def count_active_workers(self):
+        """Return the number of workers that can receive operations.
+
+        return (int): the number of connected and enabled workers.
+
+        """
+        return sum(1 for shard, operation in self._operations.items()
+                   if operation != WorkerPool.WORKER_DISABLED
+                   and self._worker[shard].connected)
+
+    def estimate_duration(self, operation):
+        """Return how long an operation is expected to take.
+
+        operation (ESOperation): the operation.
+
+        return (float): the expected wall time, in seconds, of the
+            operation when executed in a batch.
+
+        """
+        return self._durations.estimate(operation)
+
     def _remove_operations(self, shard, new_operation):
         """Safely remove operations from a worker, assigning a new status.
 
@@ -137,8 +338,15 @@ class WorkerPool:
                 self._operations_reverse[operation] = shard
 
     def wait_for_workers(self):
-        """Wait until a worker might be available."""
-        self._workers_available_event.wait()
+        """Wait until a worker might be available (or, if we are
+        waiting for a worker suited to the operations, until we stop
+        waiting for it).
+
+        """
+        timeout = None
+        if self._affinity_deadline is not None:
+            timeout = max(0.0, self._affinity_deadline - time.monotonic())
+        self._workers_available_event.wait(timeout)
 
     def add_worker(self, worker_coord):
         """Add a new worker to the worker pool.
@@ -158,6 +366,8 @@ class WorkerPool:
         self._start_time[shard] = None
         self._schedule_disabling[shard] = False
         self._ignore[shard] = False
+        self._precache[shard] = None
+        self._slots[shard] = None
         self._workers_available_event.set()
         logger.debug("Worker %s added.", shard)
 
@@ -196,15 +406,14 @@ class WorkerPool:
         """
         # We look for an available worker.
         try:
-            shard = self.find_worker(WorkerPool.WORKER_INACTIVE,
-                                     require_connection=True,
-                                     random_worker=True)
+            shard = self._choose_worker(operations)
         except LookupError:
             self._workers_available_event.clear()
             return None
 
         # Then we fill the info for future memory.
         self._add_operations(shard, operations)
+        self._affinity.record(shard, operations)
 
         logger.debug("Worker %s acquired.", shard)
         self._start_time[shard] = make_datetime()
@@ -218,10 +427,105 @@ class WorkerPool:
 
         self._worker[shard].execute_job_group(
             job_group_dict=job_group_dict,
+            stream=config.worker_stream_results,
             callback=self._service.action_finished,
             plus=shard)
         return shard
 
+    def _choose_worker(self, operations):
+        """Choose the available worker to assign operations to.
+
+        We prefer the worker most likely to have in its cache the files
+        needed by the operations (see WorkerAffinity). If none of the
+        available workers is suited, but a busy one holds the
+        executables of the operations, we wait worker_affinity_wait_s
+        seconds for it to become available before choosing any
+        available worker at random. Having recently worked on the same
+        dataset is not reason enough to wait: with one busy dataset,
+        the few workers remembered for it are almost always busy.
+
+        operations ([ESOperation]): the operations to assign.
+
+        return (int): the shard of the chosen worker.
+
+        raise (LookupError): if no worker is available, or if we are
+            waiting for a suited worker.
+
+        """
+        available = [shard for shard, operation in self._operations.items()
+                     if operation == WorkerPool.WORKER_INACTIVE
+                     and self._worker[shard].connected]
+        if len(available) == 0:
+            raise LookupError("No workers available.")
+
+        scores = self._affinity.get_scores(operations)
+        suited = [shard for shard in available if shard in scores]
+        if len(suited) > 0:
+            self._affinity_deadline = None
+            self._placement_stats["hits"] += 1
+            return max(suited, key=lambda shard: (scores[shard],
+                                                  random.random()))
+
+        busy_holder = any(
+            isinstance(self._operations.get(shard), list)
+            and self._worker[shard].connected
+            for shard in self._affinity.get_holders(operations))
+        if busy_holder:
+            now = time.monotonic()
+            if self._affinity_deadline is None:
+                self._affinity_deadline = \
+                    now + config.worker_affinity_wait_s
+                self._placement_stats["waits"] += 1
+            if now < self._affinity_deadline:
+                raise LookupError("Waiting for a suited worker.")
+            self._placement_stats["misses"] += 1
+        elif len(scores) > 0:
+            self._placement_stats["misses"] += 1
+        else:
+            self._placement_stats["no_affinity"] += 1
+        self._affinity_deadline = None
+        return random.choice(available)
+
+    def get_placement_status(self):
+        """Return statistics about the placement of the operations.
+
+        return (dict): how many batches of operations went to a worker
+            likely having their files (hits), to another worker as
+            those were busy, possibly after waiting in vain for one
+            (misses), or to any worker as none was known to have their
+            files (no_affinity); how many times
+            we waited for a suited worker; and the ratio of hits among
+            the batches that had a suited worker.
+
+        """
+        result = dict(self._placement_stats)
+        placed = result["hits"] + result["misses"]
+        result["hit_rate"] = result["hits"] / placed if placed > 0 else None
+        return result
+
+    def accept_streamed_result(self, shard, operation):
+        """Decide whether to accept the result of an operation sent by
+        a worker before the end of its group.
+
+        If accepted, the result for the operation in the group sent at
+        the end is going to be ignored, and the operation is not lost
+        if the worker is.
+
+        shard (int): the worker sending the result.
+        operation (ESOperation): the operation of the result.
+
+        return (bool): whether the result is to be used.
+
+        """
+        with self._operation_lock:
+            if self._ignore[shard] \
+                    or not isinstance(self._operations[shard], list) \
+                    or operation not in self._operations[shard] \
+                    or operation in self._operations_to_ignore[shard]:
+                return False
+            self._operations_to_ignore[shard].append(operation)
+            return True
+
     def release_worker(self, shard):
         """To be called by ES when it receives a notification that an
         operation finished.
@@ -247,6 +551,13 @@ class WorkerPool:
         if self._operations[shard] == WorkerPool.WORKER_DISABLED:
             return True
 
+        operations = self._operations[shard]
+        if isinstance(operations, list) and \
+                self._start_time[shard] is not None:
+            self._durations.record(
+                operations,
+                (make_datetime() - self._start_time[shard]).total_seconds())
+
         ret = self._ignore[shard]
         with self._operation_lock:
             to_ignore = self._operations_to_ignore[shard]
@@ -315,6 +626,16 @@ class WorkerPool:
                          "that cannot be found.", operation)
             raise
 
+    def get_operations(self):
+        """Return the operations assigned to the workers.
+
+        return ([ESOperation]): the operations, each with the side
+            data it had when it was assigned.
+
+        """
+        with self._operation_lock:
+            return list(self._operations_reverse)
+
     def get_status(self):
         """Returns a dict with info about the current status of all
         workers.
@@ -335,9 +656,45 @@ class WorkerPool:
                                for operation in self._operations[shard]]
                 if isinstance(self._operations[shard], list)
                 else self._operations[shard],
-                'start_time': s_time}
+                'start_time': s_time,
+                'precache': self._precache[shard],
+                'slots': self._slots[shard]}
         return result
 
+    def set_precache_progress(self, shard, contest_id, done, total):
+        """Record the progress of a worker in precaching files.
+
+        shard (int): the worker reporting.
+        contest_id (int): the contest whose files are being cached.
+        done (int): how many files have been processed.
+        total (int): how many files are to be processed.
+
+        raise (ValueError): if the worker is unknown.
+
+        """
+        if shard not in self._worker:
+            raise ValueError("Worker %s unknown." % shard)
+        self._precache[shard] = {
+            'contest_id': contest_id,
+            'done': done,
+            'total': total,
+            'warm': done == total,
+            'time': make_timestamp()}
+
+    def set_slots_status(self, shard, slots):
+        """Record the status of the slots of a worker.
+
+        shard (int): the worker reporting.
+        slots ([dict]): the status of each slot, as returned by
+            Worker.get_slots_status.
+
+        raise (ValueError): if the worker is unknown.
+
+        """
+        if shard not in self._worker:
+            raise ValueError("Worker %s unknown." % shard)
+        self._slots[shard] = slots
+
     def check_timeouts(self):
         """Check if some worker is not responding in too much time. If
         this is the case, the worker is scheduled for disabling, and
@@ -459,7 +816,10 @@ class WorkerPool:
                         WorkerPool.WORKER_DISABLED,
                         WorkerPool.WORKER_INACTIVE]:
                 if not self._ignore[shard]:
-                    lost_operations += self._operations[shard]
+                    lost_operations += [
+                        operation for operation in self._operations[shard]
+                        if operation not in
+                        self._operations_to_ignore[shard]]
                 self.release_worker(shard)
 
         return lost_operations
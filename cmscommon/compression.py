@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Streaming compression of file-like objects.
+
+Compressed files are identified by the name of their format (as
+stored, for example, in FSObject.compression), None meaning that the
+file is not compressed.
+
+"""
+
+import io
+import zlib
+
+
+__all__ = [
+    "COMPRESSION_ZLIB", "COMPRESSION_FORMATS",
+    "CompressingWriter", "DecompressingReader", "open_decompressed",
+]
+
+
+COMPRESSION_ZLIB = "zlib"
+
+# For each format, the functions returning a new compressor and a new
+# decompressor object (with the interface of those of zlib).
+_CODECS = {
+    COMPRESSION_ZLIB: (lambda: zlib.compressobj(6), zlib.decompressobj),
+}
+
+COMPRESSION_FORMATS = sorted(_CODECS.keys())
+
+
+def _get_codec(compression):
+    """Return the codec of a format, or raise ValueError."""
+    try:
+        return _CODECS[compression]
+    except KeyError:
+        raise ValueError("Unknown compression format %r." % compression)
+
+
+class CompressingWriter(io.RawIOBase):
+    """A writable binary file-like object compressing what is written
+    to it into another one.
+
+    Closing this object terminates the compressed stream and closes
+    the underlying file-like object, which is available as the fobj
+    attribute. The size of the uncompressed content written so far is
+    available as the size attribute.
+
+    """
+
+    def __init__(self, fobj, compression):
+        """Initialize.
+
+        fobj (fileobj): a writable binary file-like object.
+        compression (str): the compression format.
+
+        raise (ValueError): if the format is not known.
+
+        """
+        io.RawIOBase.__init__(self)
+        self.fobj = fobj
+        self.size = 0
+        self._compressor = _get_codec(compression)[0]()
+
+    def writable(self):
+        return True
+
+    def _write_all(self, data):
+        while len(data) > 0:
+            written = self.fobj.write(data)
+            if written is None:
+                break
+            data = data[written:]
+
+    def write(self, b):
+        self._write_all(self._compressor.compress(bytes(b)))
+        self.size += len(b)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._write_all(self._compressor.flush())
+        finally:
+            io.RawIOBase.close(self)
+            self.fobj.close()
+
+
+class DecompressingReader(io.RawIOBase):
+    """A readable binary file-like object with the decompressed
+    content of another one.
+
+    Closing this object closes the underlying file-like object.
+
+    """
+
+    # How much compressed data to read, and the maximum amount of
+    # data to decompress, at once.
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fobj, compression):
+        """Initialize.
+
+        fobj (fileobj): a readable binary file-like object.
+        compression (str): the compression format.
+
+        raise (ValueError): if the format is not known.
+
+        """
+        io.RawIOBase.__init__(self)
+        self.fobj = fobj
+        self._decompressor = _get_codec(compression)[1]()
+        self._buffer = b""
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        """Decompress some data, until some is available or the end
+        of the stream is reached.
+
+        raise (OSError): if the compressed stream is truncated or
+            corrupted.
+
+        """
+        while len(self._buffer) == 0 and not self._eof:
+            data = self._decompressor.unconsumed_tail
+            if len(data) == 0:
+                data = self.fobj.read(self.CHUNK_SIZE)
+            try:
+                if len(data) == 0:
+                    self._buffer = self._decompressor.flush()
+                    self._eof = True
+                    if not self._decompressor.eof:
+                        raise OSError("Truncated compressed file.")
+                else:
+                    self._buffer = self._decompressor.decompress(
+                        data, self.CHUNK_SIZE)
+            except zlib.error as error:
+                raise OSError("Corrupted compressed file: %s." % error)
+
+    def readinto(self, b):
+        self._fill()
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.fobj.close()
+        finally:
+            io.RawIOBase.close(self)
+
+
+def open_decompressed(fobj, compression):
+    """Return the decompressed content of a file-like object.
+
+    fobj (fileobj): a readable binary file-like object.
+    compression (str|None): the compression format of its content, or
+        None if it is not compressed.
+
+    return (fileobj): fobj itself if compression is None, otherwise a
+        DecompressingReader on it.
+
+    """
+    if compression is None:
+        return fobj
+    return DecompressingReader(fobj, compression)
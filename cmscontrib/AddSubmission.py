@@ -30,17 +30,19 @@ from cms.db import File, Participation, SessionGen, Submission, Task, User, \
 from cms.db.filecacher import FileCacher
 from cms.grading.languagemanager import filename_to_language
 from cms.io import RemoteServiceClient
+from cms.service.espartition import get_task_shard
 from cmscommon.datetime import make_datetime
 
 
 logger = logging.getLogger(__name__)
 
 
-def maybe_send_notification(submission_id):
+def maybe_send_notification(submission):
     """Non-blocking attempt to notify a running ES of the submission"""
-    rs = RemoteServiceClient(ServiceCoord("EvaluationService", 0))
+    rs = RemoteServiceClient(
+        ServiceCoord("EvaluationService", get_task_shard(submission.task)))
     rs.connect()
-    rs.new_submission(submission_id=submission_id)
+    rs.new_submission(submission_id=submission.id)
     rs.disconnect()
 
 
@@ -140,7 +142,7 @@ def add_submission(contest_id, username, task_name, timestamp, files):
             session.add(File(filename, digest, submission=submission))
         session.add(submission)
         session.commit()
-        maybe_send_notification(submission.id)
+        maybe_send_notification(submission)
 
     return True
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This script checks that the files in the file store (all of them,
+or those of a contest) have the content their digest says.
+
+The outcome of each check is appended to a report, one JSON object per
+line (e.g., {"digest": "...", "status": "corrupted"}), as soon as it
+is known; an interrupted check can then be resumed from the report,
+skipping the files already checked.
+
+"""
+
+# We enable monkey patching to make many libraries gevent-friendly.
+import gevent.monkey
+gevent.monkey.patch_all()  # noqa
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from cms.db import SessionGen, Contest, enumerate_files
+from cms.db.filecacher import FileCacher
+from cms.io import make_psycopg_green
+
+
+logger = logging.getLogger()
+
+
+# Seconds between two progress messages.
+PROGRESS_INTERVAL = 10.0
+
+
+def read_report(path):
+    """Return the digests already checked according to a report.
+
+    path (str): the path of the report.
+
+    return ((set, bool)): the digests in the report, and whether its
+        last line is complete.
+
+    """
+    checked = set()
+    complete = True
+    with open(path, "rt", encoding="utf-8") as report:
+        for line in report:
+            complete = line.endswith("\n")
+            try:
+                checked.add(json.loads(line)["digest"])
+            except (ValueError, KeyError):
+                # Likely the last line, written partially.
+                logger.warning("Ignoring malformed line in the report.")
+    return checked, complete
+
+
+def check_files(file_cacher, digests, report_path, resume, concurrency,
+                delete):
+    """Check the files, writing the report.
+
+    file_cacher (FileCacher): the file cacher of the file store.
+    digests (set|None): the files to check, or None for all.
+    report_path (str|None): where to write the report, if anywhere.
+    resume (bool): whether to skip the files already in the report.
+    concurrency (int): how many files to check at the same time.
+    delete (bool): whether to delete the corrupted files.
+
+    return (bool): whether all the files were fine.
+
+    """
+    skip = None
+    complete = True
+    if resume and report_path is not None and os.path.exists(report_path):
+        skip, complete = read_report(report_path)
+        logger.info("Resuming, %d files already checked.", len(skip))
+
+    counts = {}
+    last_progress = [time.monotonic()]
+    report = None
+    if report_path is not None:
+        report = open(report_path, "at" if resume else "wt",
+                      encoding="utf-8")
+        if not complete:
+            report.write("\n")
+
+    def callback(digest, status):
+        counts[status] = counts.get(status, 0) + 1
+        if report is not None:
+            report.write(json.dumps({"digest": digest, "status": status}))
+            report.write("\n")
+            # Make it a checkpoint.
+            report.flush()
+        now = time.monotonic()
+        if now - last_progress[0] >= PROGRESS_INTERVAL:
+            last_progress[0] = now
+            logger.info("%d files checked (%s)%s.", sum(counts.values()),
+                        ", ".join("%d %s" % (n, status)
+                                  for status, n in sorted(counts.items())),
+                        "" if digests is None
+                        else " out of %d" % len(digests))
+
+    try:
+        clean = file_cacher.check_backend_integrity(
+            delete=delete, digests=digests, concurrency=concurrency,
+            skip=skip, callback=callback)
+    finally:
+        if report is not None:
+            report.close()
+
+    logger.info("Done, %d files checked: %s.", sum(counts.values()),
+                ", ".join("%d %s" % (n, status)
+                          for status, n in sorted(counts.items()))
+                or "nothing to do")
+    return clean
+
+
+def main():
+    """Parse arguments and launch process.
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Check the integrity of the files in the file store.")
+    parser.add_argument("-c", "--contest-id", action="store", type=int,
+                        help="check only the files of this contest")
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=4,
+                        help="how many files to check at the same time "
+                        "(default 4)")
+    parser.add_argument("-r", "--report", action="store", type=str,
+                        help="file where to write the outcome of each check, "
+                        "one JSON object per line")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the files already in the report, and "
+                        "append to it")
+    parser.add_argument("-d", "--delete", action="store_true",
+                        help="delete the corrupted files")
+    args = parser.parse_args()
+
+    if args.resume and args.report is None:
+        parser.error("--resume requires a report")
+
+    # Let the database reads of different files happen concurrently.
+    make_psycopg_green()
+
+    digests = None
+    if args.contest_id is not None:
+        with SessionGen() as session:
+            contest = Contest.get_from_id(args.contest_id, session)
+            if contest is None:
+                logger.critical("Contest %d not found.", args.contest_id)
+                return 1
+            digests = enumerate_files(session, contest)
+
+    success = check_files(FileCacher(), digests, args.report, args.resume,
+                          args.jobs, args.delete)
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
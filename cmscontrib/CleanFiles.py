@@ -29,7 +29,8 @@ import argparse
 import logging
 import sys
 
-from cms.db import SessionGen, Digest, Executable, enumerate_files
+from cms.db import SessionGen, CompilationCacheEntry, Digest, Executable, \
+    enumerate_files
 from cms.db.filecacher import FileCacher
 
 
@@ -43,27 +44,36 @@ def make_tombstone(session):
             count += 1
         exe.digest = Digest.TOMBSTONE
     logger.info("Replaced %d executables with the tombstone.", count)
+    # The cached compilations would bring the executables back.
+    count = session.query(CompilationCacheEntry).delete()
+    logger.info("Removed %d entries from the compilation cache.", count)
 
 
 def clean_files(session, dry_run):
     filecacher = FileCacher()
-    files = set(file[0] for file in filecacher.list())
-    logger.info("A total number of %d files are present in the file store",
-                len(files))
     found_digests = enumerate_files(session)
     logger.info("Found %d digests while scanning", len(found_digests))
-    files -= found_digests
-    logger.info("%d digests are orphan.", len(files))
+    # The file store is scanned (and orphans deleted) as we go, so
+    # that it never has to be held in memory.
+    files = 0
+    orphans = 0
     total_size = 0
-    for orphan in files:
-        total_size += filecacher.get_size(orphan)
+    for digest, _ in filecacher.list():
+        files += 1
+        if digest in found_digests:
+            continue
+        orphans += 1
+        total_size += filecacher.get_size(digest)
+        if not dry_run:
+            filecacher.delete(digest)
+            if orphans % 100 == 0:
+                logger.info("%d files deleted from the file store", orphans)
+    logger.info("A total number of %d files are present in the file store",
+                files)
+    logger.info("%d digests are orphan.", orphans)
     logger.info("Orphan files take %s bytes of disk space",
                 "{:,}".format(total_size))
     if not dry_run:
-        for count, orphan in enumerate(files):
-            filecacher.delete(orphan)
-            if count % 100 == 0:
-                logger.info("%d files deleted from the file store", count)
         logger.info("All orphan files have been deleted")
 
 
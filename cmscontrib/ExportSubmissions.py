@@ -222,7 +222,7 @@ def main():
 
             fso = FSObject.get_from_digest(f_digest, session)
             assert fso is not None
-            with fso.get_lobject(mode="rb") as file_obj:
+            with fso.open_content() as file_obj:
                 data = file_obj.read()
 
                 if args.utf8:
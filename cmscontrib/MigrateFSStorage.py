@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This script moves the files of a file-system storage (as used by
+FileCacher with a path) from the old layout, with all the files in
+one directory, to the current one, with two levels of subdirectories.
+
+The storage can be used while the files are being moved.
+
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from cms.db.filecacher import FSBackend
+
+
+logger = logging.getLogger()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move the files of a file-system storage into "
+        "subdirectories named after their digest.")
+    parser.add_argument("path", action="store", type=str,
+                        help="root directory of the storage")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.path):
+        logger.critical("Directory %s does not exist.", args.path)
+        return 1
+
+    moved = FSBackend(args.path).migrate_layout()
+    logger.info("Moved %d files.", moved)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
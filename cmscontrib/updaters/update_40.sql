@@ -0,0 +1,6 @@
+begin;
+
+alter table fsobjects add compression varchar;
+alter table fsobjects add size bigint;
+
+rollback; -- change this to: commit;
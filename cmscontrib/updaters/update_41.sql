@@ -0,0 +1,16 @@
+begin;
+
+create table compilation_cache_entries (
+    key varchar not null,
+    dataset_id integer not null,
+    "timestamp" timestamp without time zone not null,
+    compilation_success boolean not null,
+    text varchar[] not null,
+    plus jsonb not null,
+    executables jsonb not null,
+    primary key (key),
+    foreign key (dataset_id) references datasets(id) on update cascade on delete cascade
+);
+create index ix_compilation_cache_entries_dataset_id on compilation_cache_entries (dataset_id);
+
+rollback; -- change this to: commit;
@@ -0,0 +1,5 @@
+begin;
+
+alter table evaluations add reused boolean not null default 'f';
+
+rollback; -- change this to: commit;
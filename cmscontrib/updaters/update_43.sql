@@ -0,0 +1,41 @@
+begin;
+
+create function cms_notify() returns trigger as $$
+declare
+    payload text[] := '{}';
+begin
+    for i in 1 .. TG_NARGS - 1 loop
+        payload := payload || (to_json(NEW) ->> TG_ARGV[i]);
+    end loop;
+    perform pg_notify(TG_ARGV[0], array_to_string(payload, ' '));
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger cms_new_submission after insert on submissions
+    for each row
+    execute procedure cms_notify('cms_new_submission', 'id');
+
+create trigger cms_new_user_test after insert on user_tests
+    for each row
+    execute procedure cms_notify('cms_new_user_test', 'id');
+
+create trigger cms_new_token after insert on tokens
+    for each row
+    execute procedure cms_notify('cms_new_token', 'submission_id');
+
+create trigger cms_submission_result_to_score
+    after insert or update on submission_results
+    for each row
+    when (NEW.score is null and (NEW.compilation_outcome = 'fail'
+                                 or NEW.evaluation_outcome is not null))
+    execute procedure cms_notify('cms_submission_result_to_score',
+                                 'submission_id', 'dataset_id');
+
+create trigger cms_submission_result_scored after update on submission_results
+    for each row
+    when (OLD.score is null and NEW.score is not null)
+    execute procedure cms_notify('cms_submission_result_scored',
+                                 'submission_id', 'dataset_id');
+
+rollback; -- change this to: commit;
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Simulation of the time to the first verdict with fair share.
+
+Some participations submit now and then, while one of them submits a
+burst of submissions at the start. Each submission needs one
+evaluation per testcase, and the workers complete one evaluation per
+time unit each. The queue of ES is simulated once as a PriorityQueue
+and once as a FairShareQueue by participation, and the percentiles of
+the time from each submission to the end of its evaluations are
+reported, for the spamming participation and for the others.
+
+"""
+
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+
+from cms.io import FairShareQueue, PriorityQueue
+from cms.service.esoperations import ESOperation
+from cms.service.fairshare import LatencyTracker
+
+
+def simulate(queue, submissions, testcases, workers):
+    """Run the simulation, returning the latencies.
+
+    queue (PriorityQueue|FairShareQueue): the queue to use.
+    submissions ([(int, int, int)]): the time, id and participation of
+        each submission, sorted by time.
+    testcases (int): the number of testcases of the task.
+    workers (int): the number of workers.
+
+    return (LatencyTracker): the latencies, by participation.
+
+    """
+    start = datetime(2018, 1, 1)
+    participations = {}
+    missing = {}
+    latencies = LatencyTracker()
+    next_submission = 0
+    time = 0
+    while next_submission < len(submissions) or not queue.empty():
+        while next_submission < len(submissions) \
+                and submissions[next_submission][0] <= time:
+            arrival, submission_id, participation = \
+                submissions[next_submission]
+            participations[submission_id] = (participation, arrival)
+            missing[submission_id] = testcases
+            for codename in range(testcases):
+                queue.push(ESOperation(ESOperation.EVALUATION,
+                                       submission_id, 1, "%03d" % codename),
+                           PriorityQueue.PRIORITY_MEDIUM,
+                           start + timedelta(seconds=arrival))
+            next_submission += 1
+        time += 1
+        for _ in range(workers):
+            if queue.empty():
+                break
+            submission_id = queue.pop().item.object_id
+            missing[submission_id] -= 1
+            if missing[submission_id] == 0:
+                participation, arrival = participations[submission_id]
+                latencies.record(participation, submission_id,
+                                 time - arrival)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate the latencies of ES with fair share.")
+    parser.add_argument(
+        "-p", "--participations", action="store", type=int, default=50,
+        help="number of participations (default 50)")
+    parser.add_argument(
+        "-s", "--submissions", action="store", type=int, default=10,
+        help="submissions of each participation (default 10)")
+    parser.add_argument(
+        "-b", "--burst", action="store", type=int, default=200,
+        help="submissions of the spamming participation (default 200)")
+    parser.add_argument(
+        "-t", "--testcases", action="store", type=int, default=20,
+        help="number of testcases (default 20)")
+    parser.add_argument(
+        "-w", "--workers", action="store", type=int, default=16,
+        help="number of workers (default 16)")
+    args = parser.parse_args()
+
+    # Participation 0 spams at the start, the others submit uniformly
+    # over a period that the workers could sustain without the burst.
+    rnd = random.Random(42)
+    period = args.participations * args.submissions * args.testcases \
+        // args.workers
+    times = [(0, 0) for _ in range(args.burst)]
+    times.extend((rnd.randrange(period), participation)
+                 for participation in range(1, args.participations + 1)
+                 for _ in range(args.submissions))
+    times.sort()
+    submissions = [(arrival, submission_id, participation)
+                   for submission_id, (arrival, participation)
+                   in enumerate(times)]
+    participation_of = dict((submission_id, participation)
+                            for _, submission_id, participation
+                            in submissions)
+
+    for name, queue in [
+            ("priority", PriorityQueue()),
+            ("fair", FairShareQueue(
+                lambda operation: participation_of[operation.object_id]))]:
+        status = simulate(
+            queue, submissions, args.testcases, args.workers).get_status()
+        spammer = status.pop("0")
+        others = sorted(s["p95"] for s in status.values())
+        print("%-8s spammer p95 %6d, others: median p95 %6d, "
+              "worst p95 %6d" % (name, spammer["p95"],
+                                 others[len(others) // 2], others[-1]))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the queue of EvaluationService during a large rejudge.
+
+The queue is filled with evaluation operations shaped like the ones a
+rejudge produces (a few datasets, tens of testcases per submission,
+codenames and timestamps coming from distinct objects as they do when
+read from the database), then emptied. The memory held by the queue
+and the push and pop throughput are reported.
+
+With --scaling, the time of push, set_priority and pop is measured
+instead on queues of growing sizes, to check that it grows as the
+logarithm of the size, also when the queue ages its entries.
+
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from cms.io import PriorityQueue
+from cms.service.esoperations import ESOperation
+
+
+def make_operations(count, testcases, datasets):
+    """Return count operations and their timestamps."""
+    start = datetime(2018, 1, 1)
+    operations = []
+    for i in range(count):
+        submission_id = 100000 + i // testcases
+        operations.append((
+            ESOperation(ESOperation.EVALUATION,
+                        submission_id,
+                        # Large ids, to be outside the small int cache.
+                        int("%d" % (1000 + submission_id % datasets)),
+                        "%03d" % (i % testcases)),
+            start + timedelta(seconds=submission_id)))
+    return operations
+
+
+def fill(queue, operations):
+    """Push all operations in the queue."""
+    for operation, timestamp in operations:
+        queue.push(operation, PriorityQueue.PRIORITY_MEDIUM, timestamp)
+
+
+def time_operations(queue, operations, rounds):
+    """Return the time of push, set_priority and pop on the queue."""
+    rnd = random.Random(0)
+    items = [entry.item for entry in queue.get_entries()]
+    times = [0.0, 0.0, 0.0]
+    for operation, timestamp in operations[:rounds]:
+        start = time.monotonic()
+        queue.push(operation, rnd.randrange(5), timestamp)
+        times[0] += time.monotonic() - start
+        item = items[rnd.randrange(len(items))]
+        if item in queue:
+            start = time.monotonic()
+            queue.set_priority(item, rnd.randrange(5))
+            times[1] += time.monotonic() - start
+        start = time.monotonic()
+        queue.pop()
+        times[2] += time.monotonic() - start
+    return times
+
+
+def scaling(args):
+    """Print how the time of the operations grows with the size."""
+    rounds = 10000
+    operations = make_operations(args.entries + rounds, args.testcases,
+                                 args.datasets)
+    print("%9s %12s %12s %12s (us per operation, and per log2 size)" % (
+        "size", "push", "set_priority", "pop"))
+    size = 1000
+    while size <= args.entries:
+        queue = PriorityQueue(args.aging_interval)
+        rnd = random.Random(1)
+        for operation, timestamp in operations[:size]:
+            queue.push(operation, rnd.randrange(5), timestamp)
+        times = time_operations(queue, operations[size:], rounds)
+        log_size = math.log2(size)
+        print("%9d %s" % (size, " ".join(
+            "%5.2f (%4.2f)" % (t / rounds * 1e6, t / rounds * 1e6 / log_size)
+            for t in times)))
+        size *= 10
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the queue of EvaluationService.")
+    parser.add_argument(
+        "-n", "--entries", action="store", type=int, default=1000000,
+        help="number of entries in the queue (default 1000000)")
+    parser.add_argument(
+        "-t", "--testcases", action="store", type=int, default=50,
+        help="number of testcases per submission (default 50)")
+    parser.add_argument(
+        "-d", "--datasets", action="store", type=int, default=4,
+        help="number of datasets (default 4)")
+    parser.add_argument(
+        "-a", "--aging-interval", action="store", type=float, default=None,
+        help="aging interval of the queue in seconds (default none)")
+    parser.add_argument(
+        "-s", "--scaling", action="store_true",
+        help="measure how the operations scale with the size instead")
+    args = parser.parse_args()
+
+    if args.scaling:
+        scaling(args)
+        return 0
+
+    tracemalloc.start()
+    operations = make_operations(args.entries, args.testcases, args.datasets)
+    operations_size = tracemalloc.get_traced_memory()[0]
+
+    queue = PriorityQueue(args.aging_interval)
+    fill(queue, operations)
+    queue_size = tracemalloc.get_traced_memory()[0] - operations_size
+    tracemalloc.stop()
+
+    # Time a second round, without the overhead of tracemalloc.
+    queue = PriorityQueue(args.aging_interval)
+    start = time.monotonic()
+    fill(queue, operations)
+    push_time = time.monotonic() - start
+    start = time.monotonic()
+    while not queue.empty():
+        queue.pop()
+    pop_time = time.monotonic() - start
+
+    print("operations  %8.1f MiB (%5.0f B per entry)" % (
+        operations_size / 2 ** 20, operations_size / args.entries))
+    print("queue       %8.1f MiB (%5.0f B per entry)" % (
+        queue_size / 2 ** 20, queue_size / args.entries))
+    print("push        %8.0f entries/s" % (args.entries / push_time))
+    print("pop         %8.0f entries/s" % (args.entries / pop_time))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the setup of the files of a job in a sandbox.
+
+For each simulated job, the files it needs (an input, a correct output
+and an executable) are materialized from the local cache of a
+FileCacher into a fresh directory, once by copying them (as
+create_file_from_storage does by default) and once by linking them (as
+it does with sandbox_link_cached_files). The directory is created in
+the configured temp_dir, as sandboxes are.
+
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from cms import config, rmtree
+from cms.db.filecacher import FileCacher
+
+
+def materialize(file_cacher, digests, link):
+    """Put the files in a new directory, returning the time taken."""
+    box = tempfile.mkdtemp(dir=config.temp_dir, prefix="cms-bench-")
+    try:
+        start = time.monotonic()
+        methods = set()
+        for i, digest in enumerate(digests):
+            path = os.path.join(box, "file%d" % i)
+            if link:
+                methods.add(file_cacher.link_file_to_path(
+                    digest, path, hardlink_mode=FileCacher.CACHE_FILE_MODE))
+            else:
+                with open(path, "xb") as dst:
+                    file_cacher.get_file_to_fobj(digest, dst)
+                methods.add(FileCacher.LINK_COPY)
+        return time.monotonic() - start, methods
+    finally:
+        rmtree(box)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the setup of the files of a job.")
+    parser.add_argument(
+        "-s", "--size-mib", action="store", type=int, default=200,
+        help="size of the input file in MiB (default 200)")
+    parser.add_argument(
+        "-j", "--jobs", action="store", type=int, default=10,
+        help="number of jobs to simulate (default 10)")
+    args = parser.parse_args()
+
+    storage = tempfile.mkdtemp(dir=config.temp_dir, prefix="cms-bench-fs-")
+    file_cacher = FileCacher(path=storage)
+    try:
+        chunk = os.urandom(1024 * 1024)
+        with tempfile.TemporaryFile(dir=config.temp_dir) as input_:
+            for _ in range(args.size_mib):
+                input_.write(chunk)
+            input_.seek(0)
+            digests = [file_cacher.put_file_from_fobj(input_)]
+        digests.append(file_cacher.put_file_content(chunk))
+        digests.append(file_cacher.put_file_content(chunk[:64 * 1024]))
+
+        for link in (False, True):
+            times = []
+            methods = set()
+            for _ in range(args.jobs):
+                elapsed, used = materialize(file_cacher, digests, link)
+                times.append(elapsed)
+                methods |= used
+            times.sort()
+            print("%-5s %-17s median %8.2f ms, max %8.2f ms per job" % (
+                "link" if link else "copy",
+                "(%s)" % ", ".join(sorted(methods)),
+                times[len(times) // 2] * 1000, times[-1] * 1000))
+    finally:
+        file_cacher.destroy_cache()
+        rmtree(storage)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the compression module"""
+
+import io
+import os
+import unittest
+
+from cmscommon.compression import COMPRESSION_ZLIB, CompressingWriter, \
+    DecompressingReader, open_decompressed
+
+
+class UnclosableBytesIO(io.BytesIO):
+    """A BytesIO whose content survives closing it."""
+
+    def close(self):
+        self.was_closed = True
+
+
+def compress(content, chunk_size=1000):
+    dst = UnclosableBytesIO()
+    with CompressingWriter(dst, COMPRESSION_ZLIB) as writer:
+        for i in range(0, len(content), chunk_size):
+            writer.write(content[i:i + chunk_size])
+    return dst.getvalue()
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_round_trip(self):
+        content = os.urandom(100) * 10000
+        compressed = compress(content)
+        self.assertLess(len(compressed), len(content))
+        with DecompressingReader(io.BytesIO(compressed),
+                                 COMPRESSION_ZLIB) as reader:
+            self.assertEqual(reader.read(), content)
+
+    def test_small_reads(self):
+        content = b"abc" * 100000
+        reader = DecompressingReader(io.BytesIO(compress(content)),
+                                     COMPRESSION_ZLIB)
+        data = []
+        buf = reader.read(7)
+        while len(buf) > 0:
+            self.assertLessEqual(len(buf), 7)
+            data.append(buf)
+            buf = reader.read(7)
+        self.assertEqual(b"".join(data), content)
+
+    def test_empty(self):
+        reader = DecompressingReader(io.BytesIO(compress(b"")),
+                                     COMPRESSION_ZLIB)
+        self.assertEqual(reader.read(), b"")
+
+    def test_close_closes_underlying(self):
+        dst = UnclosableBytesIO()
+        CompressingWriter(dst, COMPRESSION_ZLIB).close()
+        self.assertTrue(dst.was_closed)
+
+    def test_uncompressed_size(self):
+        writer = CompressingWriter(io.BytesIO(), COMPRESSION_ZLIB)
+        writer.write(b"a" * 1000)
+        writer.write(memoryview(b"b" * 24))
+        self.assertEqual(writer.size, 1024)
+
+    def test_truncated(self):
+        compressed = compress(os.urandom(10000))
+        reader = DecompressingReader(io.BytesIO(compressed[:-10]),
+                                     COMPRESSION_ZLIB)
+        with self.assertRaises(OSError):
+            reader.read()
+
+    def test_corrupted(self):
+        reader = DecompressingReader(io.BytesIO(b"not zlib data"),
+                                     COMPRESSION_ZLIB)
+        with self.assertRaises(OSError):
+            reader.read()
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            DecompressingReader(io.BytesIO(), "nonexistent")
+
+    def test_open_decompressed_uncompressed(self):
+        fobj = io.BytesIO(b"content")
+        self.assertIs(open_decompressed(fobj, None), fobj)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the CheckFiles script"""
+
+import json
+import os
+import unittest
+
+# Needs to be first to allow for monkey patching the DB connection string.
+from cmstestsuite.unit_tests.databasemixin import DatabaseMixin  # noqa
+
+from cms.db.filecacher import FileCacher
+from cmscontrib.CheckFiles import check_files
+from cmstestsuite.unit_tests.filesystemmixin import FileSystemMixin
+
+
+class TestCheckFiles(FileSystemMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_cacher = FileCacher(path=self.get_path("storage"))
+        self.digests = [self.file_cacher.put_file_content(os.urandom(100))
+                        for _ in range(4)]
+        self.report_path = self.get_path("report")
+
+    def tearDown(self):
+        self.file_cacher.destroy_cache()
+        super().tearDown()
+
+    def read_report(self):
+        entries = []
+        with open(self.report_path, "rt", encoding="utf-8") as report:
+            for line in report:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    entries.append(None)
+        return entries
+
+    def test_report(self):
+        self.assertTrue(check_files(self.file_cacher, None, self.report_path,
+                                    False, 2, False))
+        self.assertCountEqual(
+            self.read_report(),
+            [{"digest": digest, "status": FileCacher.INTEGRITY_OK}
+             for digest in self.digests])
+
+    def test_resume(self):
+        # An interrupted run, with the last line partially written.
+        with open(self.report_path, "wt", encoding="utf-8") as report:
+            report.write(json.dumps({"digest": self.digests[0],
+                                     "status": FileCacher.INTEGRITY_OK}))
+            report.write("\n{\"dig")
+        self.assertTrue(check_files(self.file_cacher, None, self.report_path,
+                                    True, 2, False))
+        entries = self.read_report()
+        # The partial line is left alone, the others are all valid.
+        self.assertIsNone(entries[1])
+        self.assertCountEqual([entry["digest"] for entry in entries[2:]],
+                              self.digests[1:])
+
+    def test_missing(self):
+        self.file_cacher.delete(self.digests[0])
+        self.assertFalse(check_files(self.file_cacher, set(self.digests),
+                                     self.report_path, False, 2, False))
+        self.assertIn({"digest": self.digests[0],
+                       "status": FileCacher.INTEGRITY_MISSING},
+                      self.read_report())
+
+
+if __name__ == "__main__":
+    unittest.main()
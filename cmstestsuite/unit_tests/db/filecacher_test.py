@@ -23,16 +23,22 @@
 
 """
 
+import fcntl
 import os
 import random
 import shutil
 import unittest
 from io import BytesIO
+from unittest.mock import Mock, patch
+
+import gevent
 
 # Needs to be first to allow for monkey patching the DB connection string.
 from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
 
-from cms.db.filecacher import FileCacher
+from cms.db import FSObject, SessionGen
+from cms.db.filecacher import CacheIndex, FileCacher, FSBackend
+from cmscommon.compression import COMPRESSION_ZLIB
 from cmscommon.digest import Digester, bytes_digest
 
 
@@ -198,7 +204,9 @@ class TestFileCacherBase:
                 self.fail("Did not use the cache even if it could.")
             self.fail("Content differ.")
 
-        # Check the size of the file.
+        # Check the size of the file (the backend's one, as the cached
+        # copy is not there).
+        os.unlink(self.cache_path)
         try:
             size = self.file_cacher.get_size(self.digest)
         except Exception as error:
@@ -209,7 +217,6 @@ class TestFileCacherBase:
                       (size, self.size))
 
         # Get file from FileCacher.
-        os.unlink(self.cache_path)
         try:
             data = self.file_cacher.get_file(self.digest)
         except Exception as error:
@@ -356,6 +363,118 @@ class TestFileCacherBase:
         # Check that the file was stored correctly.
         self.check_stored_file(digest)
 
+    def test_put_duplicate_file(self):
+        """Store the same content twice through FileCacher, also after
+        it has been removed from the cache.
+
+        The content is sent to the backend before knowing its digest:
+        the second copy should be discarded.
+
+        """
+        content = os.urandom(100)
+        digest = self.file_cacher.put_file_content(content, "Test #008")
+        self.assertEqual(digest, bytes_digest(content))
+        self.file_cacher.drop(digest)
+        self.assertEqual(
+            self.file_cacher.put_file_content(content, "Test #009"), digest)
+
+        self.assertEqual(
+            [d for d, _ in self.file_cacher.list()].count(digest), 1)
+        self.check_stored_file(digest)
+
+    def test_put_duplicate_not_sent(self):
+        """Store again contents already in the backend, small and large.
+
+        They should not be sent to the backend again.
+
+        """
+        small = os.urandom(100)
+        large = os.urandom(FileCacher.PUT_BUFFER_SIZE + 1)
+        digests = [self.file_cacher.put_file_content(content)
+                   for content in (small, large)]
+        for digest in digests:
+            self.file_cacher.drop(digest)
+
+        backend = self.file_cacher.backend
+        with patch.object(backend, "create_file",
+                          Mock(wraps=backend.create_file)) as create_file, \
+                patch.object(backend, "commit_file",
+                             Mock(wraps=backend.commit_file)) as commit_file:
+            for content, digest in zip((small, large), digests):
+                self.assertEqual(
+                    self.file_cacher.put_file_content(content), digest)
+                create_file.assert_called_with(digest)
+            commit_file.assert_not_called()
+        for digest in digests:
+            self.check_stored_file(digest)
+
+    def test_put_large_stream_sent_while_hashing(self):
+        """Store a large file that cannot be read twice.
+
+        It should be sent to the backend before knowing its digest.
+
+        """
+        backend = self.file_cacher.backend
+        with patch.object(backend, "create_file",
+                          Mock(wraps=backend.create_file)) as create_file:
+            digest = self.file_cacher.put_file_from_fobj(
+                RandomFile(FileCacher.PUT_BUFFER_SIZE + 1))
+            create_file.assert_called_once_with(None)
+        self.check_stored_file(digest)
+
+    def test_put_commit_failing(self):
+        """Fail committing a file to the backend.
+
+        No temporary file should be left in the cache.
+
+        """
+        with patch.object(self.file_cacher.backend, "commit_file",
+                          Mock(side_effect=RuntimeError("Commit failed."))):
+            with self.assertRaises(RuntimeError):
+                self.file_cacher.put_file_content(os.urandom(100))
+        self.assertEqual(os.listdir(self.file_cacher.temp_dir), [])
+
+    def test_load_many(self):
+        """Load many files, some cached, some not, and some missing,
+        into the cache at once.
+
+        """
+        contents = [os.urandom(100) for _ in range(5)]
+        digests = [self.file_cacher.put_file_content(content)
+                   for content in contents]
+        for digest in digests[1:]:
+            self.file_cacher.drop(digest)
+        missing_digest = bytes_digest(os.urandom(100))
+
+        progress = []
+        missing = self.file_cacher.load_many(
+            digests + [missing_digest], concurrency=2,
+            progress_callback=lambda done, total: progress.append(
+                (done, total)))
+
+        self.assertEqual(missing, {missing_digest})
+        self.assertEqual(progress, [(i, 6) for i in range(1, 7)])
+        for digest, content in zip(digests, contents):
+            with open(os.path.join(self.cache_base_path, digest), "rb") as f:
+                self.assertEqual(f.read(), content)
+
+    def test_put_failing_file(self):
+        """Fail reading a file while storing it through FileCacher.
+
+        Nothing should be left in the backend.
+
+        """
+        class FailingFile(RandomFile):
+            def read(self, byte_num):
+                if self.dim == 0:
+                    raise OSError("Read failed.")
+                return super().read(byte_num)
+
+        files_before = list(self.file_cacher.list())
+        with self.assertRaises(OSError):
+            self.file_cacher.put_file_from_fobj(FailingFile(100))
+        self.assertCountEqual(self.file_cacher.list(), files_before)
+
 
 class TestFileCacherDB(TestFileCacherBase, DatabaseMixin, unittest.TestCase):
     """Tests for the FileCacher service with a database backend."""
@@ -382,5 +501,605 @@ class TestFileCacherFS(TestFileCacherBase, unittest.TestCase):
         shutil.rmtree("fs-storage", ignore_errors=True)
 
 
+class TestFileCacherDBCompressed(TestFileCacherBase, DatabaseMixin,
+                                 unittest.TestCase):
+    """Tests for the FileCacher service with a compressing database
+    backend.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+        file_cacher = FileCacher(compression=COMPRESSION_ZLIB)
+        self._setUp(file_cacher)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_base_path, ignore_errors=True)
+
+    def test_compressed_in_database(self):
+        content = b"0 1 2 3 4 5 6 7 8 9\n" * 1000
+        digest = self.file_cacher.put_file_content(content)
+
+        with SessionGen() as session:
+            fso = FSObject.get_from_digest(digest, session)
+            self.assertEqual(fso.compression, COMPRESSION_ZLIB)
+            self.assertEqual(fso.size, len(content))
+            with fso.get_lobject() as lobj:
+                self.assertLess(len(lobj.read()), len(content))
+            with fso.open_content() as fobj:
+                self.assertEqual(fobj.read(), content)
+        self.assertEqual(self.file_cacher.get_size(digest), len(content))
+
+    def test_uncompressed_still_readable(self):
+        content = b"some content"
+        digest = FileCacher(compression=None).put_file_content(content)
+        self.file_cacher.drop(digest)
+
+        self.assertEqual(self.file_cacher.get_file_content(digest), content)
+        self.assertEqual(self.file_cacher.get_size(digest), len(content))
+
+
+class TestFileCacherFSCompressed(TestFileCacherBase, unittest.TestCase):
+    """Tests for the FileCacher service with a compressing filesystem
+    backend.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+        file_cacher = FileCacher(path="fs-storage",
+                                 compression=COMPRESSION_ZLIB)
+        self._setUp(file_cacher)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_base_path, ignore_errors=True)
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def test_compressed_on_disk(self):
+        content = b"0 1 2 3 4 5 6 7 8 9\n" * 1000
+        digest = self.file_cacher.put_file_content(content)
+
+        path = os.path.join("fs-storage", digest[:2], digest[2:4],
+                            "%s.%s" % (digest, COMPRESSION_ZLIB))
+        self.assertLess(os.stat(path).st_size, len(content))
+        self.assertIn((digest, ""), self.file_cacher.list())
+        self.assertEqual(self.file_cacher.get_size(digest), len(content))
+        self.assertEqual(self.file_cacher.backend.get_size(digest),
+                         len(content))
+        self.assertTrue(self.file_cacher.check_backend_integrity())
+
+    def test_size_from_cache(self):
+        content = b"0 1 2 3 4 5 6 7 8 9\n" * 1000
+        digest = self.file_cacher.put_file_content(content)
+        # The cached copy spares decompressing the stored one.
+        with patch.object(self.file_cacher.backend, "get_size",
+                          side_effect=AssertionError):
+            self.assertEqual(self.file_cacher.get_size(digest),
+                             len(content))
+
+    def test_uncompressed_still_readable(self):
+        content = b"some content"
+        digest = FileCacher(path="fs-storage").put_file_content(content)
+        self.file_cacher.drop(digest)
+
+        self.assertEqual(self.file_cacher.get_file_content(digest), content)
+        self.assertEqual(self.file_cacher.get_size(digest), len(content))
+        # Storing it again does not add a compressed copy.
+        self.file_cacher.put_file_content(content)
+        self.assertEqual(
+            os.listdir(os.path.join("fs-storage", digest[:2], digest[2:4])),
+            [digest])
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            FileCacher(path="fs-storage", compression="nonexistent")
+
+
+class TestFSBackendLayout(unittest.TestCase):
+    """Tests for the layout of the files of FSBackend."""
+
+    def setUp(self):
+        super().setUp()
+        self.backend = FSBackend("fs-storage")
+
+    def tearDown(self):
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def store(self, content, backend=None):
+        backend = backend if backend is not None else self.backend
+        digest = bytes_digest(content)
+        fobj = backend.create_file(digest)
+        fobj.write(content)
+        backend.commit_file(fobj, digest)
+        return digest
+
+    def store_flat(self, content, suffix=""):
+        digest = bytes_digest(content)
+        with open(os.path.join("fs-storage", digest + suffix), "wb") as f:
+            f.write(content)
+        return digest
+
+    def test_subdirectories(self):
+        digest = self.store(b"content")
+        self.assertTrue(os.path.isfile(os.path.join(
+            "fs-storage", digest[:2], digest[2:4], digest)))
+        with self.backend.get_file(digest) as fobj:
+            self.assertEqual(fobj.read(), b"content")
+
+    def test_flat_files_still_found(self):
+        digest = self.store_flat(b"content")
+        self.assertEqual(self.backend.get_size(digest), 7)
+        # It is not stored again.
+        self.assertIsNone(self.backend.create_file(digest))
+
+    def test_list(self):
+        digests = {self.store(b"a"), self.store(b"b"), self.store_flat(b"c"),
+                   self.store(b"d", FSBackend("fs-storage", COMPRESSION_ZLIB))}
+        # A file not committed yet.
+        self.backend.create_file(bytes_digest(b"e")).close()
+
+        files = self.backend.list()
+        self.assertNotIsInstance(files, list)
+        self.assertCountEqual(files, [(digest, "") for digest in digests])
+
+    def test_migrate_layout(self):
+        digests = {self.store_flat(b"a"), self.store(b"b")}
+        compressed = FSBackend("fs-storage", COMPRESSION_ZLIB)
+        digest = self.store(b"c", compressed)
+        path = compressed._find(digest)[0]
+        os.rename(path, os.path.join("fs-storage", os.path.basename(path)))
+        digests.add(digest)
+
+        self.assertEqual(self.backend.migrate_layout(), 2)
+
+        self.assertEqual(
+            [name for name in os.listdir("fs-storage")
+             if not os.path.isdir(os.path.join("fs-storage", name))], [])
+        self.assertCountEqual(self.backend.list(),
+                              [(digest, "") for digest in digests])
+        with self.backend.get_file(digest) as fobj:
+            self.assertEqual(fobj.read(), b"c")
+
+
+class TestFileCacherIntegrity(unittest.TestCase):
+    """Tests for the integrity check of the backend of FileCacher."""
+
+    def setUp(self):
+        super().setUp()
+        self.file_cacher = FileCacher(path="fs-storage")
+        self.good = [self.file_cacher.put_file_content(os.urandom(100))
+                     for _ in range(5)]
+        self.bad = self.file_cacher.put_file_content(b"content")
+        path = self.file_cacher.backend._find(self.bad)[0]
+        with open(path, "wb") as f:
+            f.write(b"tampered")
+        self.results = {}
+
+    def tearDown(self):
+        self.file_cacher.destroy_cache()
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def callback(self, digest, status):
+        self.assertNotIn(digest, self.results)
+        self.results[digest] = status
+
+    def test_all(self):
+        self.assertFalse(self.file_cacher.check_backend_integrity(
+            concurrency=3, callback=self.callback))
+        expected = dict((digest, FileCacher.INTEGRITY_OK)
+                        for digest in self.good)
+        expected[self.bad] = FileCacher.INTEGRITY_CORRUPTED
+        self.assertEqual(self.results, expected)
+
+    def test_delete(self):
+        self.file_cacher.check_backend_integrity(delete=True, concurrency=3)
+        self.assertCountEqual(self.file_cacher.list(),
+                              [(digest, "") for digest in self.good])
+        self.assertTrue(self.file_cacher.check_backend_integrity())
+
+    def test_digests_and_skip(self):
+        missing = bytes_digest(b"missing")
+        self.assertFalse(self.file_cacher.check_backend_integrity(
+            digests=[self.good[0], self.good[1], missing],
+            skip={self.good[1]}, callback=self.callback))
+        self.assertEqual(self.results,
+                         {self.good[0]: FileCacher.INTEGRITY_OK,
+                          missing: FileCacher.INTEGRITY_MISSING})
+
+    def test_clean(self):
+        self.assertTrue(self.file_cacher.check_backend_integrity(
+            digests=self.good, concurrency=2))
+
+
+class TestFileCacherMemory(unittest.TestCase):
+    """Tests for the in-memory cache of FileCacher."""
+
+    def setUp(self):
+        super().setUp()
+        self.file_cacher = FileCacher(path="fs-storage",
+                                      memory_cache_size=250,
+                                      memory_cache_max_file_size=100)
+
+    def tearDown(self):
+        self.file_cacher.destroy_cache()
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def remove_from_disk(self, digest):
+        os.unlink(os.path.join(self.file_cacher.file_dir, digest))
+
+    def test_small_file_kept(self):
+        content = os.urandom(100)
+        digest = self.file_cacher.put_file_content(content)
+        self.assertEqual(self.file_cacher.get_file_content(digest), content)
+
+        # It's not read from the disk anymore.
+        self.remove_from_disk(digest)
+        self.file_cacher.backend = Mock()
+        self.assertEqual(self.file_cacher.get_file_content(digest), content)
+        with self.file_cacher.get_file(digest) as fobj:
+            self.assertEqual(fobj.read(), content)
+        self.assertEqual(self.file_cacher.get_size(digest), 100)
+        self.file_cacher.backend.get_size.assert_not_called()
+
+        status = self.file_cacher.get_cache_status()["memory"]
+        self.assertEqual(status["files"], 1)
+        self.assertEqual(status["hits"], 2)
+        self.assertEqual(status["misses"], 1)
+        self.assertAlmostEqual(status["hit_rate"], 2 / 3)
+
+    def test_large_file_not_kept(self):
+        content = os.urandom(101)
+        digest = self.file_cacher.put_file_content(content)
+        self.assertEqual(self.file_cacher.get_file_content(digest), content)
+        self.assertEqual(
+            self.file_cacher.get_cache_status()["memory"]["files"], 0)
+
+    def test_lru(self):
+        digests = [self.file_cacher.put_file_content(os.urandom(100))
+                   for _ in range(3)]
+        self.file_cacher.get_file_content(digests[0])
+        self.file_cacher.get_file_content(digests[1])
+        self.file_cacher.get_file_content(digests[0])
+        self.file_cacher.get_file_content(digests[2])
+
+        memory_cache = self.file_cacher.memory_cache
+        self.assertIsNotNone(memory_cache.get_size(digests[0]))
+        self.assertIsNone(memory_cache.get_size(digests[1]))
+        self.assertIsNotNone(memory_cache.get_size(digests[2]))
+        self.assertEqual(memory_cache.get_status()["size"], 200)
+        self.assertEqual(memory_cache.get_status()["evictions"], 1)
+
+    def test_drop(self):
+        digest = self.file_cacher.put_file_content(b"content")
+        self.file_cacher.get_file_content(digest)
+        self.file_cacher.drop(digest)
+        self.assertIsNone(self.file_cacher.memory_cache.get_size(digest))
+
+    def test_disabled(self):
+        file_cacher = FileCacher(path="fs-storage")
+        self.assertNotIn("memory", file_cacher.get_cache_status())
+        file_cacher.destroy_cache()
+
+
+class TestCacheIndex(unittest.TestCase):
+    """Tests for the choice of the files to evict."""
+
+    @staticmethod
+    def _expected_victims(index, order):
+        """Return the victims chosen by the policy, by brute force.
+
+        order ([str]): the digests, from the least to the most recently
+            used.
+
+        """
+        candidates = [digest for digest in order
+                      if not index.is_pinned(digest)]
+        if index.policy == CacheIndex.POLICY_LFU:
+            candidates.sort(key=lambda digest: index._entries[digest][1])
+        size, files = index.total_size, len(order)
+        victims = []
+        for digest in candidates:
+            if not index._over_limits(size, files):
+                break
+            victims.append(digest)
+            size -= index._entries[digest][0]
+            files -= 1
+        return victims
+
+    def _check_random_operations(self, policy):
+        rnd = random.Random(42)
+        index = CacheIndex(max_size=300, max_files=20, policy=policy)
+        order = []
+        for _ in range(2000):
+            digest = "%02d" % rnd.randrange(40)
+            action = rnd.random()
+            if action < 0.5:
+                index.add(digest, rnd.randrange(1, 30))
+                if digest in order:
+                    order.remove(digest)
+                order.append(digest)
+            elif action < 0.8:
+                if index.touch(digest):
+                    order.remove(digest)
+                    order.append(digest)
+            elif action < 0.9:
+                index.remove(digest)
+                if digest in order:
+                    order.remove(digest)
+            elif index.is_pinned(digest):
+                index.unpin(digest)
+            else:
+                index.pin(digest)
+            victims = index.victims()
+            self.assertEqual(victims, self._expected_victims(index, order))
+            for victim in victims:
+                index.remove(victim, evicted=True)
+                order.remove(victim)
+
+    def test_lru(self):
+        self._check_random_operations(CacheIndex.POLICY_LRU)
+
+    def test_lfu(self):
+        self._check_random_operations(CacheIndex.POLICY_LFU)
+
+    def test_lfu_bookkeeping(self):
+        index = CacheIndex(max_files=2, policy=CacheIndex.POLICY_LFU)
+        index.add("a", 1)
+        index.add("b", 1)
+        index.touch("a")
+        index.remove("b")
+        self.assertEqual(index._by_uses, {2: {"a": None}})
+        index.clear()
+        self.assertEqual(index._by_uses, {})
+
+
+class TestFileCacherEviction(unittest.TestCase):
+    """Tests for the limits on the local cache of the FileCacher."""
+
+    def tearDown(self):
+        self.file_cacher.destroy_cache()
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def _put(self, content):
+        return self.file_cacher.put_file_content(content)
+
+    def _is_cached(self, digest):
+        return os.path.exists(os.path.join(self.file_cacher.file_dir, digest))
+
+    def test_max_files_lru(self):
+        self.file_cacher = FileCacher(path="fs-storage", max_cache_files=2)
+        a = self._put(b"a")
+        b = self._put(b"b")
+        # Using a makes b the least recently used.
+        self.file_cacher.get_file_content(a)
+        c = self._put(b"c")
+        self.assertTrue(self._is_cached(a))
+        self.assertFalse(self._is_cached(b))
+        self.assertTrue(self._is_cached(c))
+        # Evicted files are still available from the backend.
+        self.assertEqual(self.file_cacher.get_file_content(b), b"b")
+
+        status = self.file_cacher.get_cache_status()
+        self.assertEqual(status["files"], 2)
+        self.assertEqual(status["evictions"], 2)
+        self.assertEqual(status["hits"], 1)
+        self.assertEqual(status["misses"], 1)
+
+    def test_max_files_lfu(self):
+        self.file_cacher = FileCacher(path="fs-storage", max_cache_files=2,
+                                      eviction_policy="lfu")
+        a = self._put(b"a")
+        b = self._put(b"b")
+        self.file_cacher.get_file_content(a)
+        self.file_cacher.get_file_content(a)
+        self.file_cacher.get_file_content(b)
+        c = self._put(b"c")
+        self.assertTrue(self._is_cached(a))
+        self.assertFalse(self._is_cached(b))
+        self.assertTrue(self._is_cached(c))
+
+    def test_max_size(self):
+        self.file_cacher = FileCacher(path="fs-storage", max_cache_size=10)
+        a = self._put(b"a" * 6)
+        b = self._put(b"b" * 6)
+        self.assertFalse(self._is_cached(a))
+        self.assertTrue(self._is_cached(b))
+        self.assertEqual(self.file_cacher.get_cache_status()["size"], 6)
+
+        # A file larger than the limit still stays until replaced.
+        c = self._put(b"c" * 20)
+        self.assertFalse(self._is_cached(b))
+        self.assertTrue(self._is_cached(c))
+
+    def test_pinned_not_evicted(self):
+        self.file_cacher = FileCacher(path="fs-storage", max_cache_files=1)
+        a = self._put(b"a")
+        self.file_cacher.pin([a])
+        b = self._put(b"b")
+        self.assertTrue(self._is_cached(a))
+        self.assertTrue(self._is_cached(b))
+
+        # Once unpinned, the cache goes back within the limits.
+        self.file_cacher.unpin([a])
+        self.assertFalse(self._is_cached(a))
+        self.assertTrue(self._is_cached(b))
+
+    def test_existing_files_indexed(self):
+        # Services have a persistent cache directory, that the new
+        # FileCacher finds already populated.
+        service = Mock()
+        service.name = "TestFileCacherEviction"
+        service.shard = 0
+        file_cacher = FileCacher(service, path="fs-storage")
+        for filename in os.listdir(file_cacher.file_dir):
+            if not filename.startswith("_"):
+                os.unlink(os.path.join(file_cacher.file_dir, filename))
+        a = file_cacher.put_file_content(b"a")
+        b = file_cacher.put_file_content(b"b")
+        self.file_cacher = FileCacher(service, path="fs-storage",
+                                      max_cache_files=1)
+        self.assertEqual(self.file_cacher.get_cache_status()["files"], 1)
+        self.assertEqual(self._is_cached(a) + self._is_cached(b), 1)
+
+    def test_drop_and_purge(self):
+        self.file_cacher = FileCacher(path="fs-storage")
+        a = self._put(b"a")
+        self._put(b"b")
+        self.file_cacher.drop(a)
+        self.assertEqual(self.file_cacher.get_cache_status()["files"], 1)
+        self.file_cacher.purge_cache()
+        self.assertEqual(self.file_cacher.get_cache_status()["files"], 0)
+        self.assertEqual(self.file_cacher.get_cache_status()["size"], 0)
+
+
+class FakePeers:
+    """Peers of a FileCacher serving files from a dict."""
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = 0
+
+    def get_file(self, digest):
+        self.requests += 1
+        # Give other greenlets the chance to ask for the same file.
+        gevent.sleep(0.01)
+        return BytesIO(self.files[digest])
+
+
+class TestFileCacherPeers(unittest.TestCase):
+    """Tests for loading files into the FileCacher from peers."""
+
+    def setUp(self):
+        super().setUp()
+        self.content = os.urandom(100)
+        self.digest = bytes_digest(self.content)
+
+    def tearDown(self):
+        self.file_cacher.destroy_cache()
+
+    def test_from_peers(self):
+        peers = FakePeers({self.digest: self.content})
+        self.file_cacher = FileCacher(null=True, peers=peers)
+        self.assertEqual(self.file_cacher.get_file_content(self.digest),
+                         self.content)
+        self.assertEqual(peers.requests, 1)
+
+    def test_wrong_content_from_peers(self):
+        peers = FakePeers({self.digest: b"wrong"})
+        self.file_cacher = FileCacher(null=True, peers=peers)
+        # The null backend doesn't have the file either.
+        with self.assertRaises(KeyError):
+            self.file_cacher.get_file_content(self.digest)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.file_cacher.file_dir, self.digest)))
+
+    def test_concurrent_loads(self):
+        peers = FakePeers({self.digest: self.content})
+        self.file_cacher = FileCacher(null=True, peers=peers)
+        greenlets = [gevent.spawn(self.file_cacher.get_file_content,
+                                  self.digest)
+                     for _ in range(5)]
+        gevent.joinall(greenlets, raise_error=True)
+        for greenlet in greenlets:
+            self.assertEqual(greenlet.value, self.content)
+        self.assertEqual(peers.requests, 1)
+
+
+class TestFileCacherShared(unittest.TestCase):
+    """Tests for FileCachers sharing their local cache."""
+
+    def setUp(self):
+        super().setUp()
+        self.file_cacher = FileCacher(path="fs-storage", shared=True)
+        self.other_file_cacher = FileCacher(path="fs-storage", shared=True)
+
+    def tearDown(self):
+        self.file_cacher.destroy_cache()
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def test_shared_directory(self):
+        self.assertEqual(self.file_cacher.file_dir,
+                         self.other_file_cacher.file_dir)
+        content = os.urandom(100)
+        digest = self.file_cacher.put_file_content(content)
+        self.assertEqual(self.other_file_cacher.get_file_content(digest),
+                         content)
+        self.assertEqual(self.other_file_cacher.get_cache_status()["hits"], 1)
+
+    def test_load_waits_for_other_process(self):
+        content = os.urandom(100)
+        digest = self.file_cacher.put_file_content(content)
+        self.file_cacher.drop(digest)
+
+        # Pretend that another process is loading the file.
+        fd = os.open(os.path.join(self.file_cacher.lock_dir, digest),
+                     os.O_CREAT | os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            greenlet = gevent.spawn(self.other_file_cacher.load, digest)
+            gevent.sleep(0.3)
+            self.assertFalse(greenlet.ready())
+            with open(os.path.join(self.file_cacher.file_dir, digest),
+                      "wb") as f:
+                f.write(content)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        greenlet.get(timeout=5)
+        self.assertEqual(self.other_file_cacher.get_file_content(digest),
+                         content)
+
+    def test_pins_hold_across_processes(self):
+        file_cacher = FileCacher(path="fs-storage", shared=True,
+                                 max_cache_files=1)
+        digest = file_cacher.put_file_content(b"pinned")
+        self.other_file_cacher.pin([digest])
+
+        # The first file is over the limit but pinned by the other one.
+        other_digest = file_cacher.put_file_content(b"other")
+        self.assertTrue(os.path.exists(
+            os.path.join(file_cacher.file_dir, digest)))
+        self.assertEqual(file_cacher.get_cache_status()["evictions"], 0)
+
+        # Once unpinned, the next eviction removes it.
+        self.other_file_cacher.unpin([digest])
+        file_cacher.put_file_content(b"third")
+        self.assertFalse(os.path.exists(
+            os.path.join(file_cacher.file_dir, digest)))
+        self.assertFalse(os.path.exists(
+            os.path.join(file_cacher.file_dir, other_digest)))
+        # Pinning again must not rely on the old, removed pin file.
+        self.other_file_cacher.pin([digest])
+        with file_cacher._eviction_lock(digest) as evictable:
+            self.assertFalse(evictable)
+        self.other_file_cacher.unpin([digest])
+
+    def test_limits_are_host_wide(self):
+        file_cacher = FileCacher(path="fs-storage", shared=True,
+                                 max_cache_files=2)
+        other_file_cacher = FileCacher(path="fs-storage", shared=True,
+                                       max_cache_files=2)
+        first = file_cacher.put_file_content(b"first")
+        second = file_cacher.put_file_content(b"second")
+        third = other_file_cacher.put_file_content(b"third")
+
+        cached = [digest for digest in (first, second, third)
+                  if os.path.exists(os.path.join(file_cacher.file_dir,
+                                                 digest))]
+        self.assertEqual(len(cached), 2)
+        self.assertIn(third, cached)
+        self.assertEqual(other_file_cacher.get_cache_status()["files"], 2)
+
+        # The file evicted by the other process is forgotten.
+        file_cacher.put_file_content(b"fourth")
+        self.assertEqual(file_cacher.get_cache_status()["files"], 2)
+
+    def test_purge_keeps_shared_cache(self):
+        digest = self.file_cacher.put_file_content(b"content")
+        self.other_file_cacher.purge_cache()
+        self.assertTrue(os.path.exists(
+            os.path.join(self.file_cacher.file_dir, digest)))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the notifications sent by the database."""
+
+import unittest
+from unittest.mock import Mock
+
+import gevent
+
+# Needs to be first to allow for monkey patching the DB connection string.
+from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
+
+from cms.db import NotificationListener, custom_psycopg2_connection
+from cms.db.notifications import NEW_SUBMISSION, NEW_TOKEN, \
+    NEW_USER_TEST, SUBMISSION_RESULT_SCORED, SUBMISSION_RESULT_TO_SCORE, \
+    TRIGGERS
+
+
+class TestTriggers(DatabaseMixin, unittest.TestCase):
+    """Tests for the notifications sent by the triggers."""
+
+    def setUp(self):
+        super().setUp()
+        self.connection = custom_psycopg2_connection()
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            for channel, _, _, _, _ in TRIGGERS:
+                cursor.execute("LISTEN %s;" % channel)
+
+    def tearDown(self):
+        self.connection.close()
+        self.delete_data()
+        super().tearDown()
+
+    def get_notifications(self):
+        self.connection.poll()
+        notifications = [(notify.channel, notify.payload)
+                         for notify in self.connection.notifies]
+        del self.connection.notifies[:]
+        return notifications
+
+    def test_submission(self):
+        submission = self.add_submission()
+        self.session.commit()
+        self.assertEqual(self.get_notifications(),
+                         [(NEW_SUBMISSION, "%d" % submission.id)])
+
+        self.add_token(submission)
+        self.session.commit()
+        self.assertEqual(self.get_notifications(),
+                         [(NEW_TOKEN, "%d" % submission.id)])
+
+    def test_user_test(self):
+        user_test = self.add_user_test()
+        self.session.commit()
+        self.assertIn((NEW_USER_TEST, "%d" % user_test.id),
+                      self.get_notifications())
+
+    def test_submission_result(self):
+        submission_result = self.add_submission_result(self.add_submission())
+        self.session.commit()
+        payload = "%d %d" % (submission_result.submission_id,
+                             submission_result.dataset_id)
+        # Neither compiled nor evaluated yet.
+        self.assertNotIn(SUBMISSION_RESULT_TO_SCORE,
+                         [c for c, _ in self.get_notifications()])
+
+        submission_result.set_compilation_outcome(True)
+        self.session.commit()
+        self.assertEqual(self.get_notifications(), [])
+
+        submission_result.set_evaluation_outcome()
+        self.session.commit()
+        self.assertEqual(self.get_notifications(),
+                         [(SUBMISSION_RESULT_TO_SCORE, payload)])
+
+        submission_result.score = 100.0
+        self.session.commit()
+        self.assertEqual(self.get_notifications(),
+                         [(SUBMISSION_RESULT_SCORED, payload)])
+
+    def test_failed_compilation(self):
+        submission_result = self.add_submission_result(self.add_submission())
+        self.session.commit()
+        self.get_notifications()
+
+        submission_result.set_compilation_outcome(False)
+        self.session.commit()
+        self.assertEqual(
+            self.get_notifications(),
+            [(SUBMISSION_RESULT_TO_SCORE, "%d %d" % (
+                submission_result.submission_id,
+                submission_result.dataset_id))])
+
+
+class TestNotificationListener(unittest.TestCase):
+    """Tests for the dispatching of the notifications."""
+
+    def setUp(self):
+        super().setUp()
+        self.callback = Mock()
+        self.listener = NotificationListener({"channel": self.callback})
+
+    def test_dispatch(self):
+        self.listener._dispatch("channel", "4 2")
+        gevent.sleep(0)
+        self.callback.assert_called_once_with(4, 2)
+
+    def test_dispatch_invalid(self):
+        self.listener._dispatch("channel", "4 foo")
+        gevent.sleep(0)
+        self.callback.assert_not_called()
+
+    def test_callback_error(self):
+        self.callback.side_effect = ValueError
+        self.listener._dispatch("channel", "4")
+        gevent.sleep(0)
+        self.callback.assert_called_once_with(4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,9 +20,16 @@
 """Tests for general utility functions."""
 
 import io
+import os
+import shutil
+import stat
 import unittest
+from unittest.mock import Mock, patch
 
-from cms.grading.Sandbox import Truncator
+from cms.db.filecacher import FileCacher
+from cms.grading.Sandbox import IsolateSandbox, Truncator, use_slot
+from cmstestsuite.unit_tests.grading.steps.fakeisolatesandbox \
+    import FakeIsolateSandbox
 
 
 class TestTruncator(unittest.TestCase):
@@ -62,5 +69,128 @@ class TestTruncator(unittest.TestCase):
         self.perform_truncator_test(100, 40, 7)
 
 
+class TestLinkCachedFiles(unittest.TestCase):
+    """Test materializing files from the storage by linking them."""
+
+    def setUp(self):
+        patcher = patch("cms.grading.Sandbox.config.sandbox_link_cached_files",
+                        True)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+        self.file_cacher = FileCacher(path="fs-storage")
+        self.digest = self.file_cacher.put_file_content(b"input")
+        self.cache_path = os.path.join(self.file_cacher.file_dir, self.digest)
+        self.sandbox = FakeIsolateSandbox(self.file_cacher)
+
+    def tearDown(self):
+        shutil.rmtree(self.sandbox.get_root_path(), ignore_errors=True)
+        self.file_cacher.destroy_cache()
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def create(self, path, executable=False):
+        self.sandbox.create_file_from_storage(path, self.digest, executable)
+        return self.sandbox.relative_path(path)
+
+    def is_hardlinked(self, real_path):
+        return os.path.samestat(os.stat(real_path), os.stat(self.cache_path))
+
+    def test_content_and_permissions(self):
+        real_path = self.create("input.txt")
+        with open(real_path, "rb") as f:
+            self.assertEqual(f.read(), b"input")
+        mode = os.stat(real_path).st_mode
+        self.assertTrue(mode & stat.S_IROTH)
+        self.assertFalse(mode & stat.S_IWOTH)
+
+        real_path = self.create("run", executable=True)
+        self.assertTrue(os.stat(real_path).st_mode & stat.S_IXOTH)
+
+    def test_cache_permissions_unchanged(self):
+        cache_mode = os.stat(self.cache_path).st_mode
+        real_path = self.create("input.txt")
+        self.assertTrue(self.is_hardlinked(real_path))
+        # An executable needs other permissions than the cached file.
+        real_path = self.create("run", executable=True)
+        self.assertFalse(self.is_hardlinked(real_path))
+        self.assertEqual(os.stat(self.cache_path).st_mode, cache_mode)
+
+    def test_no_hardlinks_with_other_permissions(self):
+        # For example, a file cached before the cache made them
+        # read-only.
+        os.chmod(self.cache_path, 0o600)
+        real_path = self.create("input.txt")
+        self.assertFalse(self.is_hardlinked(real_path))
+        self.assertEqual(os.stat(self.cache_path).st_mode & 0o7777, 0o600)
+
+    def test_linked_files_stay_read_only(self):
+        real_path = self.create("input.txt")
+        self.sandbox.allow_writing_all()
+        self.assertFalse(os.stat(real_path).st_mode & stat.S_IWOTH)
+        self.assertFalse(os.stat(self.cache_path).st_mode & stat.S_IWOTH)
+
+    def test_writable_files_are_unlinked(self):
+        real_path = self.create("input.txt")
+        self.sandbox.allow_writing_only(["input.txt"])
+        self.assertFalse(self.is_hardlinked(real_path))
+        self.assertTrue(os.stat(real_path).st_mode & stat.S_IWOTH)
+        self.assertFalse(os.stat(self.cache_path).st_mode & stat.S_IWOTH)
+        with open(real_path, "rb") as f:
+            self.assertEqual(f.read(), b"input")
+
+    def test_no_hardlinks_when_not_allowed(self):
+        self.sandbox.HARDLINK_FROM_STORAGE = False
+        real_path = self.create("input.txt")
+        self.assertFalse(self.is_hardlinked(real_path))
+        with open(real_path, "rb") as f:
+            self.assertEqual(f.read(), b"input")
+
+
+class TestSlots(unittest.TestCase):
+    """Test the box ids and CPUs of the sandboxes of the slots."""
+
+    def setUp(self):
+        for name, value in [("worker_slots", 4), ("sandbox_num_boxes", 1000)]:
+            patcher = patch("cms.grading.Sandbox.config.%s" % name, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        patcher = patch.object(IsolateSandbox, "next_id", {})
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        self.file_cacher = Mock(service=Mock(shard=2))
+        self.sandboxes = []
+
+    def tearDown(self):
+        for sandbox in self.sandboxes:
+            shutil.rmtree(sandbox.get_root_path(), ignore_errors=True)
+
+    def new_sandbox(self):
+        sandbox = FakeIsolateSandbox(self.file_cacher)
+        self.sandboxes.append(sandbox)
+        return sandbox
+
+    def test_default_slot(self):
+        sandbox = self.new_sandbox()
+        self.assertEqual(sandbox.slot, 0)
+        self.assertIsNone(sandbox.cpus)
+        self.assertEqual(sandbox.box_id, 90)
+
+    def test_slot_ranges(self):
+        with use_slot(3, {4, 5}):
+            ids = [self.new_sandbox().box_id for _ in range(11)]
+            self.assertEqual(self.sandboxes[0].cpus, {4, 5})
+        # Slot 3 of shard 2 has the 13th range, with wrap-around.
+        self.assertEqual(ids, list(range(120, 130)) + [120])
+        # Other slots have their own range and counter.
+        with use_slot(1):
+            self.assertEqual(self.new_sandbox().box_id, 100)
+        self.assertEqual(self.new_sandbox().box_id, 90)
+
+    def test_no_service(self):
+        self.file_cacher = Mock(service=None)
+        with use_slot(2):
+            self.assertEqual(self.new_sandbox().box_id, 0)
+
+
 if __name__ == "__main__":
     unittest.main()
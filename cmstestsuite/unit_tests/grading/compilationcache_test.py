@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the compilation cache.
+
+"""
+
+import unittest
+from unittest.mock import Mock, patch
+
+from sqlalchemy.exc import OperationalError
+
+# Needs to be first to allow for monkey patching the DB connection string.
+from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
+
+from cms.db import CompilationCacheEntry, Executable, File, Manager
+from cms.grading.Job import CompilationJob
+from cms.grading.compilationcache import get_cache_key, load_from_cache, \
+    store_in_cache
+from cms.grading.steps import COMPILATION_MESSAGES
+from cms.service.esoperations import ESOperation
+
+
+LANGUAGES = {
+    "C11 / gcc": Mock(source_extensions=[".c"], header_extensions=[".h"],
+                      object_extensions=[".o"]),
+    "C++11 / g++": Mock(source_extensions=[".cpp"],
+                        header_extensions=[".h"],
+                        object_extensions=[".o"]),
+}
+
+
+class TestCompilationCache(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("cms.grading.compilationcache.get_language",
+                        LANGUAGES.__getitem__)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        self.dataset = self.add_dataset()
+        self.session.commit()
+
+    def tearDown(self):
+        self.delete_data()
+        super().tearDown()
+
+    def job(self, source="0" * 40, language="C11 / gcc", managers=None,
+            **kwargs):
+        if managers is None:
+            managers = {"grader.c": "1" * 40, "checker": "2" * 40}
+        return CompilationJob(
+            operation=ESOperation(ESOperation.COMPILATION, 1,
+                                  self.dataset.id),
+            task_type="Batch",
+            task_type_parameters=["grader", ["", ""], "diff"],
+            language=language,
+            files={"foo.%l": File("foo.%l", source)},
+            managers=dict((filename, Manager(filename, digest))
+                          for filename, digest in managers.items()),
+            **kwargs)
+
+    def compiled_job(self, **kwargs):
+        return self.job(
+            success=True, compilation_success=True, text=["OK"],
+            plus={"execution_time": 0.5},
+            executables={"foo": Executable("foo", "3" * 40)}, **kwargs)
+
+    def test_key_stable(self):
+        self.assertEqual(get_cache_key(self.job()), get_cache_key(self.job()))
+
+    def test_key_depends_on_sources(self):
+        key = get_cache_key(self.job())
+        self.assertNotEqual(get_cache_key(self.job(source="4" * 40)), key)
+        self.assertNotEqual(
+            get_cache_key(self.job(language="C++11 / g++")), key)
+        self.assertNotEqual(
+            get_cache_key(self.job(managers={"grader.c": "4" * 40,
+                                             "checker": "2" * 40})),
+            key)
+
+    def test_key_ignores_other_managers(self):
+        self.assertEqual(
+            get_cache_key(self.job(managers={"grader.c": "1" * 40,
+                                             "checker": "4" * 40})),
+            get_cache_key(self.job()))
+
+    def test_key_no_language(self):
+        self.assertIsNone(get_cache_key(self.job(language=None)))
+
+    def test_store_and_load(self):
+        self.assertTrue(store_in_cache(self.session, self.compiled_job()))
+
+        job = self.job()
+        self.assertTrue(load_from_cache(self.session, job))
+        self.assertTrue(job.success)
+        self.assertTrue(job.compilation_success)
+        self.assertEqual(job.text, ["OK"])
+        self.assertEqual(job.plus, {"execution_time": 0.5})
+        self.assertEqual(list(job.executables), ["foo"])
+        self.assertEqual(job.executables["foo"].digest, "3" * 40)
+
+        self.assertFalse(load_from_cache(self.session,
+                                         self.job(source="4" * 40)))
+
+    def test_store_twice(self):
+        self.assertTrue(store_in_cache(self.session, self.compiled_job()))
+        self.assertFalse(store_in_cache(self.session, self.compiled_job()))
+        self.assertEqual(
+            self.session.query(CompilationCacheEntry).count(), 1)
+
+    def test_load_database_error(self):
+        self.assertTrue(store_in_cache(self.session, self.compiled_job()))
+        job = self.job()
+        with patch.object(self.session, "query",
+                          side_effect=OperationalError("", {}, None)):
+            self.assertFalse(load_from_cache(self.session, job))
+        self.assertIsNone(job.success)
+
+    def test_store_database_error(self):
+        with patch.object(self.session, "commit",
+                          side_effect=OperationalError("", {}, None)):
+            self.assertFalse(
+                store_in_cache(self.session, self.compiled_job()))
+        self.assertEqual(
+            self.session.query(CompilationCacheEntry).count(), 0)
+
+    def test_not_stored(self):
+        self.assertFalse(store_in_cache(self.session, self.job(success=False)))
+        timeout = self.job(
+            success=True, compilation_success=False,
+            text=[COMPILATION_MESSAGES.get("timeout").message],
+            plus={}, executables={})
+        self.assertFalse(store_in_cache(self.session, timeout))
+        self.assertEqual(
+            self.session.query(CompilationCacheEntry).count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,6 +19,7 @@
 """Tests for the GroupMin score type."""
 
 import unittest
+from unittest.mock import patch
 
 from cms.grading.scoretypes.GroupMin import GroupMin
 from cmstestsuite.unit_tests.grading.scoretypes.scoretypetestutils \
@@ -157,6 +158,42 @@ class TestGroupMin(ScoreTypeTestMixin, unittest.TestCase):
         self.assertComputeScore(gmin.compute_score(sr),
                                 s2 + s3 * 0.1, 0.0, [0, s2, s3 * 0.1])
 
+    def test_irrelevant_testcases(self):
+        parameters = [[10, "1_*"], [30, "2_*"], [60, "[23]_*"]]
+        gmin = GroupMin(parameters, self._public_testcases)
+
+        self.assertEqual(gmin.get_irrelevant_testcases({}), set())
+        self.assertEqual(
+            gmin.get_irrelevant_testcases({"1_0": 0.0}), {"1_1"})
+        self.assertEqual(
+            gmin.get_irrelevant_testcases({"1_0": 0.5}), set())
+        # 3_0 settles the third subtask, but not the second one, that
+        # also contains 2_1.
+        self.assertEqual(
+            gmin.get_irrelevant_testcases({"3_0": 0.0}), {"3_1"})
+        self.assertEqual(
+            gmin.get_irrelevant_testcases({"3_0": 0.0, "2_0": 0.0}),
+            {"2_1", "3_1"})
+
+    def test_irrelevant_testcases_private_outcomes(self):
+        """Private outcomes do not make public testcases irrelevant."""
+        gmin = GroupMin([[100, "2_*"]], self._public_testcases)
+        self.assertEqual(gmin.get_irrelevant_testcases({"2_1": 0.0}), set())
+        self.assertEqual(gmin.get_irrelevant_testcases({"2_0": 0.0}), {"2_1"})
+
+    def test_irrelevant_testcases_settled_once(self):
+        """Each group is checked once for the public outcomes and once
+        for all of them, however many testcases it has.
+
+        """
+        parameters = [[10, "1_*"], [30, "2_*"], [60, "[23]_*"]]
+        gmin = GroupMin(parameters, self._public_testcases)
+        with patch.object(GroupMin, "is_settled",
+                          autospec=True, return_value=True) as is_settled:
+            self.assertEqual(gmin.get_irrelevant_testcases({}),
+                             set(self._public_testcases))
+        self.assertEqual(is_settled.call_count, 2 * len(parameters))
+
 
 if __name__ == "__main__":
     unittest.main()
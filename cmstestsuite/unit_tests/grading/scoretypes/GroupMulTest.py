@@ -157,6 +157,10 @@ class TestGroupMul(ScoreTypeTestMixin, unittest.TestCase):
                                 s2 + s3 * 0.5 * 0.1, 0.0,
                                 [0, s2, s3 * 0.5 * 0.1])
 
+    def test_irrelevant_testcases(self):
+        gmul = GroupMul([[40, "1_*"], [60, "3_*"]], self._public_testcases)
+        self.assertEqual(
+            gmul.get_irrelevant_testcases({"1_0": 0.5, "3_0": 0.0}), {"3_1"})
 
 if __name__ == "__main__":
     unittest.main()
@@ -173,6 +173,16 @@ class TestGroupThreshold(ScoreTypeTestMixin, unittest.TestCase):
         self.assertComputeScore(st.compute_score(sr),
                                 s2, 0.0, [0, s2, 0])
 
+    def test_irrelevant_testcases(self):
+        gthr = GroupThreshold([[40, "1_*", 10], [60, "3_*", 10]],
+                              self._public_testcases)
+        # 0.0 and values over the threshold fail the subtask.
+        self.assertEqual(
+            gthr.get_irrelevant_testcases({"1_0": 20.0, "3_0": 5.0}),
+            {"1_1"})
+        self.assertEqual(
+            gthr.get_irrelevant_testcases({"1_0": 5.0, "3_0": 0.0}),
+            {"3_1"})
 
 if __name__ == "__main__":
     unittest.main()
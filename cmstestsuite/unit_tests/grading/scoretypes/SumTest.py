@@ -78,6 +78,9 @@ class TestSum(ScoreTypeTestMixin, unittest.TestCase):
         self.assertComputeScore(st.compute_score(sr),
                                 testcase_score * 2.2, testcase_score * 0.2, [])
 
+    def test_irrelevant_testcases(self):
+        sum_ = Sum(100, self._public_testcases)
+        self.assertEqual(sum_.get_irrelevant_testcases({"0": 0.0}), set())
 
 if __name__ == "__main__":
     unittest.main()
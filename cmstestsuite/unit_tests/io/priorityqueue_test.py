@@ -20,13 +20,17 @@
 
 """
 
+import math
+import random
 import unittest
+from unittest.mock import patch
 
 import gevent
 import gevent.event
 import gevent.socket
 
-from cms.io import FakeQueueItem, PriorityQueue
+from cms.io import FairShareQueue, FakeQueueItem, PriorityQueue, \
+    QueueEntry
 from cmscommon.datetime import make_datetime
 
 
@@ -176,5 +180,182 @@ class TestPriorityQueue(unittest.TestCase):
         self.queue._verify()
 
 
+class TestPriorityQueueAging(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.time = 0.0
+        patcher = patch("cms.io.priorityqueue.monotonic_time",
+                        lambda: self.time)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        self.queue = PriorityQueue(aging_interval=10.0)
+
+    def push_at(self, time, title, priority):
+        self.time = time
+        self.queue.push(FakeQueueItem(title), priority,
+                        timestamp=make_datetime(time))
+
+    def test_aging(self):
+        """Test that the waiting items gain one level per interval."""
+        self.push_at(0.0, "low", PriorityQueue.PRIORITY_LOW)
+        self.push_at(5.0, "medium1", PriorityQueue.PRIORITY_MEDIUM)
+        self.push_at(25.0, "medium2", PriorityQueue.PRIORITY_MEDIUM)
+        self.push_at(35.0, "high", PriorityQueue.PRIORITY_HIGH)
+        self.assertTrue(self.queue._verify())
+
+        status = dict((entry["item"]["_title"], entry)
+                      for entry in self.queue.get_status())
+        self.assertEqual(status["low"]["priority"],
+                         PriorityQueue.PRIORITY_LOW)
+        self.assertEqual(status["low"]["effective_priority"], 0)
+        self.assertEqual(status["medium1"]["effective_priority"], -1)
+        self.assertEqual(status["medium2"]["effective_priority"], 1)
+        self.assertEqual(status["high"]["effective_priority"], 1)
+
+        self.assertEqual([str(self.queue.pop().item) for _ in range(4)],
+                         ["medium1", "low", "medium2", "high"])
+
+    def test_set_priority_keeps_age(self):
+        self.push_at(0.0, "a", PriorityQueue.PRIORITY_LOW)
+        self.push_at(20.0, "b", PriorityQueue.PRIORITY_MEDIUM)
+        self.assertEqual(str(self.queue.top().item), "a")
+        self.queue.set_priority(FakeQueueItem("a"),
+                                PriorityQueue.PRIORITY_EXTRA_LOW)
+        self.assertTrue(self.queue._verify())
+        # Now a is as b, but older.
+        self.assertEqual(self.queue.get_status()[0]["effective_priority"],
+                         PriorityQueue.PRIORITY_MEDIUM)
+        self.assertEqual(str(self.queue.top().item), "a")
+        self.queue.set_priority(FakeQueueItem("b"),
+                                PriorityQueue.PRIORITY_HIGH)
+        self.assertEqual(str(self.queue.top().item), "b")
+
+    def test_logarithmic(self):
+        """Test that push, pop and set_priority do O(log n) comparisons.
+
+        The order of the entries does not depend on the current time,
+        so they never need to be reordered all together.
+
+        """
+        comparisons = [0]
+        less_than = QueueEntry.__lt__
+
+        def counting_less_than(entry, other):
+            comparisons[0] += 1
+            return less_than(entry, other)
+
+        rnd = random.Random(0)
+        for size in [1000, 16000]:
+            queue = PriorityQueue(aging_interval=10.0)
+            for i in range(size):
+                self.time = rnd.uniform(0.0, 1000.0)
+                queue.push(FakeQueueItem(str(i)), rnd.randrange(5),
+                           make_datetime(rnd.uniform(0.0, 1000.0)))
+            bound = 2 * math.log2(size) + 2
+            with patch.object(QueueEntry, "__lt__", counting_less_than):
+                for i in range(200):
+                    comparisons[0] = 0
+                    queue.push(FakeQueueItem("new%d" % i), rnd.randrange(5))
+                    self.assertLessEqual(comparisons[0], bound)
+                    entries = queue.get_entries()
+                    item = entries[rnd.randrange(len(entries))].item
+                    comparisons[0] = 0
+                    queue.set_priority(item, rnd.randrange(5))
+                    self.assertLessEqual(comparisons[0], bound)
+                    comparisons[0] = 0
+                    queue.pop()
+                    self.assertLessEqual(comparisons[0], bound)
+            self.assertTrue(queue._verify())
+
+
+class TestFairShareQueue(unittest.TestCase):
+
+    def setUp(self):
+        # The share of an item is the first letter of its title.
+        self.weights = {}
+        self.queue = FairShareQueue(lambda item: str(item)[0],
+                                    lambda share: self.weights.get(share, 1))
+
+    def push(self, titles, priority=PriorityQueue.PRIORITY_MEDIUM):
+        for title in titles.split():
+            self.queue.push(FakeQueueItem(title), priority,
+                            timestamp=make_datetime(int(title[1:])))
+        self.assertTrue(self.queue._verify())
+
+    def pop_all(self, count=None):
+        titles = []
+        while not self.queue.empty() and \
+                (count is None or len(titles) < count):
+            titles.append(str(self.queue.pop().item))
+            self.assertTrue(self.queue._verify())
+        return " ".join(titles)
+
+    def test_round_robin(self):
+        """Test that the shares take turns, regardless of their size."""
+        self.push("a1 a2 a3 a4 b5 c6")
+        self.assertFalse(self.queue.push(FakeQueueItem("a2")))
+        self.assertEqual(len(self.queue), 6)
+        self.assertEqual(str(self.queue.top().item), "a1")
+        self.assertEqual(self.pop_all(), "a1 b5 c6 a2 a3 a4")
+        with self.assertRaises(LookupError):
+            self.queue.pop()
+
+    def test_priority(self):
+        """Test that priorities are still strict."""
+        self.push("a1", PriorityQueue.PRIORITY_HIGH)
+        self.push("a2 b3")
+        self.push("b4", PriorityQueue.PRIORITY_LOW)
+        self.assertEqual(self.pop_all(), "a1 b3 a2 b4")
+
+    def test_weights(self):
+        """Test that the turns are proportional to the weights."""
+        self.weights["a"] = 2
+        self.push("b1 b2 b3 a4 a5 a6 a7 a8 a9")
+        self.assertEqual(self.pop_all(), "b1 a4 a5 b2 a6 a7 b3 a8 a9")
+
+    def test_no_credit_when_idle(self):
+        """Test that a share does not gain turns while not queued."""
+        self.push("a1 a2 a3 a4 a5")
+        self.assertEqual(self.pop_all(3), "a1 a2 a3")
+        self.push("b6 b7 b8")
+        self.assertEqual(self.pop_all(), "b6 a4 b7 a5 b8")
+
+    def test_remove_and_set_priority(self):
+        self.push("a1 a2 b3 b4")
+        self.queue.remove(FakeQueueItem("a1"))
+        self.assertFalse(FakeQueueItem("a1") in self.queue)
+        with self.assertRaises(KeyError):
+            self.queue.remove(FakeQueueItem("a1"))
+        self.queue.set_priority(FakeQueueItem("b4"),
+                                PriorityQueue.PRIORITY_HIGH)
+        self.assertTrue(self.queue._verify())
+        self.assertEqual(len(self.queue.get_entries()), 3)
+        self.assertEqual(self.queue.get_status()[0]["item"],
+                         FakeQueueItem("b4").to_dict())
+        self.assertEqual(self.pop_all(), "b4 a2 b3")
+
+    def test_pop_waiting(self):
+        """Test that pop with waiting works."""
+        greenlet = gevent.spawn(self.queue.pop, wait=True)
+        gevent.sleep(0.01)
+        self.assertFalse(greenlet.ready())
+        self.push("a1")
+        gevent.sleep(0.01)
+        self.assertEqual(str(greenlet.get(timeout=1).item), "a1")
+        self.assertTrue(self.queue._verify())
+
+    def test_aging(self):
+        """Test that the shares compare the effective priorities."""
+        time = [0.0]
+        with patch("cms.io.priorityqueue.monotonic_time", lambda: time[0]):
+            self.queue = FairShareQueue(lambda item: str(item)[0],
+                                        aging_interval=10.0)
+            self.push("a1", PriorityQueue.PRIORITY_LOW)
+            time[0] = 20.0
+            self.push("b2 b3")
+            self.assertEqual(self.pop_all(), "a1 b2 b3")
+
+
 if __name__ == "__main__":
     unittest.main()
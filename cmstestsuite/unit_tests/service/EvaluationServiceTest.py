@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the executor of the evaluation service.
+
+"""
+
+import unittest
+from collections import OrderedDict
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+# Needs to be first to allow for monkey patching the DB connection string.
+import cmstestsuite.unit_tests.databasemixin  # noqa
+
+from cms.io import PriorityQueue, QueueEntry
+from cms.service.EvaluationService import EvaluationExecutor, \
+    EvaluationService
+from cms.service.esoperations import ESOperation
+
+
+class TestEvaluationExecutor(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.service = Mock(shard=0, contest_id=None)
+        self.worker = Mock(connected=True)
+        self.service.connect_to.return_value = self.worker
+        with patch("cms.service.EvaluationService.get_workers",
+                   return_value=[0]):
+            self.executor = EvaluationExecutor(self.service)
+        patcher = patch("cms.service.workerpool.JobGroup")
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+        self.timestamp = datetime(2018, 1, 1, 12, 0, 0)
+        self.operations = [
+            ESOperation(ESOperation.EVALUATION, 1, 1, "001"),
+            ESOperation(ESOperation.EVALUATION, 1, 1, "002")]
+
+    def test_execute(self):
+        """Test that a batch of operations is given to a worker."""
+        self.executor.enqueue(ESOperation(ESOperation.COMPILATION, 2, 1),
+                              PriorityQueue.PRIORITY_LOW, self.timestamp)
+        self.executor.execute([
+            QueueEntry(operation, PriorityQueue.PRIORITY_HIGH,
+                       self.timestamp, i)
+            for i, operation in enumerate(self.operations)])
+
+        self.assertEqual(self.worker.execute_job_group.call_count, 1)
+        for operation in self.operations:
+            self.assertIn(operation, self.executor)
+            self.assertEqual(operation.side_data,
+                             (PriorityQueue.PRIORITY_HIGH, self.timestamp))
+        self.assertCountEqual(self.executor.get_operations(), [
+            (ESOperation(ESOperation.COMPILATION, 2, 1),
+             PriorityQueue.PRIORITY_LOW, self.timestamp),
+            (self.operations[0], PriorityQueue.PRIORITY_HIGH,
+             self.timestamp),
+            (self.operations[1], PriorityQueue.PRIORITY_HIGH,
+             self.timestamp)])
+
+    def test_lost_operations(self):
+        """Test that the operations of a disabled worker keep the data
+        to re-enqueue them.
+
+        """
+        self.executor.execute([
+            QueueEntry(operation, PriorityQueue.PRIORITY_MEDIUM,
+                       self.timestamp, i)
+            for i, operation in enumerate(self.operations)])
+        lost_operations = self.executor.pool.disable_worker(0)
+        self.assertCountEqual(lost_operations, self.operations)
+        for operation in lost_operations:
+            self.assertEqual(operation.side_data,
+                             (PriorityQueue.PRIORITY_MEDIUM, self.timestamp))
+
+
+class TestShares(unittest.TestCase):
+    """Test the cache of the shares of the operations."""
+
+    def setUp(self):
+        super().setUp()
+        # Only the cache of the shares is needed.
+        self.service = EvaluationService.__new__(EvaluationService)
+        self.service._shares = OrderedDict()
+        for target, value in [
+                ("cms.service.EvaluationService.config.evaluation_fair_share",
+                 ["participation"]),
+                ("cms.service.EvaluationService.EvaluationService."
+                 "MAX_CACHED_SHARES", 2)]:
+            patcher = patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        # Cached shares must not need the database.
+        patcher = patch("cms.service.EvaluationService.SessionGen",
+                        side_effect=AssertionError)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def remember(self, submission_id):
+        self.service.remember_share(
+            True, Mock(id=submission_id, participation_id=submission_id,
+                       task_id=1))
+
+    def share(self, submission_id):
+        return self.service.get_operation_share(
+            ESOperation(ESOperation.EVALUATION, submission_id, 1, "001"))
+
+    def test_least_recently_used_evicted(self):
+        self.remember(1)
+        self.remember(2)
+        self.assertEqual(self.share(1), (1,))
+        # 2 is now the least recently used.
+        self.remember(3)
+        self.assertEqual(self.share(1), (1,))
+        self.assertEqual(self.share(3), (3,))
+        with self.assertRaises(AssertionError):
+            self.share(2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,14 +21,15 @@
 
 """
 
+import time
 import unittest
-from unittest.mock import Mock, call
+from unittest.mock import Mock, call, patch
 
 import gevent
 
 import cms.service.Worker
 from cms.grading import JobException
-from cms.grading.Job import JobGroup, EvaluationJob
+from cms.grading.Job import Job, JobGroup, EvaluationJob
 from cms.service.Worker import Worker
 from cms.service.esoperations import ESOperation
 from cmstestsuite.unit_tests.testidgenerator import \
@@ -249,6 +250,112 @@ class TestWorker(unittest.TestCase):
             JobGroup.import_from_dict(
                 self.service.execute_job_group(job_groups[0].export_to_dict()))
 
+    def test_execute_job_group_slots(self):
+        """Executes a job group in parallel slots.
+
+        """
+        with patch("cms.service.Worker.config.worker_slots", 3):
+            self.service = Worker(0)
+        n_jobs = 6
+        job_groups, calls = TestWorker.new_job_groups([n_jobs])
+        task_type = FakeTaskType([0.1] * n_jobs)
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        start = time.monotonic()
+        result = JobGroup.import_from_dict(
+            self.service.execute_job_group(job_groups[0].export_to_dict()))
+        elapsed = time.monotonic() - start
+
+        self.assertTrue(all(job.success for job in result.jobs))
+        cms.service.Worker.get_task_type.assert_has_calls(calls)
+        # Three jobs at a time, so two rounds.
+        self.assertLess(elapsed, 0.1 * n_jobs / 2)
+        self.assertEqual(task_type.max_concurrency, 3)
+        slots = self.service.get_slots_status()
+        self.assertEqual([slot["jobs"] for slot in slots], [2, 2, 2])
+        self.assertTrue(all(slot["operation"] is None for slot in slots))
+
+    def test_execute_job_group_slots_failure(self):
+        """A failing job in a slot makes the group fail, and the other
+        jobs are not started.
+
+        """
+        with patch("cms.service.Worker.config.worker_slots", 2):
+            self.service = Worker(0)
+        job_groups, unused_calls = TestWorker.new_job_groups([5])
+        task_type = FakeTaskType([0.01, Exception(), 0.01, 0.01, 0.01])
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        with self.assertRaises(JobException):
+            self.service.execute_job_group(job_groups[0].export_to_dict())
+        self.assertEqual(task_type.call_count, 2)
+
+    def test_execute_job_group_stream(self):
+        """Streams each job to ES as soon as it is done.
+
+        """
+        self.service.evaluation_service = Mock()
+        job_groups, unused_calls = TestWorker.new_job_groups([3])
+        task_type = FakeTaskType([True, False, True])
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        self.service.execute_job_group(job_groups[0].export_to_dict(),
+                                       stream=True)
+
+        streamed = [
+            Job.import_from_dict_with_type(kwargs["job_dict"])
+            for unused_args, kwargs in
+            self.service.evaluation_service.job_finished.call_args_list]
+        self.assertEqual([job.info for job in streamed], ["00", "01", "02"])
+        self.assertEqual([job.success for job in streamed],
+                         [True, False, True])
+
+    def test_execute_job_group_stream_until_failure(self):
+        """Jobs done before a failure are streamed anyway.
+
+        """
+        self.service.evaluation_service = Mock()
+        job_groups, unused_calls = TestWorker.new_job_groups([3])
+        task_type = FakeTaskType([True, Exception(), True])
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        with self.assertRaises(JobException):
+            self.service.execute_job_group(job_groups[0].export_to_dict(),
+                                           stream=True)
+        self.assertEqual(
+            self.service.evaluation_service.job_finished.call_count, 1)
+
+    def test_split_cpus(self):
+        self.assertEqual(Worker._split_cpus([0, 1, 2, 3, 4], 2),
+                         [{0, 1}, {2, 3, 4}])
+        self.assertEqual(Worker._split_cpus([0, 1], 3), [None] * 3)
+
+    # Testing precache_files.
+
+    def test_sort_by_first_use(self):
+        """Managers come first, then testcases in codename order, then
+        the other datasets, then everything else.
+
+        """
+        def dataset(managers, testcases):
+            return Mock(
+                managers=dict((k, Mock(digest=v))
+                              for k, v in managers.items()),
+                testcases=dict((k, Mock(input=i, output=o))
+                               for k, (i, o) in testcases.items()))
+
+        active = dataset({"checker": "m1"},
+                         {"002": ("i2", "o2"), "001": ("i1", "o1")})
+        inactive = dataset({"checker": "m2"}, {"001": ("i3", "o1")})
+        contest = Mock(tasks=[Mock(datasets=[inactive, active],
+                                   active_dataset=active)])
+
+        self.assertEqual(
+            Worker._sort_by_first_use(
+                contest, {"statement", "o2", "i3", "i2", "o1", "i1", "m2",
+                          "m1"}),
+            ["m1", "i1", "o1", "i2", "o2", "m2", "i3", "statement"])
+
     @staticmethod
     def new_jobs(number_of_jobs, prefix=None):
         prefix = prefix if prefix is not None else ""
@@ -288,6 +395,8 @@ class FakeTaskType:
         self.execute_results = execute_results
         self.index = 0
         self.call_count = 0
+        self.concurrency = 0
+        self.max_concurrency = 0
 
     def execute_job(self, job, file_cacher):
         self.call_count += 1
@@ -302,7 +411,11 @@ class FakeTaskType:
         else:
             # Float: wait the number of seconds.
             job.success = True
+            self.concurrency += 1
+            self.max_concurrency = max(self.max_concurrency,
+                                       self.concurrency)
             gevent.sleep(result)
+            self.concurrency -= 1
 
     def set_results(self, results):
         self.execute_results = results
@@ -26,9 +26,11 @@ import unittest
 # Needs to be first to allow for monkey patching the DB connection string.
 from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
 
+from cms.db import Task
+from cms.grading.steps import EVALUATION_MESSAGES
 from cms.io.priorityqueue import PriorityQueue
 from cms.service.esoperations import ESOperation, get_submissions_operations, \
-    get_user_tests_operations
+    get_user_tests_operations, reuse_evaluations
 
 
 class TestESOperations(DatabaseMixin, unittest.TestCase):
@@ -240,6 +242,47 @@ class TestESOperations(DatabaseMixin, unittest.TestCase):
             set(get_submissions_operations(self.session, self.contest.id)),
             expected_operations)
 
+    def test_get_submissions_operations_min_submission_id(self):
+        """Test that older submissions are ignored if requested."""
+        # An older submission to be compiled.
+        self.add_submission(self.tasks[0], self.participation)
+
+        # A newer submission with results to be evaluated.
+        submission, results = self.add_submission_with_results(
+            self.tasks[0], self.participation, True)
+        self.session.flush()
+        expected_operations = set(
+            self.submission_evaluation_operation(result, codename)
+            for result in results if self.to_judge(result.dataset)
+            for codename in result.dataset.testcases)
+
+        self.assertEqual(
+            set(get_submissions_operations(self.session, self.contest.id,
+                                           submission.id)),
+            expected_operations)
+        self.assertEqual(
+            set(get_submissions_operations(self.session, self.contest.id,
+                                           submission.id + 1)),
+            set())
+
+    def test_get_submissions_operations_task_filter(self):
+        """Test that only the submissions for some tasks are examined if
+        requested.
+
+        """
+        submission = self.add_submission(self.tasks[0], self.participation)
+        self.add_submission(self.tasks[1], self.participation)
+        self.session.flush()
+        expected_operations = set(
+            self.submission_compilation_operation(submission, dataset)
+            for dataset in submission.task.datasets if self.to_judge(dataset))
+
+        self.assertEqual(
+            set(get_submissions_operations(
+                self.session, self.contest.id,
+                task_filter=Task.id == self.tasks[0].id)),
+            expected_operations)
+
     def submission_compilation_operation(
             self, submission, dataset, result=None):
         active_priority = PriorityQueue.PRIORITY_HIGH \
@@ -395,6 +438,23 @@ class TestESOperations(DatabaseMixin, unittest.TestCase):
             set(get_user_tests_operations(self.session, self.contest.id)),
             expected_operations)
 
+    def test_get_user_tests_operations_min_user_test_id(self):
+        """Test that older user tests are ignored if requested."""
+        # An older user test to be compiled.
+        self.add_user_test(self.tasks[0], self.participation)
+
+        # A newer user test with results to be evaluated.
+        user_test, results = self.add_user_test_with_results(True)
+        self.session.flush()
+        expected_operations = set(
+            self.user_test_evaluation_operation(result)
+            for result in results if self.to_judge(result.dataset))
+
+        self.assertEqual(
+            set(get_user_tests_operations(self.session, self.contest.id,
+                                          user_test.id)),
+            expected_operations)
+
     def user_test_compilation_operation(self, user_test, dataset, result=None):
         active_priority = PriorityQueue.PRIORITY_HIGH \
             if result is None or result.compilation_tries == 0 \
@@ -421,5 +481,94 @@ class TestESOperations(DatabaseMixin, unittest.TestCase):
             dataset.task.active_dataset_id == dataset.id)
 
 
+class TestReuseEvaluations(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.participation = self.add_participation()
+        self.task = self.add_task(contest=self.participation.contest)
+        self.old_dataset = self.add_dataset(task=self.task, time_limit=1.0)
+        self.new_dataset = self.add_dataset(task=self.task, time_limit=1.0)
+        for dataset in [self.old_dataset, self.new_dataset]:
+            self.add_manager(dataset, filename="checker", digest="1" * 40)
+            for codename in ["1", "2", "3"]:
+                self.add_testcase(dataset, codename=codename,
+                                  input=codename * 40, output="0" * 40)
+        self.submission, (self.old_result, self.new_result) = \
+            self.add_submission_with_results(self.task, self.participation,
+                                             True)
+        for result in [self.old_result, self.new_result]:
+            self.add_executable(result, filename="foo", digest="2" * 40)
+        for testcase in self.old_dataset.testcases.values():
+            self.add_evaluation(self.old_result, testcase, outcome="1.0",
+                                text=["Output is correct"])
+        self.session.flush()
+
+    def tearDown(self):
+        self.session.close()
+        super().tearDown()
+
+    def reused_codenames(self):
+        return sorted(evaluation.codename
+                      for evaluation in self.new_result.evaluations
+                      if evaluation.reused)
+
+    def test_reuse(self):
+        self.assertEqual(reuse_evaluations(self.new_result), 3)
+        self.assertEqual(self.reused_codenames(), ["1", "2", "3"])
+        for evaluation in self.new_result.evaluations:
+            self.assertEqual(evaluation.outcome, "1.0")
+            self.assertIs(evaluation.testcase,
+                          self.new_dataset.testcases[evaluation.codename])
+        self.session.flush()
+        # Nothing left to copy.
+        self.assertEqual(reuse_evaluations(self.new_result), 0)
+
+    def test_changed_testcase(self):
+        self.new_dataset.testcases["2"].output = "3" * 40
+        self.assertEqual(reuse_evaluations(self.new_result), 2)
+        self.assertEqual(self.reused_codenames(), ["1", "3"])
+
+    def test_already_evaluated(self):
+        self.add_evaluation(self.new_result, self.new_dataset.testcases["1"],
+                            outcome="0.0")
+        self.assertEqual(reuse_evaluations(self.new_result), 2)
+        self.assertEqual(self.reused_codenames(), ["2", "3"])
+
+    def test_skipped_not_reused(self):
+        self.old_result.evaluations[0].text = \
+            [EVALUATION_MESSAGES.get("skipped").message]
+        self.assertEqual(reuse_evaluations(self.new_result), 2)
+
+    def test_different_conditions(self):
+        self.new_dataset.time_limit = 2.0
+        self.assertEqual(reuse_evaluations(self.new_result), 0)
+        self.new_dataset.time_limit = 1.0
+        self.new_dataset.managers["checker"].digest = "3" * 40
+        self.assertEqual(reuse_evaluations(self.new_result), 0)
+        self.new_dataset.managers["checker"].digest = "1" * 40
+        self.new_result.executables["foo"].digest = "3" * 40
+        self.assertEqual(reuse_evaluations(self.new_result), 0)
+
+    def test_not_compiled(self):
+        self.new_result.compilation_outcome = None
+        self.assertEqual(reuse_evaluations(self.new_result), 0)
+
+
+class TestESOperation(unittest.TestCase):
+
+    def test_compact(self):
+        codename = "".join(["00", "1"])
+        operation = ESOperation(ESOperation.EVALUATION, 1, 12345, codename)
+        other = ESOperation.from_dict(operation.to_dict())
+        self.assertFalse(hasattr(operation, "__dict__"))
+        self.assertEqual(other, operation)
+        self.assertIs(other.testcase_codename, operation.testcase_codename)
+        self.assertIs(other.dataset_id, operation.dataset_id)
+        self.assertEqual(operation.to_dict(), {
+            "type": ESOperation.EVALUATION, "object_id": 1,
+            "dataset_id": 12345, "testcase_codename": "001"})
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the partition of the work among the shards of ES."""
+
+import unittest
+from unittest.mock import patch
+
+# Needs to be first to allow for monkey patching the DB connection string.
+from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
+
+from cms import config
+from cms.db import Task
+from cms.service.espartition import get_shard_count, get_task_filter, \
+    get_task_shard, get_worker_shard, get_workers
+
+
+SHARDS = {"EvaluationService": 3, "Worker": 8}
+
+
+class TestESPartition(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("cms.service.espartition.get_service_shards",
+                        SHARDS.get)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        self.contest = self.add_contest()
+        self.tasks = [self.add_task(contest=self.contest) for _ in range(6)]
+        self.other_contest = self.add_contest()
+        self.other_tasks = [self.add_task(contest=self.other_contest)
+                            for _ in range(2)]
+        self.session.flush()
+
+    def tearDown(self):
+        self.delete_data()
+        super().tearDown()
+
+    def query_shard(self, shard):
+        return set(self.session.query(Task)
+                   .filter(Task.id.in_(
+                       task.id for task in self.tasks + self.other_tasks))
+                   .filter(get_task_filter(shard)).all())
+
+    def test_single_shard(self):
+        with patch("cms.service.espartition.get_service_shards",
+                   lambda service: {"Worker": 2}.get(service, 0)):
+            self.assertEqual(get_shard_count(), 1)
+            self.assertEqual(get_task_shard(self.tasks[1]), 0)
+            self.assertEqual(get_workers(0), [0, 1])
+            self.assertEqual(self.query_shard(0),
+                             set(self.tasks + self.other_tasks))
+
+    def test_by_task(self):
+        with patch.object(config, "evaluation_partition", "task"):
+            shards = [self.query_shard(shard) for shard in range(3)]
+            # The shards are a partition of the tasks, consistent with
+            # get_task_shard.
+            self.assertEqual(set().union(*shards),
+                             set(self.tasks + self.other_tasks))
+            for shard, tasks in enumerate(shards):
+                for task in tasks:
+                    self.assertEqual(get_task_shard(task), shard)
+            # Consecutive tasks are spread among the shards.
+            self.assertEqual(
+                set(get_task_shard(task) for task in self.tasks[:3]),
+                {0, 1, 2})
+
+    def test_by_contest(self):
+        with patch.object(config, "evaluation_partition", "contest"):
+            shard = get_task_shard(self.tasks[0])
+            for task in self.tasks:
+                self.assertEqual(get_task_shard(task), shard)
+            self.assertLessEqual(set(self.tasks), self.query_shard(shard))
+            other_shard = get_task_shard(self.other_tasks[0])
+            self.assertNotEqual(other_shard, shard)
+            self.assertLessEqual(set(self.other_tasks),
+                                 self.query_shard(other_shard))
+
+    def test_workers(self):
+        self.assertEqual(get_workers(0), [0, 3, 6])
+        self.assertEqual(get_workers(1), [1, 4, 7])
+        self.assertEqual(get_workers(2), [2, 5])
+        for worker in range(8):
+            self.assertIn(worker, get_workers(get_worker_shard(worker)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the fair share scheduling of ES."""
+
+import unittest
+from unittest.mock import patch
+
+from cms import config
+from cms.service.fairshare import LatencyTracker, get_share, \
+    get_share_weight
+
+
+class TestShares(unittest.TestCase):
+
+    def test_by_participation(self):
+        with patch.object(config, "evaluation_fair_share",
+                          ["participation"]):
+            self.assertEqual(get_share(3, 7), (3,))
+            with patch.object(config, "evaluation_fair_share_weights",
+                              {"participation:3": 2.0, "task:7": 3.0}):
+                self.assertEqual(get_share_weight((3,)), 2.0)
+                self.assertEqual(get_share_weight((4,)), 1.0)
+
+    def test_by_participation_and_task(self):
+        with patch.object(config, "evaluation_fair_share",
+                          ["participation", "task"]):
+            self.assertEqual(get_share(3, 7), (3, 7))
+            with patch.object(config, "evaluation_fair_share_weights",
+                              {"participation:3": 2.0, "task:7": 0.5}):
+                self.assertEqual(get_share_weight((3, 7)), 1.0)
+                self.assertEqual(get_share_weight((3, 8)), 2.0)
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tracker = LatencyTracker()
+
+    def test_first_only(self):
+        self.assertTrue(self.tracker.record(1, 10, 5.0))
+        self.assertFalse(self.tracker.record(1, 10, 50.0))
+        self.assertEqual(self.tracker.get_status(), {
+            "1": {"count": 1, "p50": 5.0, "p95": 5.0, "max": 5.0}})
+
+    def test_percentiles(self):
+        for i in range(100):
+            self.tracker.record(1, i, float(100 - i))
+        self.tracker.record(2, 100, 3.0)
+        status = self.tracker.get_status()
+        self.assertEqual(status["1"], {
+            "count": 100, "p50": 50.0, "p95": 95.0, "max": 100.0})
+        self.assertEqual(status["2"]["p95"], 3.0)
+
+    def test_latest_only(self):
+        with patch.object(LatencyTracker, "MAX_SAMPLES", 3):
+            for i in range(5):
+                self.tracker.record(1, i, float(i))
+        self.assertEqual(self.tracker.get_status()["1"]["count"], 3)
+        self.assertEqual(self.tracker.get_status()["1"]["p50"], 3.0)
+
+    def test_recorded_bounded(self):
+        with patch.object(LatencyTracker, "MAX_RECORDED", 2):
+            for i in range(3):
+                self.tracker.record(1, i, float(i))
+            self.assertEqual(len(self.tracker._recorded), 2)
+            # The oldest object was forgotten, the others were not.
+            self.assertTrue(self.tracker.record(1, 0, 0.0))
+            self.assertFalse(self.tracker.record(1, 2, 0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
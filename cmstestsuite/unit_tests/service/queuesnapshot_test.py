@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the snapshots of the queue of ES."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from cms.io import PriorityQueue
+from cms.service.esoperations import ESOperation
+from cms.service.queuesnapshot import load_queue_snapshot, \
+    save_queue_snapshot
+
+
+PARTITION = (2, "task")
+
+OPERATIONS = [
+    (ESOperation(ESOperation.COMPILATION, 4, 1),
+     PriorityQueue.PRIORITY_HIGH, datetime(2018, 1, 1, 12, 0, 0)),
+    (ESOperation(ESOperation.EVALUATION, 2, 1, "000"),
+     PriorityQueue.PRIORITY_MEDIUM, datetime(2018, 1, 1, 11, 30, 15, 500)),
+    (ESOperation(ESOperation.USER_TEST_COMPILATION, 7, 3),
+     PriorityQueue.PRIORITY_EXTRA_LOW, datetime(2018, 1, 1, 12, 5, 0)),
+]
+
+
+class TestQueueSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.base_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.base_dir, "queue.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        super().tearDown()
+
+    def test_round_trip(self):
+        save_queue_snapshot(self.path, 1, PARTITION, OPERATIONS, 2, None)
+        operations, min_submission_id, min_user_test_id = \
+            load_queue_snapshot(self.path, 1, PARTITION)
+        self.assertEqual(operations, OPERATIONS)
+        self.assertEqual(min_submission_id, 2)
+        self.assertIsNone(min_user_test_id)
+        self.assertEqual(os.listdir(self.base_dir), ["queue.json"])
+
+    def test_overwrite(self):
+        save_queue_snapshot(self.path, None, PARTITION, OPERATIONS, 2, 3)
+        save_queue_snapshot(self.path, None, PARTITION, OPERATIONS[:1], 4, 5)
+        self.assertEqual(load_queue_snapshot(self.path, None, PARTITION),
+                         (OPERATIONS[:1], 4, 5))
+
+    def test_missing(self):
+        self.assertIsNone(load_queue_snapshot(self.path, None, PARTITION))
+
+    def test_other_contest(self):
+        save_queue_snapshot(self.path, 1, PARTITION, OPERATIONS, 2, 3)
+        self.assertIsNone(load_queue_snapshot(self.path, 2, PARTITION))
+        self.assertIsNone(load_queue_snapshot(self.path, None, PARTITION))
+
+    def test_other_partition(self):
+        save_queue_snapshot(self.path, None, PARTITION, OPERATIONS, 2, 3)
+        self.assertIsNone(load_queue_snapshot(self.path, None, (3, "task")))
+        self.assertIsNone(
+            load_queue_snapshot(self.path, None, (2, "contest")))
+
+    def test_invalid(self):
+        with open(self.path, "wt", encoding="utf-8") as f:
+            f.write("{\"version\": 2, \"operations\": [")
+        self.assertIsNone(load_queue_snapshot(self.path, None, PARTITION))
+        with open(self.path, "wt", encoding="utf-8") as f:
+            f.write("{\"version\": 2, \"contest_id\": null}")
+        self.assertIsNone(load_queue_snapshot(self.path, None, PARTITION))
+
+    def test_other_version(self):
+        save_queue_snapshot(self.path, None, PARTITION, OPERATIONS, 2, 3)
+        with open(self.path, "rt", encoding="utf-8") as f:
+            data = f.read()
+        with open(self.path, "wt", encoding="utf-8") as f:
+            f.write(data.replace("\"version\": 2", "\"version\": 1"))
+        self.assertIsNone(load_queue_snapshot(self.path, None, PARTITION))
+
+
+if __name__ == "__main__":
+    unittest.main()
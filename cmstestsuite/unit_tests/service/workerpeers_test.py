@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the distribution of files among workers.
+
+"""
+
+import base64
+import unittest
+from unittest.mock import Mock, patch
+
+import gevent.event
+
+from cms.service.workerpeers import WorkerPeers
+
+
+class FakeWorker:
+    """A remote worker serving chunks of the files in a dict."""
+
+    def __init__(self, files):
+        self.files = files
+        self.connected = True
+        self.remote_service_coord = "FakeWorker"
+
+    def get_file_chunk(self, digest, offset, size):
+        result = gevent.event.AsyncResult()
+        if digest in self.files:
+            result.set(base64.b64encode(
+                self.files[digest][offset:offset + size]).decode("ascii"))
+        else:
+            result.set(None)
+        return result
+
+
+class TestWorkerPeers(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("cms.service.workerpeers.get_service_shards",
+                        return_value=2)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+        # A file bigger than a chunk, whose home is shard 1.
+        self.digest = "1" * 40
+        self.content = bytes(range(256)) * (WorkerPeers.CHUNK_SIZE // 100)
+        self.worker = FakeWorker({self.digest: self.content})
+        service = Mock(shard=0)
+        service.connect_to.return_value = self.worker
+        self.peers = WorkerPeers(service)
+
+    def test_get_home(self):
+        self.assertEqual(self.peers.get_home("0" * 40), 0)
+        self.assertEqual(self.peers.get_home("1" * 40), 1)
+
+    def test_get_file(self):
+        self.assertEqual(self.peers.get_file(self.digest).read(),
+                         self.content)
+
+    def test_get_file_own(self):
+        with self.assertRaises(KeyError):
+            self.peers.get_file("0" * 40)
+
+    def test_get_file_not_connected(self):
+        self.worker.connected = False
+        with self.assertRaises(KeyError):
+            self.peers.get_file(self.digest)
+
+    def test_get_file_missing(self):
+        with self.assertRaises(KeyError):
+            self.peers.get_file("3" * 40).read()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the worker pool.
+
+"""
+
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+
+from cms import ServiceCoord
+from cms.service.esoperations import ESOperation
+from cms.service.workerpool import OperationDurations, WorkerAffinity, \
+    WorkerPool
+
+
+def compilation(submission_id, dataset_id=1):
+    return ESOperation(ESOperation.COMPILATION, submission_id, dataset_id)
+
+
+def evaluation(submission_id, codename, dataset_id=1):
+    return ESOperation(ESOperation.EVALUATION, submission_id, dataset_id,
+                       codename)
+
+
+class TestWorkerAffinity(unittest.TestCase):
+
+    def setUp(self):
+        self.affinity = WorkerAffinity()
+
+    def test_no_affinity(self):
+        self.assertEqual(self.affinity.get_scores([compilation(1)]), {})
+
+    def test_compiling_worker_preferred(self):
+        self.affinity.record(0, [compilation(1)])
+        self.affinity.record(1, [compilation(2)])
+        scores = self.affinity.get_scores([evaluation(1, "001")])
+        self.assertGreater(scores[0], scores[1])
+
+    def test_holders(self):
+        self.affinity.record(0, [compilation(1)])
+        self.affinity.record(1, [compilation(2)])
+        # Worker 1 worked on the dataset, but not on submission 1.
+        self.assertEqual(self.affinity.get_holders([evaluation(1, "001")]),
+                         {0})
+        self.assertEqual(self.affinity.get_holders([compilation(3)]), set())
+
+    def test_other_datasets_ignored(self):
+        self.affinity.record(0, [compilation(1, dataset_id=2)])
+        self.assertEqual(self.affinity.get_scores([evaluation(1, "001")]),
+                         {})
+
+    def test_recent_workers_per_dataset(self):
+        for shard in range(WorkerAffinity.WORKERS_PER_DATASET + 1):
+            self.affinity.record(shard, [compilation(shard + 10)])
+        scores = self.affinity.get_scores([compilation(100)])
+        self.assertNotIn(0, scores)
+        self.assertEqual(len(scores), WorkerAffinity.WORKERS_PER_DATASET)
+
+    def test_objects_bounded(self):
+        with patch.object(WorkerAffinity, "MAX_OBJECTS", 2):
+            for submission_id in range(3):
+                self.affinity.record(submission_id, [
+                    compilation(submission_id, dataset_id=submission_id)])
+        self.assertEqual(
+            self.affinity.get_scores([evaluation(0, "001", dataset_id=0)]),
+            {0: 1})
+
+
+class TestOperationDurations(unittest.TestCase):
+
+    def setUp(self):
+        self.durations = OperationDurations()
+
+    def test_defaults(self):
+        self.assertEqual(
+            self.durations.estimate(compilation(1)),
+            OperationDurations.DEFAULTS[ESOperation.COMPILATION])
+
+    def test_per_dataset_and_type(self):
+        self.durations.record([evaluation(1, "001"), evaluation(1, "002")],
+                              4.0)
+        self.durations.record([compilation(1)], 3.0)
+        self.assertEqual(self.durations.estimate(evaluation(2, "001")), 2.0)
+        self.assertEqual(self.durations.estimate(compilation(2)), 3.0)
+        # Another dataset falls back to the average of the type.
+        self.assertEqual(
+            self.durations.estimate(evaluation(2, "001", dataset_id=2)), 2.0)
+
+    def test_moving_average(self):
+        self.durations.record([evaluation(1, "001")], 1.0)
+        self.durations.record([evaluation(1, "001")], 2.0)
+        self.assertAlmostEqual(self.durations.estimate(evaluation(1, "001")),
+                               1.0 + OperationDurations.ALPHA)
+
+
+class TestWorkerPoolPlacement(unittest.TestCase):
+
+    def setUp(self):
+        service = Mock()
+        service.connect_to.side_effect = \
+            lambda coord, on_connect=None: Mock(connected=True)
+        self.pool = WorkerPool(service)
+        for shard in range(3):
+            self.pool.add_worker(ServiceCoord("Worker", shard))
+
+        for name in ["SessionGen", "JobGroup"]:
+            patcher = patch("cms.service.workerpool.%s" % name, MagicMock())
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        patcher = patch("cms.service.workerpool.config.worker_affinity_wait_s",
+                        10.0)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        self.now = 1000.0
+        patcher = patch("cms.service.workerpool.time.monotonic",
+                        lambda: self.now)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_evaluations_follow_compilation(self):
+        for submission_id in range(3):
+            shard = self.pool.acquire_worker([compilation(submission_id)])
+            self.pool.release_worker(shard)
+            for _ in range(5):
+                self.assertEqual(
+                    self.pool.acquire_worker(
+                        [evaluation(submission_id, "001")]),
+                    shard)
+                self.pool.release_worker(shard)
+        status = self.pool.get_placement_status()
+        self.assertEqual(status["hits"], 15 + 2)
+        self.assertEqual(status["no_affinity"], 1)
+        self.assertEqual(status["hit_rate"], 1.0)
+
+    def test_wait_for_suited_worker(self):
+        self.pool.acquire_worker([compilation(5, dataset_id=9)])
+        busy = self.pool.find_worker([compilation(5, dataset_id=9)])
+
+        # The suited worker is busy: wait for it.
+        operations = [evaluation(5, "001", dataset_id=9)]
+        self.assertIsNone(self.pool.acquire_worker(operations))
+        self.now += 5.0
+        self.assertIsNone(self.pool.acquire_worker(operations))
+
+        # It becomes available in time.
+        self.pool.release_worker(busy)
+        self.assertEqual(self.pool.acquire_worker(operations), busy)
+        self.assertEqual(self.pool.get_placement_status()["waits"], 1)
+
+    def test_no_wait_for_dataset_affinity(self):
+        # Workers that only worked on the same dataset do not hold the
+        # files of other submissions: use the idle workers right away.
+        busy = set()
+        for submission_id in range(3):
+            shard = self.pool.acquire_worker(
+                [evaluation(submission_id, "001", dataset_id=9)])
+            self.assertIsNotNone(shard)
+            self.assertNotIn(shard, busy)
+            busy.add(shard)
+        status = self.pool.get_placement_status()
+        self.assertEqual(status["waits"], 0)
+        self.assertEqual(status["misses"], 2)
+
+    def test_fall_back_after_waiting(self):
+        self.pool.acquire_worker([compilation(5, dataset_id=9)])
+        busy = self.pool.find_worker([compilation(5, dataset_id=9)])
+
+        operations = [evaluation(5, "001", dataset_id=9)]
+        self.assertIsNone(self.pool.acquire_worker(operations))
+        self.now += 11.0
+        shard = self.pool.acquire_worker(operations)
+        self.assertIsNotNone(shard)
+        self.assertNotEqual(shard, busy)
+        status = self.pool.get_placement_status()
+        self.assertEqual(status["misses"], 1)
+        self.assertEqual(status["hit_rate"], 0.0)
+
+    def test_streamed_results(self):
+        operations = [evaluation(1, "001"), evaluation(1, "002")]
+        shard = self.pool.acquire_worker(operations)
+        self.assertTrue(self.pool.accept_streamed_result(shard, operations[0]))
+        # Not twice, nor for other operations or from other workers.
+        self.assertFalse(
+            self.pool.accept_streamed_result(shard, operations[0]))
+        self.assertFalse(
+            self.pool.accept_streamed_result(shard, evaluation(2, "001")))
+        self.assertFalse(self.pool.accept_streamed_result(
+            (shard + 1) % 3, operations[1]))
+        # The streamed operation is not lost with the worker.
+        self.assertEqual(self.pool.disable_worker(shard), [operations[1]])
+
+    def test_count_active_workers(self):
+        self.assertEqual(self.pool.count_active_workers(), 3)
+        self.pool.disable_worker(0)
+        self.pool._worker[1].connected = False
+        self.assertEqual(self.pool.count_active_workers(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -145,6 +145,7 @@ setup(
             "cmsAddTeam=cmscontrib.AddTeam:main",
             "cmsAddTestcases=cmscontrib.AddTestcases:main",
             "cmsAddUser=cmscontrib.AddUser:main",
+            "cmsCheckFiles=cmscontrib.CheckFiles:main",
             "cmsCleanFiles=cmscontrib.CleanFiles:main",
             "cmsComputeComplexity=cmscontrib.ComputeComplexity:main",
             "cmsDumpExporter=cmscontrib.DumpExporter:main",
@@ -152,6 +153,7 @@ setup(
             "cmsDumpUpdater=cmscontrib.DumpUpdater:main",
             "cmsExportSubmissions=cmscontrib.ExportSubmissions:main",
             "cmsImportContest=cmscontrib.ImportContest:main",
+            "cmsMigrateFSStorage=cmscontrib.MigrateFSStorage:main",
             "cmsImportDataset=cmscontrib.ImportDataset:main",
             "cmsImportTask=cmscontrib.ImportTask:main",
             "cmsImportTeam=cmscontrib.ImportTeam:main",